@@ -0,0 +1,158 @@
+# agent/agent_logging.py
+"""Agent 运行日志：结构化 JSON、按轮采样、脱敏、非阻塞。
+
+取代 AgentExecutor(verbose=True) 在请求线程上同步打印整段 Thought/Action/Observation。
+AgentLogHandler 作为 LangChain 回调挂到每轮 /chat 上，每个事件一行 JSON：
+    {"ts", "event", "session_id", "turn_id", "iteration", "tool", "latency_ms", ...}
+事件经 backend.log_pipeline 的有界队列由后台线程写到 stdout（或 AGENT_LOG_FILE）；
+队列满时丢弃并计数，不阻塞请求。
+
+- AGENT_LOG_SAMPLE_RATE：按轮采样比例（0~1），同一轮的事件要么全记要么全不记，错误总是记录；
+- AGENT_LOG_REDACT_KEYS：工具参数里需要脱敏的键，默认 phone_tail,receiver；
+- 观察结果只记录长度和 ok 标志，不记录原文。
+"""
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from backend import log_pipeline
+
+AGENT_LOG_SAMPLE_RATE = float(os.getenv("AGENT_LOG_SAMPLE_RATE", "1.0"))
+AGENT_LOG_REDACT_KEYS = {k.strip() for k in os.getenv("AGENT_LOG_REDACT_KEYS", "phone_tail,receiver").split(",") if k.strip()}
+
+MASK = "***"
+_KV_RE = re.compile(r'("(?:%s)"\s*:\s*)"[^"]*"' % "|".join(map(re.escape, AGENT_LOG_REDACT_KEYS))) if AGENT_LOG_REDACT_KEYS else None
+
+
+def redact(value: Any) -> Any:
+    """dict 按键脱敏；字符串先按 JSON 解析，解析不了就用正则替换 "key": "value"。"""
+    if isinstance(value, dict):
+        return {k: (MASK if k in AGENT_LOG_REDACT_KEYS and v not in (None, "") else redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        s = value.strip()
+        if s.startswith("{"):
+            try:
+                return redact(json.loads(s))
+            except ValueError:
+                pass
+        return _KV_RE.sub(r'\1"%s"' % MASK, value) if _KV_RE else value
+    return value
+
+
+_counts = {"emitted": 0, "sampled_out_turns": 0}
+
+logger = logging.getLogger("smart_mall.agent")
+logger.propagate = False
+
+
+def _ensure_started() -> None:
+    log_pipeline.get_logger(logger.name)
+
+
+def shutdown() -> None:
+    """停止后台写线程并写完队列里剩余的事件。"""
+    log_pipeline.shutdown()
+
+
+def stats() -> Dict[str, int]:
+    return {
+        **_counts,
+        **log_pipeline.queue_stats(),
+        "sample_rate": AGENT_LOG_SAMPLE_RATE,
+    }
+
+
+class AgentLogHandler(BaseCallbackHandler):
+    """一轮 /chat 一个实例。"""
+
+    def __init__(self, session_id: str, turn_id: str, engine: str = "", sample_rate: Optional[float] = None):
+        rate = AGENT_LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.engine = engine
+        self.sampled = rate >= 1 or random.random() < rate
+        if not self.sampled:
+            _counts["sampled_out_turns"] += 1
+        self.iteration = 0
+        self._started: Dict[Any, float] = {}
+        self._tool_names: Dict[Any, str] = {}
+        self._t0 = time.perf_counter()
+        _ensure_started()
+
+    def _emit(self, event: str, force: bool = False, **fields: Any) -> None:
+        if not (self.sampled or force):
+            return
+        rec = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "event": event,
+            "session_id": self.session_id,
+            "turn_id": self.turn_id,
+            "iteration": self.iteration,
+        }
+        if self.engine:
+            rec["engine"] = self.engine
+        rec.update({k: v for k, v in fields.items() if v is not None})
+        _counts["emitted"] += 1
+        logger.log(logging.ERROR if event.endswith("_error") else logging.INFO, rec)
+
+    def _elapsed(self, run_id: Any) -> Optional[int]:
+        t = self._started.pop(run_id, None)
+        return int((time.perf_counter() - t) * 1000) if t is not None else None
+
+    # ---- LLM ----
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self.iteration += 1
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._emit("llm_end", latency_ms=self._elapsed(run_id))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._emit("llm_error", force=True, latency_ms=self._elapsed(run_id), error=f"{type(error).__name__}: {error}")
+
+    # ---- 工具 ----
+    def on_agent_action(self, action: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._emit("agent_action", tool=getattr(action, "tool", None), tool_input=redact(getattr(action, "tool_input", None)))
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+        self._tool_names[run_id] = (serialized or {}).get("name") or kwargs.get("name") or ""
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        # ReAct 引擎这里拿到的是 str(Observation)，payload 已丢失，从精简文本开头判断 ok
+        payload = getattr(output, "payload", None)
+        if isinstance(payload, dict):
+            ok = payload.get("ok")
+        else:
+            text = str(output)
+            ok = text.startswith('{"ok":true') if text.startswith('{"ok":') else None
+        self._emit(
+            "tool_end",
+            tool=self._tool_names.pop(run_id, None) or kwargs.get("name"),
+            latency_ms=self._elapsed(run_id),
+            ok=ok,
+            output_chars=len(str(output)),
+        )
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._emit("tool_error", force=True, tool=self._tool_names.pop(run_id, None),
+                   latency_ms=self._elapsed(run_id), error=f"{type(error).__name__}: {error}")
+
+    # ---- 整轮 ----
+    def on_agent_finish(self, finish: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        output = (getattr(finish, "return_values", None) or {}).get("output", "")
+        self._emit("agent_finish", latency_ms=int((time.perf_counter() - self._t0) * 1000), output_chars=len(str(output)))
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self._emit("agent_error", force=True, latency_ms=int((time.perf_counter() - self._t0) * 1000),
+                       error=f"{type(error).__name__}: {error}")
@@ -0,0 +1,174 @@
+# agent/batch_runner.py
+"""离线批量回放多轮对话（评测 / 改 Prompt、工具后的回归）。
+
+输入 JSONL，每行一段对话：
+    {"id": "c001", "turns": [{"message": "我的订单到哪了", "order_no": "2025..."}, {"message": "能退吗"}]}
+turns 里的元素也可以直接是字符串。
+
+每段对话在独立 session 中按轮次顺序走与 /chat 完全相同的流程（上下文预取、槽位、Agent），
+多段对话在线程池里并发执行。结果逐行追加写入输出 JSONL；重跑时跳过输出文件里已有的 id（断点续跑）。
+
+默认 dry-run：创建售后单、工单、发券等写工具换成不落库的替身，回放几百段对话不会产生真实记录；
+确实要执行写操作时加 --live。
+
+回放的对话记录不进线上的 TRANSCRIPT_SINK：默认不落盘，需要时用 --transcripts 指定单独的 sink
+（格式同 TRANSCRIPT_SINK，如 jsonl:replay_transcripts.jsonl），跑完会把缓冲的记录刷完再退出。
+
+用法：
+    python -m backend.agent.batch_runner convs.jsonl results.jsonl --concurrency 8
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set
+
+from backend.transcripts import TranscriptWriter
+
+
+def load_conversations(path: str) -> List[Dict[str, Any]]:
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            conv = json.loads(line)
+            conv.setdefault("id", f"line{i + 1}")
+            conv["turns"] = [t if isinstance(t, dict) else {"message": t} for t in conv.get("turns") or []]
+            out.append(conv)
+    return out
+
+
+def load_done_ids(path: str) -> Set[str]:
+    """读取已完成的对话 id；末尾写了一半的行直接忽略。"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if "error" not in rec:
+                done.add(str(rec.get("id")))
+    return done
+
+
+def run_conversation(conv: Dict[str, Any], dry_run: bool = True,
+                     transcripts: Optional[TranscriptWriter] = None) -> Dict[str, Any]:
+    """回放一段对话；transcripts 为空时对话记录不落盘。"""
+    from backend.api_server import ChatRequest, SESSIONS, _chat_turn
+    from backend.agent import usage as llm_usage
+    from backend.agent.session_slots import SESSION_SLOTS
+
+    if transcripts is None:
+        transcripts = TranscriptWriter("off")
+    sid = f"batch-{conv['id']}-{uuid.uuid4().hex[:8]}"
+    turns_out = []
+    tools: Counter = Counter()
+    t_conv = time.perf_counter()
+    try:
+        for turn in conv["turns"]:
+            t0 = time.perf_counter()
+            resp = _chat_turn(ChatRequest(
+                session_id=sid,
+                message=turn["message"],
+                product_id=turn.get("product_id"),
+                shop_id=turn.get("shop_id"),
+                order_no=turn.get("order_no"),
+                include_usage=True,
+            ), ip=None, dry_run=dry_run, transcripts=transcripts)
+            turn_tools = [s.tool for s in resp.steps]
+            tools.update(turn_tools)
+            usage = resp.usage or {}
+            turns_out.append({
+                "message": turn["message"],
+                "answer": resp.answer,
+                "tools": turn_tools,
+                "iterations": usage.get("llm_calls", len(resp.steps) + 1),
+                "input_tokens": usage.get("input_tokens", 0),
+                "output_tokens": usage.get("output_tokens", 0),
+                "latency_ms": int((time.perf_counter() - t0) * 1000),
+            })
+    finally:
+        SESSIONS.pop(sid, None)
+        SESSION_SLOTS.pop(sid, None)
+        llm_usage.LEDGER.reset_session(sid)
+
+    return {
+        "id": conv["id"],
+        "turns": turns_out,
+        "tool_calls": sum(tools.values()),
+        "tool_counts": dict(tools),
+        "iterations": sum(t["iterations"] for t in turns_out),
+        "latency_ms": int((time.perf_counter() - t_conv) * 1000),
+    }
+
+
+def run_batch(in_path: str, out_path: str, concurrency: int = 4, resume: bool = True,
+              dry_run: bool = True, transcripts_sink: str = "off") -> Dict[str, Any]:
+    convs = load_conversations(in_path)
+    done = load_done_ids(out_path) if resume else set()
+    todo = [c for c in convs if str(c["id"]) not in done]
+
+    lock = threading.Lock()
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    ok = failed = 0
+    t0 = time.perf_counter()
+    transcripts = TranscriptWriter(transcripts_sink)
+    try:
+        with open(out_path, "a" if resume else "w", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+            futs = {pool.submit(run_conversation, c, dry_run, transcripts): c for c in todo}
+            for fut in as_completed(futs):
+                conv = futs[fut]
+                try:
+                    rec = fut.result()
+                    ok += 1
+                except Exception as e:
+                    rec = {"id": conv["id"], "error": f"{type(e).__name__}: {e}"}
+                    failed += 1
+                with lock:
+                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    out.flush()
+                if "error" in rec:
+                    print(f"[{ok + failed}/{len(todo)}] {rec['id']} ERROR {rec['error']}")
+                else:
+                    print(f"[{ok + failed}/{len(todo)}] {rec['id']} turns={len(rec['turns'])} "
+                          f"tools={rec['tool_calls']} iters={rec['iterations']} {rec['latency_ms']}ms")
+    finally:
+        transcripts.close()
+    return {
+        "total": len(convs),
+        "skipped": len(convs) - len(todo),
+        "ok": ok,
+        "failed": failed,
+        "elapsed_s": round(time.perf_counter() - t0, 2),
+    }
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="批量回放多轮对话")
+    ap.add_argument("input", help="对话 JSONL")
+    ap.add_argument("output", help="结果 JSONL（追加写，支持断点续跑）")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--no-resume", action="store_true", help="忽略已有结果，从头跑并覆盖输出文件")
+    ap.add_argument("--live", action="store_true", help="真实执行写工具（售后单 / 工单 / 发券），默认 dry-run")
+    ap.add_argument("--transcripts", default="off",
+                    help="回放对话记录的 sink（格式同 TRANSCRIPT_SINK），默认 off，不写线上记录")
+    args = ap.parse_args(argv)
+    summary = run_batch(args.input, args.output, args.concurrency, resume=not args.no_resume,
+                        dry_run=not args.live, transcripts_sink=args.transcripts)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,73 @@
+# agent/bench_engines.py
+"""对比 ReAct 与原生函数调用两种 Agent 引擎（需要真实 DASHSCOPE_API_KEY 与数据库）。
+
+指标：每轮平均迭代次数、解析/参数错误率（ReAct 为 _Exception 步骤，函数调用为参数校验失败）、平均/P95 延迟。
+
+用法：
+    python -m backend.agent.bench_engines questions.txt     # 每行一个用户问题
+    python -m backend.agent.bench_engines                   # 使用内置样例
+"""
+import sys
+import time
+from typing import Any, Dict, List
+
+from backend.agent.observation import full_payload
+from backend.agent.react_agent import build_agent, run_agent
+
+SAMPLE_QUESTIONS = [
+    "帮我查一下订单 20251223120000ABCDEF 到哪了",
+    "我的订单 20251223120000ABCDEF 能退货吗？手机尾号 1234",
+    "有没有适合打游戏的便宜手机",
+    "一加15 有什么配置",
+    "快递三天没动了，太慢了，我要投诉",
+]
+
+
+def _is_error_step(action, obs) -> bool:
+    if getattr(action, "tool", "") == "_Exception":
+        return True
+    payload = full_payload(obs)
+    return isinstance(payload, dict) and bool(payload.get("arg_error"))
+
+
+def bench(engine: str, questions: List[str], llm) -> Dict[str, Any]:
+    iterations, errors, steps_total, latencies = [], 0, 0, []
+    for q in questions:
+        executor = build_agent(llm, engine=engine)
+        t0 = time.perf_counter()
+        _, steps = run_agent(executor, q, [])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        # 迭代次数 = 工具步骤数 + 最后一次给出答案的生成
+        iterations.append(len(steps) + 1)
+        steps_total += len(steps)
+        errors += sum(1 for a, o in steps if _is_error_step(a, o))
+    latencies.sort()
+    return {
+        "engine": engine,
+        "turns": len(questions),
+        "avg_iterations": sum(iterations) / len(iterations),
+        "error_rate": errors / steps_total if steps_total else 0.0,
+        "avg_latency_ms": sum(latencies) / len(latencies),
+        "p95_latency_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main(argv: List[str]) -> int:
+    from backend.agent.llm_aliyun import AliyunQwenLLM
+
+    questions = SAMPLE_QUESTIONS
+    if argv:
+        with open(argv[0], "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    llm = AliyunQwenLLM()
+    for engine in ("react", "function_call"):
+        r = bench(engine, questions, llm)
+        print(
+            f"{r['engine']:<14} turns={r['turns']} iters={r['avg_iterations']:.2f} "
+            f"error_rate={r['error_rate']:.1%} avg={r['avg_latency_ms']:.0f}ms p95={r['p95_latency_ms']:.0f}ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,229 @@
+# agent/function_agent.py
+"""DashScope 原生函数调用（function calling）版 Agent。
+
+与文本 ReAct 相比，工具名和参数由模型以结构化 tool_calls 返回，不再依赖
+“Action Input:” 文本解析；参数按 JSON Schema 校验，非法 JSON / 缺少必填项会作为
+明确的错误观察返回给模型，而不是静默变成 {}。
+
+对外接口与 AgentExecutor 保持一致：invoke({"input", "history"}) 返回
+{"output", "intermediate_steps"}，run_agent 和 /chat 无需区分引擎。
+"""
+import hashlib
+import json
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import dashscope
+from langchain.schema import AgentAction, AgentFinish
+from langchain.tools import Tool
+
+from backend.agent.observation import to_observation
+from backend.agent.usage import record_llm_call
+from backend.agent.llm_aliyun import LLM_FLIGHT
+
+
+def _obj(properties: Dict[str, Any], required: List[str]) -> Dict[str, Any]:
+    return {"type": "object", "properties": properties, "required": required, "additionalProperties": False}
+
+
+_STR = {"type": "string"}
+_INT = {"type": "integer"}
+
+# 工具参数 JSON Schema
+TOOL_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "lookup_order": _obj({
+        "order_id": {"type": "string", "description": "订单号"},
+        "phone_tail": {"type": "string", "description": "手机号尾号，用于校验"},
+        "receiver": {"type": "string", "description": "收件人姓名，用于校验"},
+    }, ["order_id"]),
+    "get_tracking": _obj({"tracking_no": {"type": "string", "description": "运单号"}}, ["tracking_no"]),
+    "check_return_eligibility": _obj({"order_id": {"type": "string", "description": "订单号"}}, ["order_id"]),
+    "get_order_insight": _obj({
+        "order_id": {"type": "string", "description": "订单号"},
+        "phone_tail": {"type": "string", "description": "手机号尾号，用于校验"},
+        "receiver": {"type": "string", "description": "收件人姓名，用于校验"},
+        "tracking_no": {"type": "string", "description": "运单号，传了才返回物流轨迹"},
+    }, ["order_id"]),
+    "create_after_sale": _obj({
+        "order_id": {"type": "string", "description": "订单号"},
+        "after_sale_type": {"type": "string", "description": "售后类型，如 退货退款/仅退款/换货"},
+        "reason": _STR,
+    }, ["order_id"]),
+    "create_ticket": _obj({
+        "ticket_type": {"type": "string", "description": "工单类型：投诉/催件/异常升级"},
+        "detail": {"type": "string", "description": "问题描述"},
+        "order_id": _STR,
+        "priority": {"type": "string", "enum": ["P0", "P1", "P2", "P3"]},
+    }, ["ticket_type", "detail"]),
+    "issue_coupon": _obj({
+        "receiver": {"type": "string", "description": "收件人"},
+        "amount": _INT,
+        "reason": _STR,
+        "order_id": {"type": "string", "description": "关联订单号，同一订单限发一张"},
+    }, ["receiver"]),
+    "search_products_by_name": _obj({
+        "name": {"type": "string", "description": "商品名称关键词"},
+        "max_results": _INT,
+    }, ["name"]),
+    "semantic_search_products": _obj({
+        "query": {"type": "string", "description": "用户对商品的自然语言描述"},
+        "max_results": _INT,
+    }, ["query"]),
+    "get_product_detail": _obj({"product_id": {"type": "string", "description": "商品ID"}}, ["product_id"]),
+}
+
+_PY_TYPES = {"string": str, "integer": int, "number": (int, float), "boolean": bool, "object": dict}
+
+
+def validate_args(tool_name: str, raw: Any, defaults: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """解析并校验 tool_calls 里的 arguments，返回 (args, 错误信息)。defaults 用于补齐缺省参数。"""
+    if isinstance(raw, dict):
+        args = dict(raw)
+    else:
+        try:
+            args = json.loads(raw or "{}")
+        except (TypeError, ValueError) as e:
+            return None, f"参数不是合法JSON：{e}"
+    if not isinstance(args, dict):
+        return None, "参数必须是JSON对象"
+    for k, v in (defaults or {}).items():
+        if args.get(k) in (None, ""):
+            args[k] = v
+
+    schema = TOOL_SCHEMAS.get(tool_name)
+    if schema is None:
+        return args, None
+    props = schema["properties"]
+    missing = [k for k in schema["required"] if args.get(k) in (None, "")]
+    if missing:
+        return None, f"缺少必填参数：{', '.join(missing)}"
+    unknown = [k for k in args if k not in props]
+    if unknown:
+        return None, f"未知参数：{', '.join(unknown)}，可用参数：{', '.join(props)}"
+    for k, v in args.items():
+        t = props[k].get("type")
+        if v is not None and t in _PY_TYPES and not isinstance(v, _PY_TYPES[t]):
+            if t == "integer" and isinstance(v, str) and v.strip().isdigit():
+                args[k] = int(v)
+            elif t == "string" and isinstance(v, (int, float)):
+                args[k] = str(v)
+            else:
+                return None, f"参数 {k} 类型应为 {t}"
+    return args, None
+
+
+def _fire(callbacks: List[Any], method: str, *args: Any, **kwargs: Any) -> None:
+    """按 LangChain 回调接口通知 handler；handler 出错不影响本轮对话。"""
+    for cb in callbacks:
+        try:
+            getattr(cb, method)(*args, **kwargs)
+        except Exception:
+            pass
+
+
+class FunctionCallingAgent:
+    def __init__(self, llm, tools: List[Tool], system_prompt: str, max_iterations: int = 6, slots=None):
+        self.llm = llm
+        self.slots = slots
+        self.tools = {t.name: t for t in tools}
+        self.system_prompt = system_prompt
+        self.max_iterations = max_iterations
+        self.tool_specs = [
+            {
+                "type": "function",
+                "function": {
+                    "name": t.name,
+                    "description": t.description,
+                    "parameters": TOOL_SCHEMAS.get(t.name, _obj({}, [])),
+                },
+            }
+            for t in tools
+        ]
+
+    def _generate(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # 与 AliyunQwenLLM 共用 single-flight 分组：相同模型 / 温度 / 消息 / 工具定义的并发调用只打一次上游
+        raw = json.dumps(
+            [getattr(self.llm, "model_name", "qwen-turbo"), getattr(self.llm, "temperature", 0.2), messages, self.tool_specs],
+            ensure_ascii=False, sort_keys=True, default=str,
+        )
+        (message, usage), shared = LLM_FLIGHT.call(hashlib.sha256(raw.encode("utf-8")).hexdigest(),
+                                                   lambda: self._call_upstream(messages))
+        record_llm_call(getattr(self.llm, "model_name", "qwen-turbo"), usage, shared=shared)
+        return message
+
+    def _call_upstream(self, messages: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Any]:
+        resp = dashscope.Generation.call(
+            api_key=getattr(self.llm, "api_key", None) or os.getenv("DASHSCOPE_API_KEY"),
+            model=getattr(self.llm, "model_name", "qwen-turbo"),
+            messages=messages,
+            tools=self.tool_specs,
+            temperature=getattr(self.llm, "temperature", 0.2),
+            result_format="message",
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"DashScope error: {resp}")
+        return resp.output.choices[0]["message"], resp.usage
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        callbacks = list((config or {}).get("callbacks") or [])
+        run_id = uuid.uuid4()
+        try:
+            return self._invoke(inputs, callbacks, run_id)
+        except Exception as e:
+            _fire(callbacks, "on_chain_error", e, run_id=run_id, parent_run_id=None)
+            raise
+
+    def _invoke(self, inputs: Dict[str, Any], callbacks: List[Any], run_id: uuid.UUID) -> Dict[str, Any]:
+        # system 只放静态 SOP（跨会话逐字节一致，可命中前缀缓存），历史与上下文依次追加在后
+        messages: List[Dict[str, Any]] = [{"role": "system", "content": self.system_prompt}]
+        for m in inputs.get("history_messages") or []:
+            if m.get("role") in ("user", "assistant") and m.get("content"):
+                messages.append({"role": m["role"], "content": m["content"]})
+        messages.append({"role": "user", "content": (inputs.get("context") or "") + inputs["input"]})
+        steps: List[Tuple[AgentAction, Any]] = []
+
+        model = getattr(self.llm, "model_name", "qwen-turbo")
+        for _ in range(self.max_iterations):
+            llm_run = uuid.uuid4()
+            _fire(callbacks, "on_llm_start", {"name": model}, [], run_id=llm_run, parent_run_id=run_id)
+            try:
+                msg = self._generate(messages)
+            except Exception as e:
+                _fire(callbacks, "on_llm_error", e, run_id=llm_run, parent_run_id=run_id)
+                raise
+            _fire(callbacks, "on_llm_end", None, run_id=llm_run, parent_run_id=run_id)
+            tool_calls = msg.get("tool_calls") or []
+            if not tool_calls:
+                output = msg.get("content") or ""
+                _fire(callbacks, "on_agent_finish", AgentFinish({"output": output}, output), run_id=run_id)
+                return {"output": output, "intermediate_steps": steps}
+
+            messages.append({"role": "assistant", "content": msg.get("content") or "", "tool_calls": tool_calls})
+            for call in tool_calls:
+                fn = call.get("function") or {}
+                name = fn.get("name", "")
+                raw = fn.get("arguments")
+                tool = self.tools.get(name)
+                tool_input = raw if isinstance(raw, str) else json.dumps(raw or {}, ensure_ascii=False)
+                action = AgentAction(tool=name, tool_input=tool_input, log=msg.get("content") or "")
+                tool_run = uuid.uuid4()
+                _fire(callbacks, "on_agent_action", action, run_id=run_id)
+                _fire(callbacks, "on_tool_start", {"name": name}, tool_input, run_id=tool_run, parent_run_id=run_id)
+                if tool is None:
+                    obs = to_observation(name, {"ok": False, "arg_error": True, "message": f"未知工具 {name}"})
+                else:
+                    defaults = self.slots.defaults_for(name) if self.slots is not None else None
+                    args, err = validate_args(name, raw, defaults)
+                    try:
+                        obs = to_observation(name, {"ok": False, "arg_error": True, "message": err}) if err else tool.func(args)
+                    except Exception as e:
+                        _fire(callbacks, "on_tool_error", e, run_id=tool_run, parent_run_id=run_id)
+                        raise
+                _fire(callbacks, "on_tool_end", obs, run_id=tool_run, parent_run_id=run_id)
+                steps.append((action, obs))
+                messages.append({"role": "tool", "name": name, "content": str(obs)})
+
+        output = "抱歉，这个问题我需要再确认一下，已为您记录，请稍后再试或联系人工客服。"
+        _fire(callbacks, "on_agent_finish", AgentFinish({"output": output}, ""), run_id=run_id)
+        return {"output": output, "intermediate_steps": steps}
@@ -1,33 +1,53 @@
 # agent/llm_aliyun.py
+import hashlib
 import os
-from langchain.llms.base import LLM
-from typing import Optional, List
+from typing import Any, List, Optional, Tuple
+
 import dashscope
+from langchain.llms.base import LLM
+
+from backend.agent.prompt_layout import to_messages
+from backend.agent import usage as llm_usage
+from backend.singleflight import group, LLM_WAIT
+
+# 并发的相同调用（同模型、同温度、同 Prompt）只打一次上游
+LLM_FLIGHT = group("llm", LLM_WAIT)
+
 
 class AliyunQwenLLM(LLM):
-    """阿里云百炼 Qwen LLM 封装"""
+    """阿里云百炼 Qwen LLM 封装（messages 模式，静态前缀单独作为 system 消息）"""
 
     model_name: str = "qwen-turbo"
     temperature: float = 0.2
+    api_key: str = os.getenv("DASHSCOPE_API_KEY", "")
 
     @property
     def _llm_type(self) -> str:
         return "aliyun_qwen"
 
-    def _call(
-        self,
-        prompt: str,
-        stop: Optional[List[str]] = None,
-    ) -> str:
-        response = dashscope.Generation.call(
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        key = (self.model_name, self.temperature, hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        (text, usage), shared = LLM_FLIGHT.call(key, lambda: self._generate_text(prompt))
+        # 用量记在每个拿到结果的调用方自己这一轮上（follower 标记 shared），会话预算与限流退款才算得对
+        llm_usage.record_llm_call(self.model_name, usage, shared=shared)
+
+        if stop:
+            for s in stop:
+                if s and s in text:
+                    text = text.split(s)[0]
+        return text
+
+    def _generate_text(self, prompt: str) -> Tuple[str, Any]:
+        # 静态前缀单独作为 system 消息，便于命中服务端前缀缓存；返回 (文本, usage)，由 _call 记账
+        resp = dashscope.Generation.call(
+            api_key=self.api_key,
             model=self.model_name,
-            prompt=prompt,
+            messages=to_messages(prompt),
             temperature=self.temperature,
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            result_format="text",
+            result_format="message",
         )
 
-        if response.status_code != 200:
-            raise RuntimeError(f"DashScope error: {response}")
+        if resp.status_code != 200:
+            raise RuntimeError(f"DashScope error: {resp}")
 
-        return response.output.text
+        return resp.output.choices[0]["message"]["content"] or "", resp.usage
@@ -0,0 +1,129 @@
+# agent/observation.py
+"""工具观察结果的精简渲染。
+
+工具返回的 dict 原样 str() 后会在后续每轮迭代里反复发给 LLM，其中图片链接、
+长描述、完整物流轨迹对回答几乎没有帮助。这里按工具配置只保留需要的字段、
+截断长文本、压缩物流轨迹，渲染成紧凑 JSON 交给 LLM；完整结果挂在
+Observation.payload 上，/chat 返回给前端的 steps 仍是完整数据。
+
+每个工具可保留的字段可通过环境变量 OBSERVATION_FIELDS（JSON）覆盖，例如：
+    OBSERVATION_FIELDS='{"search_products_by_name": ["product_id", "title", "price"]}'
+"""
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+MAX_TEXT = int(os.getenv("OBSERVATION_MAX_TEXT", "80"))
+MAX_TRACES = int(os.getenv("OBSERVATION_MAX_TRACES", "2"))
+
+# 任何工具里都丢弃的字段
+DROP_KEYS = {"image_url", "carousel_images", "detail_images", "detailed_text"}
+
+# 工具名 -> 商品/订单明细保留的字段；未配置的工具不过滤
+DEFAULT_FIELDS: Dict[str, Optional[List[str]]] = {
+    "search_products_by_name": ["product_id", "title", "category", "price", "specs", "description"],
+    "semantic_search_products": ["product_id", "title", "category", "price", "specs", "description"],
+    "get_product_detail": ["product_id", "shop_id", "title", "category", "price", "specs", "description", "is_active"],
+    "lookup_order": ["product_id", "title", "price", "qty"],
+    "get_order_insight": ["product_id", "title", "price", "qty"],
+}
+
+
+def _load_fields() -> Dict[str, Optional[List[str]]]:
+    fields = dict(DEFAULT_FIELDS)
+    raw = os.getenv("OBSERVATION_FIELDS")
+    if raw:
+        fields.update(json.loads(raw))
+    return fields
+
+
+FIELDS = _load_fields()
+
+_CJK_RE = re.compile(r"[一-鿿　-〿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 数：中文及全角符号约 1 字 1 token，其余约 4 字符 1 token。"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Observation(str):
+    """字符串值是给 LLM 的精简文本，payload 是工具原始返回值。"""
+
+    payload: Any
+    latency_ms: Optional[int] = None
+
+    def __new__(cls, text: str, payload: Any):
+        obj = super().__new__(cls, text)
+        obj.payload = payload
+        return obj
+
+
+def _truncate(s: str) -> str:
+    return s if len(s) <= MAX_TEXT else s[:MAX_TEXT] + "…"
+
+
+def _compact(value: Any, keep: Optional[List[str]]) -> Any:
+    if isinstance(value, dict):
+        # 商品 / 订单明细按工具配置裁剪字段
+        if keep is not None and "product_id" in value:
+            value = {k: value[k] for k in keep if k in value}
+        out = {}
+        for k, v in value.items():
+            if k in DROP_KEYS or v is None or v == "" or v == [] or v == {}:
+                continue
+            if k == "traces" and isinstance(v, list):
+                out["traces_total"] = len(v)
+                v = v[-MAX_TRACES:]
+            out[k] = _compact(v, keep)
+        return out
+    if isinstance(value, list):
+        return [_compact(it, keep) for it in value]
+    if isinstance(value, str):
+        return _truncate(value)
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+def render(tool_name: str, payload: Any) -> str:
+    if isinstance(payload, str):
+        return payload
+    compacted = _compact(payload, FIELDS.get(tool_name))
+    return json.dumps(compacted, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class _Stats:
+    """按工具累计精简前后的估算 token 数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.data: Dict[str, Dict[str, int]] = {}
+
+    def add(self, tool_name: str, before: int, after: int) -> None:
+        with self._lock:
+            d = self.data.setdefault(tool_name, {"calls": 0, "tokens_before": 0, "tokens_after": 0})
+            d["calls"] += 1
+            d["tokens_before"] += before
+            d["tokens_after"] += after
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self.data.items()}
+
+
+STATS = _Stats()
+
+
+def to_observation(tool_name: str, payload: Any) -> Observation:
+    text = render(tool_name, payload)
+    STATS.add(tool_name, estimate_tokens(str(payload)), estimate_tokens(text))
+    return Observation(text, payload)
+
+
+def full_payload(obs: Any) -> Any:
+    """取回工具原始结果（给前端展示用）。"""
+    return getattr(obs, "payload", obs)
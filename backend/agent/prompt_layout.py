@@ -0,0 +1,143 @@
+# agent/prompt_layout.py
+"""面向服务端前缀缓存的 Prompt 布局。
+
+DashScope 对请求开头完全相同的部分做前缀缓存，命中的 token 计费更低、首包更快。
+这里把 Prompt 切成两段：
+- 静态前缀：SOP + 工具目录 + 输出格式说明，同一套工具下逐字节一致，进程内只渲染一次；
+- 易变部分：对话历史 → 本轮商品/订单上下文 → 用户问题 → scratchpad，严格追加在前缀之后。
+
+LLM 调用时用 split_prompt() 把静态前缀单独作为 system 消息发送，
+并用 record_usage() 按 DashScope usage 统计缓存命中 / 未命中的输入 token。
+"""
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+STATIC_TEMPLATE = """
+你可以使用以下工具:
+{tools}
+
+工具使用规范（必须严格输出格式）：
+Thought: 你的思考
+Action: 工具名称（必须是 {tool_names} 之一）
+Action Input: 工具输入（必须是JSON对象字符串）
+Observation: 工具返回结果
+...（如需多次调用工具可重复以上步骤）
+Final Answer: 给用户的最终回复（中文，客服口吻，按模板）
+
+重要提醒：
+- Action Input 必须是 JSON 对象字符串，例如：订单查询时传入键 order_id，可能还需要 phone_tail 或 receiver。
+- 如果缺少必要信息，先在 Final Answer 里追问，不要强行调用工具。
+
+现在开始！
+"""
+
+# 变化越频繁的放越后面：历史按会话追加，上下文每轮不同，scratchpad 每次迭代都变
+VOLATILE_TEMPLATE = """
+对话历史：
+{history}
+
+{context}用户输入：
+{input}
+
+{agent_scratchpad}
+"""
+
+_lock = threading.Lock()
+_prefixes: Dict[str, str] = {}  # sha256 -> 静态前缀
+
+
+def _render_static(sop: str, tools: List[Any]) -> str:
+    from langchain.tools.render import render_text_description
+
+    # 与 create_react_agent 内部 partial 的渲染方式一致，保证和最终 Prompt 逐字节相同
+    return sop + STATIC_TEMPLATE.format(
+        tools=render_text_description(list(tools)),
+        tool_names=", ".join([t.name for t in tools]),
+    )
+
+
+def register_prefix(prefix: str) -> str:
+    digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+    with _lock:
+        _prefixes[digest] = prefix
+    return digest
+
+
+def build_react_prompt(sop: str, tools: List[Any]):
+    """返回给 create_react_agent 用的 PromptTemplate，同时登记渲染后的静态前缀。
+
+    LangChain 在这里才导入：api_server 导入本模块只为 STATS / to_messages，不应拖慢启动。
+    """
+    from langchain.prompts import PromptTemplate
+
+    register_prefix(_render_static(sop, tools))
+    return PromptTemplate.from_template(sop + STATIC_TEMPLATE + VOLATILE_TEMPLATE)
+
+
+def split_prompt(prompt: str) -> Tuple[Optional[str], str]:
+    """命中已登记的静态前缀时返回 (前缀, 剩余部分)，否则 (None, prompt)。"""
+    with _lock:
+        prefixes = list(_prefixes.values())
+    for p in prefixes:
+        if prompt.startswith(p):
+            return p, prompt[len(p):]
+    return None, prompt
+
+
+def to_messages(prompt: str) -> List[Dict[str, str]]:
+    prefix, rest = split_prompt(prompt)
+    if prefix is None:
+        return [{"role": "user", "content": prompt}]
+    return [{"role": "system", "content": prefix}, {"role": "user", "content": rest}]
+
+
+def _get(obj: Any, key: str, default: Any = None) -> Any:
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    try:
+        return obj[key]
+    except (KeyError, TypeError, IndexError):
+        return getattr(obj, key, default)
+
+
+def cached_tokens(usage: Any) -> int:
+    """DashScope usage 里的缓存命中 token：prompt_tokens_details.cached_tokens（无则为 0）。"""
+    details = _get(usage, "prompt_tokens_details")
+    return int(_get(details, "cached_tokens", 0) or 0)
+
+
+class _CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+
+    def add(self, usage: Any) -> None:
+        total = int(_get(usage, "input_tokens", 0) or 0)
+        cached = cached_tokens(usage)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += total
+            self.cached_tokens += cached
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "uncached_tokens": self.input_tokens - self.cached_tokens,
+                "hit_rate": round(self.cached_tokens / self.input_tokens, 4) if self.input_tokens else 0.0,
+                "prefixes": len(_prefixes),
+            }
+
+
+STATS = _CacheStats()
+
+
+def record_usage(usage: Any) -> None:
+    STATS.add(usage)
@@ -1,57 +1,48 @@
 # agent/react_agent.py
 import json
-from typing import List, Dict, Any, Tuple, Union
+import os
+import time
+from typing import List, Dict, Any, Tuple, Union, Callable, Optional
 
 from langchain.agents import AgentExecutor, create_react_agent
-from langchain.prompts import PromptTemplate
 from langchain.tools import Tool
 
+from backend.agent.observation import to_observation
+from backend.agent.prompt_layout import build_react_prompt
+from backend.agent.usage import note_tool
+from backend.agent.session_slots import SessionSlots
+from backend.agent.tool_cache import ToolCache, MISS
 from backend.tools.order_tools import (
     lookup_order,
+    verify_order_identity,
     get_tracking,
     check_return_eligibility,
+    evaluate_return_rules,
+    get_order_insight,
     create_after_sale,
     create_ticket,
     issue_coupon
 )
 from backend.tools.product_tools import (
     search_products_by_name,
-    get_product_detail
+    get_product_detail,
+    semantic_search_products
 )
 
+# Agent 引擎：react / function_call
+AGENT_ENGINE = os.getenv("AGENT_ENGINE", "react")
+# 本地调试时设为 1 恢复 LangChain 的 stdout 打印；线上日志走 agent_logging.AgentLogHandler
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "0") == "1"
+
 # ====== 核心提示词：让它像“真实客服 SOP” ======
-REACT_PROMPT = """你是一个专业、耐心、流程清晰的电商客服智能体。你必须遵循SOP：
+SOP_PROMPT = """你是一个专业、耐心、流程清晰的电商客服智能体。你必须遵循SOP：
 1) 先确认用户诉求（查订单/查物流/退货退款/催件/投诉/商品查询/其他）。
 2) 如信息不足，先追问必要信息（订单号、手机号尾号、收件人、商品名称关键词等）。
 3) 涉及事实信息（订单状态、物流轨迹、是否可退、商品信息）必须调用工具获取，禁止凭空编造。
-4) 当用户询问商品相关信息时，应使用search_products_by_name工具根据商品名称关键词进行查询。
+4) 当用户询问商品相关信息时，应使用search_products_by_name工具根据商品名称关键词进行查询；用户只描述需求/用途而没有明确商品名时，使用semantic_search_products。
 5) 回复模板必须包含：当前进展/结论 + 下一步建议 + 如需补充信息则明确追问。
-6) 对投诉/着急等情绪，先致歉+安抚，再给出动作（如创建工单、发补偿券）。
-
-你可以使用以下工具:
-{tools}
-
-工具使用规范（必须严格输出格式）：
-Thought: 你的思考
-Action: 工具名称（必须是 {tool_names} 之一）
-Action Input: 工具输入（必须是JSON对象字符串）
-Observation: 工具返回结果
-...（如需多次调用工具可重复以上步骤）
-Final Answer: 给用户的最终回复（中文，客服口吻，按模板）
-
-重要提醒：
-- Action Input 必须是 JSON 对象字符串，例如：订单查询时传入键 order_id，可能还需要 phone_tail 或 receiver。
-- 如果缺少必要信息，先在 Final Answer 里追问，不要强行调用工具。
-
-现在开始！
-
-对话历史：
-{history}
-
-用户输入：
-{input}
-
-{agent_scratchpad}
+6) 售后类问题（能不能退、到哪了、订单里有什么）优先用 get_order_insight 一次拿到订单、明细、可退判断和物流，不必分别调用 lookup_order / check_return_eligibility / get_tracking。
+7) 对投诉/着急等情绪，先致歉+安抚，再给出动作（如创建工单、发补偿券）。
 """
 
 
@@ -71,23 +62,132 @@ def _parse_json(s: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
         return {}
 
 
-def build_agent(llm) -> AgentExecutor:
+def _cached(name: str, fn: Callable[..., Any], cache: Optional[ToolCache]) -> Callable[[Any], Any]:
+    """包装只读工具：相同参数优先复用本轮缓存（含 /chat 预取结果）。"""
+    def _run(s):
+        args = _parse_json(s)
+        if cache is None:
+            return fn(**args)
+        hit = cache.get(name, args)
+        if hit is not MISS:
+            return hit
+        result = fn(**args)
+        cache.put(name, args, result)
+        return result
+    return _run
+
+
+def _cached_lookup_order(cache: Optional[ToolCache]) -> Callable[[Any], Any]:
+    """lookup_order 的身份校验可以在缓存的订单上本地完成，无需按校验参数再查一次库。"""
+    run = _cached("lookup_order", lookup_order, cache)
+
+    def _run(s):
+        args = _parse_json(s)
+        if cache is None or not (args.get("phone_tail") or args.get("receiver")):
+            return run(args)
+        base = cache.get("lookup_order", {"order_id": args.get("order_id")})
+        if base is MISS or not base.get("ok"):
+            return run(args)
+        err = verify_order_identity(base["order"], args.get("phone_tail"), args.get("receiver"))
+        if err:
+            return {"ok": False, "message": err, "order": None}
+        return base
+    return _run
+
+
+def _cached_return_eligibility(cache: Optional[ToolCache]) -> Callable[[Any], Any]:
+    """可退判断只看订单状态和下单时间：复用本轮 lookup_order 的结果（没有就查一次并放进缓存），
+    同一轮里订单只查一次库。"""
+    if cache is None:
+        return _cached("check_return_eligibility", check_return_eligibility, None)
+    lookup = _cached("lookup_order", lookup_order, cache)
+
+    def _run(s):
+        args = _parse_json(s)
+        hit = cache.get("check_return_eligibility", args)
+        if hit is not MISS:
+            return hit
+        order_id = args.get("order_id") or ""
+        base = lookup({"order_id": order_id})
+        if base.get("ok"):
+            result = {"ok": True, **evaluate_return_rules(base["order"])}
+        else:
+            result = {"ok": False, "eligible": False, "reason": f"未找到订单 {order_id}"}
+        cache.put("check_return_eligibility", args, result)
+        return result
+    return _run
+
+
+def _compacted(tool: Tool) -> Tool:
+    """工具返回值精简后再交给 LLM，原始结果保留在 Observation.payload。"""
+    func = tool.func
+
+    def _run(s):
+        t0 = time.perf_counter()
+        obs = to_observation(tool.name, func(s))
+        obs.latency_ms = int((time.perf_counter() - t0) * 1000)
+        note_tool(tool.name)
+        return obs
+
+    tool.func = _run
+    return tool
+
+
+def _slotted(tool: Tool, slots: SessionSlots) -> Tool:
+    """缺省参数用会话槽位补齐，工具返回后回填槽位。"""
+    func = tool.func
+
+    def _run(s):
+        args = slots.fill_defaults(tool.name, _parse_json(s))
+        result = func(args)
+        slots.observe(tool.name, args, result)
+        return result
+
+    tool.func = _run
+    return tool
+
+
+# 有副作用的工具（写售后单 / 工单 / 券台账）
+WRITE_TOOLS = ("create_after_sale", "create_ticket", "issue_coupon")
+
+
+def _dry_run_result(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """dry_run 时写工具的替身：返回与真实工具同结构的成功结果，不落库、不占发券额度。"""
+    if name == "create_after_sale":
+        if not lookup_order(args.get("order_id") or "").get("ok"):
+            return {"ok": False, "message": f"未找到订单 {args.get('order_id')}", "after_sale": None}
+        return {"ok": True, "message": "售后单已创建（dry-run，未落库）", "dry_run": True,
+                "after_sale": {"after_sale_id": "DRYRUN", "status": "已创建", **args}}
+    if name == "create_ticket":
+        return {"ok": True, "message": "工单已创建（dry-run，未落库）", "dry_run": True,
+                "ticket": {"ticket_id": "DRYRUN", "status": "处理中", **args}}
+    return {"ok": True, "message": "补偿券已发放（dry-run，未落库）", "dry_run": True,
+            "coupon": {"code": "DRYRUN", "amount": args.get("amount", 10), **args}}
+
+
+def build_tools(tool_cache: Optional[ToolCache] = None, slots: Optional[SessionSlots] = None,
+                dry_run: bool = False) -> List[Tool]:
     tools = [
         Tool(
             name="lookup_order",
-            func=lambda s: lookup_order(**_parse_json(s)),
+            func=_cached_lookup_order(tool_cache),
             description="查询订单。输入JSON键：order_id（必填），phone_tail/receiver（可选用于校验）。返回订单信息或失败原因。"
         ),
         Tool(
             name="get_tracking",
-            func=lambda s: get_tracking(**_parse_json(s)),
+            func=_cached("get_tracking", get_tracking, tool_cache),
             description="查询物流轨迹。输入JSON键：tracking_no（必填）。返回物流节点列表（模拟）。"
         ),
         Tool(
             name="check_return_eligibility",
-            func=lambda s: check_return_eligibility(**_parse_json(s)),
+            func=_cached_return_eligibility(tool_cache),
             description="判断是否可退。输入JSON键：order_id（必填）。返回eligible与reason。"
         ),
+        Tool(
+            name="get_order_insight",
+            func=_cached("get_order_insight", get_order_insight, tool_cache),
+            description="订单综合查询。输入JSON键：order_id（必填），phone_tail/receiver（可选用于校验），tracking_no（可选）。一次返回订单与明细、是否可退及原因、物流轨迹（传了运单号时）。"
+        ),
         Tool(
             name="create_after_sale",
             func=lambda s: create_after_sale(**_parse_json(s)),
@@ -101,27 +201,53 @@ def build_agent(llm) -> AgentExecutor:
         Tool(
             name="issue_coupon",
             func=lambda s: issue_coupon(**_parse_json(s)),
-            description="发放补偿券。输入JSON键：receiver（必填），amount/reason（可选）。返回券码。"
+            description="发放补偿券。输入JSON键：receiver（必填），amount/reason/order_id（可选）。同一收件人、同一订单有发放上限，超限返回失败原因。返回券码。"
         ),
         Tool(
             name="search_products_by_name",
-            func=lambda s: search_products_by_name(**_parse_json(s)),
+            func=_cached("search_products_by_name", search_products_by_name, tool_cache),
             description="根据商品名称模糊查询商品。输入JSON键：name（必填，商品名称关键词），max_results（可选，返回的最大结果数）。返回查询结果列表。"
         ),
+        Tool(
+            name="semantic_search_products",
+            func=_cached("semantic_search_products", semantic_search_products, tool_cache),
+            description="根据自然语言描述检索商品（如“适合打游戏的便宜手机”）。输入JSON键：query（必填，用户描述），max_results（可选）。返回按相关度排序的商品列表。"
+        ),
         Tool(
             name="get_product_detail",
-            func=lambda s: get_product_detail(**_parse_json(s)),
+            func=_cached("get_product_detail", get_product_detail, tool_cache),
             description="根据商品ID查询商品详情。输入JSON键：product_id（必填）。返回商品详细信息。"
         ),
     ]
 
-    prompt = PromptTemplate.from_template(REACT_PROMPT)
+    if dry_run:
+        for t in tools:
+            if t.name in WRITE_TOOLS:
+                t.func = (lambda name: lambda s: _dry_run_result(name, _parse_json(s)))(t.name)
+    if slots is not None:
+        tools = [_slotted(t, slots) for t in tools]
+    return [_compacted(t) for t in tools]
+
+
+def build_agent(llm, tool_cache: Optional[ToolCache] = None, engine: Optional[str] = None,
+                slots: Optional[SessionSlots] = None, dry_run: bool = False):
+    """engine: react（默认，文本 ReAct）/ function_call（DashScope 原生函数调用），不传读 AGENT_ENGINE。
+
+    dry_run=True 时写工具（WRITE_TOOLS）换成不落库的替身，供离线回放使用。
+    """
+    tools = build_tools(tool_cache, slots, dry_run)
+
+    if (engine or AGENT_ENGINE) == "function_call":
+        from backend.agent.function_agent import FunctionCallingAgent
+        return FunctionCallingAgent(llm, tools, system_prompt=SOP_PROMPT, max_iterations=6, slots=slots)
+
+    prompt = build_react_prompt(SOP_PROMPT, tools)
 
     agent = create_react_agent(llm, tools, prompt)
     executor = AgentExecutor(
         agent=agent,
         tools=tools,
-        verbose=True,
+        verbose=AGENT_VERBOSE,
         return_intermediate_steps=True,
         handle_parsing_errors=True,
         max_iterations=6
@@ -129,10 +255,12 @@ def build_agent(llm) -> AgentExecutor:
     return executor
 
 
-def run_agent(executor: AgentExecutor, user_msg: str, history: List[Dict[str, str]]) -> Tuple[str, List[Any]]:
+def run_agent(executor, user_msg: str, history: List[Dict[str, str]], context: str = "",
+              history_window: int = 10, callbacks: Optional[List[Any]] = None) -> Tuple[str, List[Any]]:
+    """context 为本轮商品/订单等请求上下文，放在历史之后、用户问题之前；callbacks 为本轮的 LangChain 回调。"""
     # 历史合并（给模型看）
     hist_lines = []
-    for m in history[-10:]:
+    for m in history[-history_window:]:
         role = m.get("role", "")
         content = m.get("content", "")
         hist_lines.append(f"{role}: {content}")
@@ -140,10 +268,12 @@ def run_agent(executor: AgentExecutor, user_msg: str, history: List[Dict[str, st
 
     merged_input = {
         "input": user_msg,
-        "history": hist_text
+        "history": hist_text,
+        "context": context,
+        "history_messages": history[-history_window:],
     }
 
-    result = executor.invoke(merged_input)
+    result = executor.invoke(merged_input, config={"callbacks": callbacks} if callbacks else None)
     answer = result.get("output", "")
     steps = result.get("intermediate_steps", [])
     return answer, steps
\ No newline at end of file
@@ -0,0 +1,122 @@
+# agent/session_slots.py
+"""会话级结构化槽位记忆。
+
+用户给过的订单号、手机尾号、收件人、运单号、当前商品等信息，原本只以原文形式存在于
+history[-10:] 里，几轮之后就滑出窗口，Agent 会重复追问或重复查询。这里按会话维护一组槽位：
+- 从工具调用参数和返回结果中自动填充；
+- 以一行紧凑文本注入 Prompt 上下文；
+- 只读工具缺参数时作为默认值（售后 / 工单 / 发券等有副作用的工具不补，参数必须由模型显式给出）；
+- 订单身份校验通过后记住，后续轮次查询同一订单不再重复校验。
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# 只读工具参数 -> 默认取值的槽位；补错了最多查错一次，不会落库
+TOOL_DEFAULTS: Dict[str, Dict[str, str]] = {
+    "lookup_order": {"order_id": "order_no"},
+    "check_return_eligibility": {"order_id": "order_no"},
+    "get_order_insight": {"order_id": "order_no", "tracking_no": "tracking_no"},
+    "get_tracking": {"tracking_no": "tracking_no"},
+    "get_product_detail": {"product_id": "product_id"},
+}
+
+# 最多保留的会话数，超出后淘汰最久未使用的（LRU）
+SESSION_SLOTS_MAX = int(os.getenv("SESSION_SLOTS_MAX", "10000"))
+
+_LABELS = [
+    ("order_no", "订单号"),
+    ("phone_tail", "手机尾号"),
+    ("receiver", "收件人"),
+    ("tracking_no", "运单号"),
+    ("product_id", "当前商品"),
+]
+
+
+class SessionSlots:
+    def __init__(self):
+        self.order_no: Optional[str] = None
+        self.phone_tail: Optional[str] = None
+        self.receiver: Optional[str] = None
+        self.tracking_no: Optional[str] = None
+        self.product_id: Optional[str] = None
+        self.verified_orders: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def verified(self) -> bool:
+        return bool(self.order_no and self.verified_orders.get(self.order_no))
+
+    def update(self, **kwargs: Any) -> None:
+        with self._lock:
+            for k, v in kwargs.items():
+                if v not in (None, "") and hasattr(self, k):
+                    setattr(self, k, str(v).strip())
+
+    def defaults_for(self, tool_name: str) -> Dict[str, str]:
+        out = {}
+        for arg, slot in TOOL_DEFAULTS.get(tool_name, {}).items():
+            v = getattr(self, slot)
+            if v:
+                out[arg] = v
+        return out
+
+    def fill_defaults(self, tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        """缺省参数用槽位补齐；已验证过身份的订单去掉校验参数，不再重复校验。"""
+        filled = dict(args)
+        for k, v in self.defaults_for(tool_name).items():
+            if filled.get(k) in (None, ""):
+                filled[k] = v
+        if tool_name in ("lookup_order", "get_order_insight"):
+            order_no = str(filled.get("order_id") or "").strip()
+            if order_no and self.verified_orders.get(order_no):
+                filled.pop("phone_tail", None)
+                filled.pop("receiver", None)
+        return filled
+
+    def observe(self, tool_name: str, args: Dict[str, Any], result: Any) -> None:
+        """根据工具参数与结果更新槽位。"""
+        ok = isinstance(result, dict) and (result.get("ok") or result.get("success"))
+        if tool_name in ("lookup_order", "get_order_insight"):
+            if ok:
+                order_no = result["order"]["order_no"]
+                self.update(order_no=order_no, phone_tail=args.get("phone_tail"), receiver=args.get("receiver"))
+                if args.get("phone_tail") or args.get("receiver"):
+                    with self._lock:
+                        self.verified_orders[order_no] = True
+                if tool_name == "get_order_insight" and result.get("tracking"):
+                    self.update(tracking_no=args.get("tracking_no"))
+        elif tool_name in ("check_return_eligibility", "create_after_sale") and ok:
+            self.update(order_no=args.get("order_id"))
+        elif tool_name == "get_tracking" and ok:
+            self.update(tracking_no=args.get("tracking_no"))
+        elif tool_name == "get_product_detail" and ok:
+            self.update(product_id=args.get("product_id"))
+        elif tool_name == "issue_coupon" and ok:
+            self.update(receiver=args.get("receiver"))
+
+    def render(self) -> str:
+        parts = []
+        for slot, label in _LABELS:
+            v = getattr(self, slot)
+            if v:
+                if slot == "order_no" and self.verified:
+                    v += "（身份已验证）"
+                parts.append(f"{label} {v}")
+        return ("已知会话信息：" + "；".join(parts) + "\n\n") if parts else ""
+
+
+# session_id -> SessionSlots
+SESSION_SLOTS: "OrderedDict[str, SessionSlots]" = OrderedDict()
+_SLOTS_LOCK = threading.Lock()
+
+
+def get_slots(session_id: str, reset: bool = False) -> SessionSlots:
+    with _SLOTS_LOCK:
+        if reset or session_id not in SESSION_SLOTS:
+            SESSION_SLOTS[session_id] = SessionSlots()
+        SESSION_SLOTS.move_to_end(session_id)
+        while len(SESSION_SLOTS) > SESSION_SLOTS_MAX:
+            SESSION_SLOTS.popitem(last=False)
+        return SESSION_SLOTS[session_id]
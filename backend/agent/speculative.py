@@ -0,0 +1,107 @@
+# agent/speculative.py
+"""根据用户消息里的实体投机预取只读工具。
+
+用户常把订单号、运单号直接贴在消息里，Agent 需要先花一次完整的 LLM 迭代才决定调用
+lookup_order / get_tracking。这里在第一次 LLM 调用前用正则抽取实体，把对应的只读工具
+丢进线程池与首次生成并行执行，结果以 Future 形式放进本轮 ToolCache，Agent 调用时直接取用。
+
+命中率 / 浪费率按进程累计，见 STATS。
+"""
+import re
+import threading
+from concurrent.futures import Executor
+from typing import Dict, Iterable, List, Tuple
+
+from backend.agent.tool_cache import ToolCache
+from backend.tools.order_tools import lookup_order, get_tracking, check_return_eligibility
+from backend.tools.product_tools import search_products_by_name
+
+# 订单号：14 位时间戳 + 6 位十六进制（见 api_server._gen_order_no），兼容纯数字长单号
+ORDER_NO_RE = re.compile(r"(?<![0-9A-Za-z])(\d{14}[0-9A-Fa-f]{6}|\d{16,20})(?![0-9A-Za-z])")
+# 运单号：快递公司前缀 + 数字
+TRACKING_NO_RE = re.compile(r"(?<![0-9A-Za-z])((?:SF|YTO|YT|ZTO|STO|JD|EMS|HTKY)\d{8,15})(?![0-9A-Za-z])", re.IGNORECASE)
+# 商品关键词：书名号 / 引号内的短语
+PRODUCT_KEYWORD_RE = re.compile(r"[《「“\"]([^》」”\"]{2,30})[》」”\"]")
+# 出现这些词时才顺带预取退货资格
+RETURN_HINT_RE = re.compile(r"退货|退款|能退|可以退|退换")
+
+MAX_PREFETCH = 4
+
+
+def extract_entities(text: str) -> Dict[str, List[str]]:
+    text = text or ""
+    return {
+        "order_no": list(dict.fromkeys(ORDER_NO_RE.findall(text))),
+        "tracking_no": list(dict.fromkeys(t.upper() for t in TRACKING_NO_RE.findall(text))),
+        "product_keyword": list(dict.fromkeys(k.strip() for k in PRODUCT_KEYWORD_RE.findall(text))),
+    }
+
+
+def plan_calls(text: str, skip: Iterable[Tuple[str, Dict[str, str]]] = ()) -> List[Tuple[str, Dict[str, str]]]:
+    """skip：调用方已经在查的 (工具名, 参数)，不计入 MAX_PREFETCH。"""
+    ents = extract_entities(text)
+    calls: List[Tuple[str, Dict[str, str]]] = []
+    for no in ents["order_no"]:
+        calls.append(("lookup_order", {"order_id": no}))
+        if RETURN_HINT_RE.search(text):
+            calls.append(("check_return_eligibility", {"order_id": no}))
+    for no in ents["tracking_no"]:
+        calls.append(("get_tracking", {"tracking_no": no}))
+    for kw in ents["product_keyword"]:
+        calls.append(("search_products_by_name", {"name": kw}))
+    skip = list(skip)
+    return [c for c in calls if c not in skip][:MAX_PREFETCH]
+
+
+_FUNCS = {
+    "lookup_order": lookup_order,
+    "check_return_eligibility": check_return_eligibility,
+    "get_tracking": get_tracking,
+    "search_products_by_name": search_products_by_name,
+}
+
+
+def prefetch(text: str, cache: ToolCache, pool: Executor, skip: Iterable[Tuple[str, Dict[str, str]]] = ()) -> int:
+    """提交投机预取任务，返回实际提交的数量（已在缓存中的、skip 里的跳过）。"""
+    n = 0
+    for name, args in plan_calls(text, skip):
+        if cache.has(name, args):
+            continue
+        if cache.put_future(name, args, pool.submit(_FUNCS[name], **args)):
+            n += 1
+    return n
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.started = 0
+        self.used = 0
+
+    def add(self, started: int, used: int) -> None:
+        if not started:
+            return
+        with self._lock:
+            self.turns += 1
+            self.started += started
+            self.used += used
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "started": self.started,
+                "used": self.used,
+                "hit_rate": round(self.used / self.started, 4) if self.started else 0.0,
+                "wasted_rate": round((self.started - self.used) / self.started, 4) if self.started else 0.0,
+            }
+
+
+STATS = _Stats()
+
+
+def finish(cache: ToolCache) -> None:
+    """一轮结束后调用，累计本轮预取的命中/浪费。"""
+    s = cache.speculative_stats()
+    STATS.add(s["started"], s["used"])
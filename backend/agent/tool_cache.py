@@ -0,0 +1,87 @@
+# agent/tool_cache.py
+"""单轮对话内的工具结果缓存。
+
+/chat 在 Agent 启动前预取的商品/订单会以“工具观察结果”的形式预置到这里，
+Agent 之后再以相同参数调用同一工具时直接复用，不再多走一次数据库。
+
+也可以放入尚未完成的 Future（投机预取），Agent 取用时等待其结果；
+预取失败则按未命中处理，由 Agent 正常调用工具。
+"""
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+
+MISS = object()
+
+# 等待投机预取结果的最长时间（秒），超时按未命中处理
+SPECULATIVE_WAIT = 5.0
+
+
+class _Speculative:
+    def __init__(self, fut: Future):
+        self.fut = fut
+        self.used = False
+
+
+def _canonical_key(tool_name: str, args: Optional[Dict[str, Any]]) -> str:
+    norm = {}
+    for k, v in (args or {}).items():
+        if v is None:
+            continue
+        norm[k] = v.strip() if isinstance(v, str) else v
+    return tool_name + ":" + json.dumps(norm, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class ToolCache:
+    """按 (工具名, 参数) 缓存工具返回值，线程安全，生命周期为一轮 /chat。"""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.spec_started = 0
+        self.spec_used = 0
+
+    def put(self, tool_name: str, args: Dict[str, Any], value: Any) -> None:
+        with self._lock:
+            self._data[_canonical_key(tool_name, args)] = value
+
+    def put_future(self, tool_name: str, args: Dict[str, Any], fut: Future) -> bool:
+        """放入投机预取任务；该 key 已有结果时不覆盖，返回是否放入。"""
+        key = _canonical_key(tool_name, args)
+        with self._lock:
+            if key in self._data:
+                return False
+            self._data[key] = _Speculative(fut)
+            self.spec_started += 1
+            return True
+
+    def has(self, tool_name: str, args: Dict[str, Any]) -> bool:
+        with self._lock:
+            return _canonical_key(tool_name, args) in self._data
+
+    def get(self, tool_name: str, args: Dict[str, Any]) -> Any:
+        """命中返回缓存值，未命中返回 MISS。"""
+        with self._lock:
+            value = self._data.get(_canonical_key(tool_name, args), MISS)
+            if isinstance(value, _Speculative) and not value.used:
+                value.used = True
+                self.spec_used += 1
+        if isinstance(value, _Speculative):
+            try:
+                value = value.fut.result(timeout=SPECULATIVE_WAIT)
+            except Exception:
+                value = MISS
+        with self._lock:
+            if value is MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def speculative_stats(self) -> Dict[str, int]:
+        """本轮投机预取：总数 / 被 Agent 用到的数量。"""
+        with self._lock:
+            return {"started": self.spec_started, "used": self.spec_used}
@@ -0,0 +1,223 @@
+# agent/usage.py
+"""LLM token 用量与费用统计。
+
+每次 DashScope 调用的 usage 都记到当前轮（TurnUsage）上，再汇总到：
+- 每次 ReAct 迭代（第几次 LLM 调用）；
+- 每轮 / 每个会话；
+- 触发该次调用的工具（上一步执行的工具，第一轮迭代记为 "-"）；
+- 全局按模型、按工具的累计值，以 Prometheus 文本格式导出。
+
+single-flight 合并的调用（shared）同样记到 follower 自己这一轮和会话上（预算、限流退款按它算），
+但不计入按模型的上游用量，单独记为 llm_shared_*，上游实际花费只看 leader。
+
+会话累计 token 超过 SESSION_TOKEN_BUDGET 后进入降级：缩短历史窗口、换用更便宜的模型。
+"""
+import contextvars
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from backend.agent.prompt_layout import cached_tokens, record_usage
+
+# 每千 token 单价（元），可用 LLM_PRICES='{"qwen-plus": [0.0008, 0.002]}' 覆盖
+DEFAULT_PRICES = {
+    "qwen-flash": (0.00015, 0.0015),
+    "qwen-turbo": (0.0003, 0.0006),
+    "qwen-plus": (0.0008, 0.002),
+    "qwen-max": (0.0024, 0.0096),
+}
+PRICES = {**DEFAULT_PRICES, **{k: tuple(v) for k, v in json.loads(os.getenv("LLM_PRICES", "{}")).items()}}
+
+# 每会话 token 预算，0 表示不限制
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "0"))
+DEGRADED_MODEL = os.getenv("LLM_DEGRADED_MODEL", "qwen-flash")
+DEGRADED_HISTORY = int(os.getenv("LLM_DEGRADED_HISTORY", "4"))
+NORMAL_HISTORY = 10
+# 按会话的累计只保留最近活跃的这么多个（LRU），被淘汰的会话预算从 0 重新计
+LEDGER_MAX_SESSIONS = int(os.getenv("LLM_LEDGER_MAX_SESSIONS", "10000"))
+
+
+def _get(obj: Any, key: str) -> int:
+    if obj is None:
+        return 0
+    if isinstance(obj, dict):
+        return int(obj.get(key) or 0)
+    try:
+        return int(obj[key] or 0)
+    except (KeyError, TypeError, IndexError):
+        return int(getattr(obj, key, 0) or 0)
+
+
+def cost_of(model: str, input_tokens: int, output_tokens: int) -> float:
+    pin, pout = PRICES.get(model, PRICES["qwen-turbo"])
+    return input_tokens / 1000 * pin + output_tokens / 1000 * pout
+
+
+class TurnUsage:
+    """一轮 /chat 内所有 LLM 调用。"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.calls: List[Dict[str, Any]] = []
+        self.last_tool = "-"
+
+    def add(self, model: str, usage: Any, shared: bool = False) -> Dict[str, Any]:
+        inp, out = _get(usage, "input_tokens"), _get(usage, "output_tokens")
+        call = {
+            "iteration": len(self.calls) + 1,
+            "model": model,
+            "shared": shared,
+            "tool": self.last_tool,
+            "input_tokens": inp,
+            "output_tokens": out,
+            "cached_tokens": cached_tokens(usage),
+            "cost": round(cost_of(model, inp, out), 6),
+        }
+        self.calls.append(call)
+        return call
+
+    def totals(self) -> Dict[str, Any]:
+        return {
+            "llm_calls": len(self.calls),
+            "input_tokens": sum(c["input_tokens"] for c in self.calls),
+            "output_tokens": sum(c["output_tokens"] for c in self.calls),
+            "cached_tokens": sum(c["cached_tokens"] for c in self.calls),
+            "cost": round(sum(c["cost"] for c in self.calls), 6),
+        }
+
+    def by_tool(self) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for c in self.calls:
+            d = out.setdefault(c["tool"], {"input_tokens": 0, "output_tokens": 0})
+            d["input_tokens"] += c["input_tokens"]
+            d["output_tokens"] += c["output_tokens"]
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.totals(), "iterations": self.calls, "by_tool": self.by_tool()}
+
+
+_current: contextvars.ContextVar[Optional[TurnUsage]] = contextvars.ContextVar("turn_usage", default=None)
+
+
+def begin_turn(session_id: str) -> TurnUsage:
+    turn = TurnUsage(session_id)
+    _current.set(turn)
+    return turn
+
+
+def end_turn(turn: TurnUsage) -> None:
+    _current.set(None)
+    LEDGER.add_turn(turn)
+
+
+def note_tool(tool_name: str) -> None:
+    """工具执行完成后调用，下一次 LLM 调用记到这个工具名下。"""
+    turn = _current.get()
+    if turn is not None:
+        turn.last_tool = tool_name
+
+
+def record_llm_call(model: str, usage: Any, shared: bool = False) -> None:
+    """所有 DashScope 调用统一从这里上报 usage；shared=True 表示结果由 single-flight 的 leader 代为生成。"""
+    if not shared:
+        record_usage(usage)
+    turn = _current.get()
+    call = turn.add(model, usage, shared) if turn is not None else TurnUsage("-").add(model, usage, shared)
+    LEDGER.add_call(call)
+
+
+class _Ledger:
+    """进程内累计：按会话、模型、工具。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sessions: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self.models: Dict[str, Dict[str, float]] = {}
+        self.tools: Dict[str, Dict[str, float]] = {}
+        self.shared: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _bump(d: Dict[str, float], input_tokens: int, output_tokens: int, cost: float) -> None:
+        d["calls"] = d.get("calls", 0) + 1
+        d["input_tokens"] = d.get("input_tokens", 0) + input_tokens
+        d["output_tokens"] = d.get("output_tokens", 0) + output_tokens
+        d["cost"] = d.get("cost", 0.0) + cost
+
+    def add_call(self, call: Dict[str, Any]) -> None:
+        with self._lock:
+            if call.get("shared"):
+                self._bump(self.shared.setdefault(call["model"], {}), call["input_tokens"], call["output_tokens"], call["cost"])
+                return
+            self._bump(self.models.setdefault(call["model"], {}), call["input_tokens"], call["output_tokens"], call["cost"])
+            self._bump(self.tools.setdefault(call["tool"], {}), call["input_tokens"], call["output_tokens"], call["cost"])
+
+    def add_turn(self, turn: TurnUsage) -> None:
+        t = turn.totals()
+        with self._lock:
+            d = self.sessions.setdefault(turn.session_id, {})
+            self.sessions.move_to_end(turn.session_id)
+            d["turns"] = d.get("turns", 0) + 1
+            d["input_tokens"] = d.get("input_tokens", 0) + t["input_tokens"]
+            d["output_tokens"] = d.get("output_tokens", 0) + t["output_tokens"]
+            d["cost"] = d.get("cost", 0.0) + t["cost"]
+            while len(self.sessions) > LEDGER_MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+
+    def session_tokens(self, session_id: str) -> int:
+        with self._lock:
+            d = self.sessions.get(session_id) or {}
+            return int(d.get("input_tokens", 0) + d.get("output_tokens", 0))
+
+    def reset_session(self, session_id: str) -> None:
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def prometheus(self) -> str:
+        lines = [
+            "# TYPE llm_calls_total counter",
+            "# TYPE llm_tokens_total counter",
+            "# TYPE llm_cost_total counter",
+            "# TYPE llm_tool_tokens_total counter",
+            "# TYPE llm_shared_calls_total counter",
+            "# TYPE llm_shared_tokens_total counter",
+        ]
+        with self._lock:
+            for m, d in sorted(self.models.items()):
+                lines.append(f'llm_calls_total{{model="{m}"}} {d["calls"]}')
+                lines.append(f'llm_tokens_total{{model="{m}",kind="input"}} {d["input_tokens"]}')
+                lines.append(f'llm_tokens_total{{model="{m}",kind="output"}} {d["output_tokens"]}')
+                lines.append(f'llm_cost_total{{model="{m}"}} {d["cost"]:.6f}')
+            for t, d in sorted(self.tools.items()):
+                lines.append(f'llm_tool_tokens_total{{tool="{t}",kind="input"}} {d["input_tokens"]}')
+                lines.append(f'llm_tool_tokens_total{{tool="{t}",kind="output"}} {d["output_tokens"]}')
+            for m, d in sorted(self.shared.items()):
+                lines.append(f'llm_shared_calls_total{{model="{m}"}} {d["calls"]}')
+                lines.append(f'llm_shared_tokens_total{{model="{m}",kind="input"}} {d["input_tokens"]}')
+                lines.append(f'llm_shared_tokens_total{{model="{m}",kind="output"}} {d["output_tokens"]}')
+            lines.append(f"llm_sessions {len(self.sessions)}")
+        return "\n".join(lines) + "\n"
+
+
+LEDGER = _Ledger()
+
+
+def check_degraded_model(model: str) -> None:
+    """启动时校验：开了会话预算，降级模型就必须比主模型便宜，否则降级等于没降。
+    ReAct 每次调用的输入（系统提示 + 工具描述 + 历史）远多于输出，按输入:输出 = 10:1 折算单价。"""
+    if not SESSION_TOKEN_BUDGET:
+        return
+    if DEGRADED_MODEL == model or cost_of(DEGRADED_MODEL, 1000, 100) >= cost_of(model, 1000, 100):
+        raise RuntimeError(
+            f"LLM_DEGRADED_MODEL={DEGRADED_MODEL} is not cheaper than {model}; "
+            "set a cheaper model (and LLM_PRICES if it is not built in) or unset SESSION_TOKEN_BUDGET"
+        )
+
+
+def budget_plan(session_id: str, model: str) -> Dict[str, Any]:
+    """按会话已用 token 决定本轮的模型和历史窗口。"""
+    if SESSION_TOKEN_BUDGET and LEDGER.session_tokens(session_id) >= SESSION_TOKEN_BUDGET:
+        return {"degraded": True, "model": DEGRADED_MODEL, "history_window": DEGRADED_HISTORY}
+    return {"degraded": False, "model": model, "history_window": NORMAL_HISTORY}
@@ -5,69 +5,85 @@ from fastapi import HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi import UploadFile, File, Form
 
-from datetime import datetime
-from backend.database import get_conn
+from datetime import date, datetime
+from backend.database import ORDER_LIST_KEY, get_conn, get_read_conn, mark_written, start_replica_health_checker
+from backend.idgen import new_after_sale_no
 
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+import functools
 import os
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 from typing import Dict, List, Optional, Any
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
-# ReAct Agent
-from backend.agent.react_agent import build_agent, run_agent
-
-# 阿里 DashScope
-import dashscope
-from langchain.llms.base import LLM
-
+# ReAct Agent（LangChain / DashScope 部分见 _agent_stack，按需加载）
+from backend.agent.tool_cache import ToolCache
+from backend.agent import speculative
+from backend.agent.session_slots import get_slots
+from backend.agent.observation import full_payload, STATS as OBSERVATION_STATS
+from backend.agent.prompt_layout import STATS as PREFIX_CACHE_STATS
+from backend.agent import usage as llm_usage
+from backend.transcripts import WRITER as TRANSCRIPTS, TranscriptWriter
+from backend.coupons import LEDGER as COUPONS
+from backend import order_admin, checkout, profiler, singleflight, order_stats, log_pipeline
+from backend.order_stats import ORDER_STATS
+from backend.fastjson import FastJSONResponse
+from backend.rowmap import PRODUCT
+from backend.ratelimit import LIMITER, RateLimitMiddleware, client_ip, cost_of, retry_after_header
+from backend.archiver import ARCHIVER
+from backend.tools.order_tools import (
+    lookup_order,
+    load_order_insight,
+    invalidate_order_insight,
+    order_insight_stats,
+    verify_order_identity,
+    get_tracking,
+    ORDER_TABLES,
+)
+from backend.tools.product_tools import get_product_detail
+from backend.tools import product_index
 
 # 阿里云百炼 Key
 DASHSCOPE_API_KEY = "your_dashscope_api_key"
 ALIYUN_MODEL_NAME = "qwen-turbo"
 ALIYUN_TEMPERATURE = 0.2
 
+# 就绪检查里的 LLM 探活：fake 用假 LLM 跑通一轮 Agent（不花 token），real 真实调用一次，off 不检查
+READY_LLM_PING = os.getenv("READY_LLM_PING", "fake")
 
-class AliyunQwenLLM(LLM):
-
-    model_name: str = ALIYUN_MODEL_NAME
-    temperature: float = ALIYUN_TEMPERATURE
 
-    @property
-    def _llm_type(self) -> str:
-        return "aliyun_qwen"
+@functools.lru_cache(maxsize=None)
+def _agent_stack() -> SimpleNamespace:
+    """LangChain / DashScope / Agent 的导入要 2s 左右，首次 /chat 或启动预热时才加载。
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
-        resp = dashscope.Generation.call(
-            api_key=DASHSCOPE_API_KEY,
-            model=self.model_name,
-            prompt=prompt,
-            temperature=self.temperature,
-            result_format="text",
-        )
-
-        if resp.status_code != 200:
-            raise RuntimeError(f"DashScope error: {resp}")
+    进程启动、/health 和不走 Agent 的接口都不受影响；python -m backend.startup_check 检查导入耗时回归。
+    """
+    from backend.agent import agent_logging, react_agent
+    from backend.agent.llm_aliyun import AliyunQwenLLM
 
-        text = resp.output.text or ""
+    return SimpleNamespace(
+        build_agent=react_agent.build_agent,
+        run_agent=react_agent.run_agent,
+        engine=react_agent.AGENT_ENGINE,
+        agent_logging=agent_logging,
+        LLM=AliyunQwenLLM,
+    )
 
-        if stop:
-            for s in stop:
-                if s and s in text:
-                    text = text.split(s)[0]
-        return text
 
-
-app = FastAPI(title="多轮电商客服模拟器（ReAct + Tools）")
+app = FastAPI(title="多轮电商客服模拟器（ReAct + Tools）", default_response_class=FastJSONResponse)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# 访问: http://127.0.0.1:8000/uploads/xxx.jpg
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# 访问: http://127.0.0.1:8000/uploads/xxx.jpg；目录在第一次上传时创建
+app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR, check_dir=False), name="uploads")
 
 
 def _load_json(path: str):
@@ -83,7 +99,7 @@ def get_shop_by_id(shop_id: str):
     return None
 
 def get_product_by_id(product_id: str):
-    with get_conn() as conn:
+    with get_read_conn(product_id) as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT product_id, shop_id, title, category, price, description, specs_json, image_url, carousel_images, detail_images, detailed_text, is_active "
@@ -92,27 +108,7 @@ def get_product_by_id(product_id: str):
             )
             r = cur.fetchone()
             if r:
-                try:
-                    r["specs"] = json.loads(r["specs_json"]) if r.get("specs_json") else {}
-                except Exception:
-                    r["specs"] = {}
-                r.pop("specs_json", None)
-                # Handle JSON fields
-                if r.get("carousel_images"):
-                    try:
-                        r["carousel_images"] = json.loads(r["carousel_images"]) if isinstance(r["carousel_images"], str) else r["carousel_images"]
-                    except:
-                        r["carousel_images"] = []
-                else:
-                    r["carousel_images"] = []
-                if r.get("detail_images"):
-                    try:
-                        r["detail_images"] = json.loads(r["detail_images"]) if isinstance(r["detail_images"], str) else r["detail_images"]
-                    except:
-                        r["detail_images"] = []
-                else:
-                    r["detail_images"] = []
-                return r
+                return PRODUCT(r)
 
     for p in load_products():
         if p["product_id"] == product_id:
@@ -123,6 +119,9 @@ def get_product_by_id(product_id: str):
 # def index():
 #     return FileResponse(os.path.join(BASE_DIR, "web", "index.html"))
 
+# /chat 请求上下文预取用的线程池
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="chat-prefetch")
+
 # session_id -> [{"role":"user|assistant","content":"..."}]
 SESSIONS: Dict[str, List[Dict[str, str]]] = {}
 
@@ -133,30 +132,202 @@ class ChatRequest(BaseModel):
     product_id: Optional[str] = Field(default=None, description="当前商品ID（可选）")
     shop_id: Optional[str] = Field(default=None, description="当前店铺ID（可选）")
     order_no: Optional[str] = Field(default=None, description="当前订单号（可选）")
+    include_usage: bool = Field(default=False, description="是否在响应中返回本轮 token 用量")
 
 class StepItem(BaseModel):
     action: str
     observation: str
+    tool: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     session_id: str
     answer: str
     steps: List[StepItem]
+    usage: Optional[Dict[str, Any]] = None
+
+
+@app.on_event("startup")
+def _start_background_jobs():
+    llm_usage.check_degraded_model(ALIYUN_MODEL_NAME)
+    start_replica_health_checker()
+    TRANSCRIPTS.start()
+    COUPONS.start()
+    ARCHIVER.start()
+    ORDER_STATS.start()
+    _start_warm_up()
+
+
+@app.on_event("shutdown")
+def _stop_background_jobs():
+    TRANSCRIPTS.close()
+    COUPONS.close()
+    ARCHIVER.close()
+    ORDER_STATS.close()
+    log_pipeline.shutdown()  # Agent 日志与后台任务错误共用一条队列，最后刷完
 
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+
+# ========== 就绪检查：库可用、Agent 已构建、LLM 探活通过后 /ready 才返回 200 ==========
+_READY_LOCK = threading.Lock()
+_READY: Dict[str, Any] = {"ready": False, "warming": False, "checks": {}, "warm_seconds": None}
+
+
+def _check_db() -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+    with get_read_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+
+
+def _check_agent() -> None:
+    stack = _agent_stack()
+    stack.build_agent(stack.LLM(model_name=ALIYUN_MODEL_NAME, temperature=ALIYUN_TEMPERATURE, api_key=DASHSCOPE_API_KEY))
+
+
+def _check_llm() -> None:
+    stack = _agent_stack()
+    if READY_LLM_PING == "real":
+        stack.LLM(model_name=ALIYUN_MODEL_NAME, temperature=0, api_key=DASHSCOPE_API_KEY)._call("ping")
+    elif READY_LLM_PING == "fake":
+        from langchain.llms.fake import FakeListLLM
+
+        # 走一遍 Prompt 渲染 + 输出解析 + AgentExecutor，不调用外部接口
+        executor = stack.build_agent(FakeListLLM(responses=["Final Answer: ok"]), engine="react")
+        answer, _ = stack.run_agent(executor, "ping", [])
+        if answer.strip() != "ok":
+            raise RuntimeError(f"unexpected answer: {answer!r}")
+
+
+_READY_CHECKS = [
+    ("db", _check_db),
+    ("product_index", product_index.get_index),
+    ("agent", _check_agent),
+    ("llm", _check_llm),
+]
+
+
+def _warm_up() -> None:
+    t0 = time.perf_counter()
+    for name, fn in _READY_CHECKS:
+        if _READY["checks"].get(name, {}).get("ok"):
+            continue
+        t = time.perf_counter()
+        try:
+            fn()
+            result = {"ok": True}
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        result["ms"] = int((time.perf_counter() - t) * 1000)
+        with _READY_LOCK:
+            _READY["checks"][name] = result
+    with _READY_LOCK:
+        _READY["ready"] = all(_READY["checks"].get(n, {}).get("ok") for n, _ in _READY_CHECKS)
+        _READY["warming"] = False
+        _READY["warm_seconds"] = round(time.perf_counter() - t0, 2)
+
+
+def _start_warm_up() -> None:
+    with _READY_LOCK:
+        if _READY["ready"] or _READY["warming"]:
+            return
+        _READY["warming"] = True
+    threading.Thread(target=_warm_up, name="ready-warm-up", daemon=True).start()
+
+
+@app.get("/ready")
+def ready(response: Response):
+    # 未就绪时返回 503；上次预热失败的检查项会在这里触发重试
+    with _READY_LOCK:
+        state = {**_READY, "checks": dict(_READY["checks"])}
+    if not state["ready"]:
+        _start_warm_up()
+        response.status_code = 503
+    return state
+
+@app.get("/api/admin/observation_stats")
+def api_observation_stats():
+    # 各工具观察结果精简前后的估算 token 数
+    return OBSERVATION_STATS.snapshot()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus 文本格式：按模型 / 触发工具累计的 token 与费用
+    return llm_usage.LEDGER.prometheus()
+
+@app.get("/api/admin/prefetch_stats")
+def api_prefetch_stats():
+    # 投机预取命中率 / 浪费率
+    return speculative.STATS.snapshot()
+
+@app.get("/api/admin/prompt_cache_stats")
+def api_prompt_cache_stats():
+    # 输入 token 中命中服务端前缀缓存的比例
+    return PREFIX_CACHE_STATS.snapshot()
+
+@app.get("/api/admin/coupon_stats")
+def api_coupon_stats():
+    # 补偿券发放 / 拒绝 / 落库 / 号段余量
+    return COUPONS.snapshot()
+
+@app.get("/api/admin/agent_log_stats")
+def api_agent_log_stats():
+    # Agent 结构化日志：已输出 / 采样丢弃的轮次 / 队列满丢弃的事件
+    return _agent_stack().agent_logging.stats()
+
+@app.get("/api/admin/error_stats")
+def api_error_stats():
+    # 后台任务错误计数（组件.事件），明细见结构化日志
+    return log_pipeline.error_stats()
+
+@app.get("/api/admin/singleflight_stats")
+def api_singleflight_stats():
+    # 各分组实际执行 / 被合并 / 等待超时的调用数
+    return singleflight.stats()
+
+@app.get("/api/admin/ratelimit_stats")
+def api_ratelimit_stats():
+    # 各类别放行 / 限流次数与桶参数
+    return LIMITER.snapshot()
+
+@app.get("/api/admin/archive_stats")
+def api_archive_stats():
+    # 冷订单归档：累计 / 最近一轮归档数量与耗时
+    return ARCHIVER.snapshot()
+
+@app.get("/api/admin/order_stats")
+def api_order_stats(date_from: Optional[date] = None, date_to: Optional[date] = None, shop_id: Optional[str] = None):
+    # 看板：区间内订单数 / GMV / 退款率 / 日序列 / 店铺排行 / 售后，读内存快照
+    try:
+        return FastJSONResponse(ORDER_STATS.query(date_from, date_to, shop_id or None))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/order_stats_refresh")
+def api_order_stats_refresh():
+    # 看板快照刷新次数、耗时、最近错误
+    return ORDER_STATS.snapshot()
+
+@app.get("/api/admin/order_insight_stats")
+def api_order_insight_stats():
+    # 订单综合信息缓存命中 / 失效次数
+    return order_insight_stats()
+
 @app.get("/api/shops")
 def api_shops():
     # 数据库中没有shops表，返回空列表
     return []
 
 @app.get("/api/products")
+@profiler.profiled
 def api_products():
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT product_id, shop_id, title, category, price, description, specs_json, image_url, carousel_images, is_active "
@@ -164,62 +335,65 @@ def api_products():
             )
             rows = cur.fetchall()
 
-    for r in rows:
-        try:
-            r["specs"] = json.loads(r["specs_json"]) if r.get("specs_json") else {}
-        except Exception:
-            r["specs"] = {}
-        r.pop("specs_json", None)
-        # Handle carousel images
-        if r.get("carousel_images"):
-            try:
-                r["carousel_images"] = json.loads(r["carousel_images"]) if isinstance(r["carousel_images"], str) else r["carousel_images"]
-            except:
-                r["carousel_images"] = []
-        else:
-            r["carousel_images"] = []
-
-    return rows
+    # 全量商品目录：直接返回 FastJSONResponse，绕开 jsonable_encoder
+    return FastJSONResponse(PRODUCT.many(rows))
 
 @app.get("/api/products/{pid}")
 def api_product_detail(pid: str):
     p = get_product_by_id(pid)
     if not p:
         raise HTTPException(status_code=404, detail="product not found")
-    return p
+    return FastJSONResponse(p)
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    # ====== 内部函数：按订单号查订单 ======
-    def get_order_by_no(order_no: str) -> Optional[Dict[str, Any]]:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
-                    "FROM orders WHERE order_no=%s",
-                    (order_no,),
-                )
-                o = cur.fetchone()
-                if not o:
-                    return None
-                cur.execute(
-                    "SELECT product_id, shop_id, title, price, qty FROM order_items WHERE order_id=%s",
-                    (o["id"],),
-                )
-                o["items"] = cur.fetchall()
-        return o
+@profiler.profiled
+def chat(req: ChatRequest, request: Request):
+    return _chat_turn(req, client_ip(request.scope))
+
+
+def _chat_turn(req: ChatRequest, ip: Optional[str], dry_run: bool = False,
+               transcripts: Optional[TranscriptWriter] = None) -> ChatResponse:
+    """一轮对话。ip 为客户端 IP，用于会话限流与退还令牌；None 表示进程内离线调用（批量回放），不限流。
+    dry_run=True 时售后单 / 工单 / 发券等写工具不落库。
+    transcripts 为本轮对话记录写到哪个 writer，默认线上的 TRANSCRIPTS；批量回放传自己的，不混进线上记录。"""
+    t_start = time.perf_counter()
 
     # 1) session
     sid = req.session_id or str(uuid.uuid4())
+    if ip is not None:
+        wait = LIMITER.hit("session", sid)
+        if wait:
+            LIMITER.refund("chat", ip, cost_of("chat"))
+            raise HTTPException(status_code=429, detail="too many requests for this session",
+                                headers={"Retry-After": retry_after_header(wait)})
     if req.reset or sid not in SESSIONS:
         SESSIONS[sid] = []
+        llm_usage.LEDGER.reset_session(sid)
     history = SESSIONS[sid]
+    slots = get_slots(sid, reset=req.reset)
+    slots.update(order_no=req.order_no, product_id=req.product_id)
+    budget = llm_usage.budget_plan(sid, ALIYUN_MODEL_NAME)
+
+    # 2) 并发预取商品/订单上下文，结果同时预置为工具观察，Agent 复用时不再查库
+    tool_cache = ToolCache()
+    product_fut = _PREFETCH_POOL.submit(get_product_detail, req.product_id) if req.product_id else None
+    order_fut = _PREFETCH_POOL.submit(lookup_order, req.order_no) if req.order_no else None
+
+    # 用户消息里直接贴了订单号/运单号等实体时，投机预取对应只读工具，与首次 LLM 生成并行；
+    # 请求字段里的订单 / 商品上面已经在查，结果稍后预置进 tool_cache，这里跳过免得重复查、误计浪费
+    prefetched = []
+    if req.order_no:
+        prefetched.append(("lookup_order", {"order_id": req.order_no}))
+    if req.product_id:
+        prefetched.append(("get_product_detail", {"product_id": req.product_id}))
+    speculative.prefetch(req.message, tool_cache, _PREFETCH_POOL, skip=prefetched)
 
-    # 2) build llm + agent
-    llm = AliyunQwenLLM(model_name=ALIYUN_MODEL_NAME, temperature=ALIYUN_TEMPERATURE)
-    executor = build_agent(llm)
+    # 3) build llm + agent
+    stack = _agent_stack()
+    llm = stack.LLM(model_name=budget["model"], temperature=ALIYUN_TEMPERATURE, api_key=DASHSCOPE_API_KEY)
+    executor = stack.build_agent(llm, tool_cache=tool_cache, slots=slots, dry_run=dry_run)
 
-    # 3) run
+    # 4) run
     user_msg = req.message.strip()
 
     # ====== 店铺 persona ======
@@ -235,9 +409,11 @@ def chat(req: ChatRequest):
 
     # ====== 商品上下文 ======
     product_ctx = ""
-    if req.product_id:
-        p = get_product_by_id(req.product_id)
+    if product_fut is not None:
+        pr = product_fut.result()
+        p = pr.get("product") if pr.get("success") else None
         if p:
+            tool_cache.put("get_product_detail", {"product_id": req.product_id}, pr)
             product_ctx = (
                 "当前咨询商品信息：\n"
                 f"- 商品ID：{p['product_id']}\n"
@@ -250,12 +426,12 @@ def chat(req: ChatRequest):
 
     # ====== 订单上下文（新增） ======
     order_ctx = ""
-    if req.order_no:
-        o = get_order_by_no(req.order_no)
+    if order_fut is not None:
+        lr = order_fut.result()
+        tool_cache.put("lookup_order", {"order_id": req.order_no}, lr)
+        o = lr.get("order") if lr.get("ok") else None
         if o:
             created_at = o.get("created_at")
-            if hasattr(created_at, "isoformat"):
-                created_at = created_at.isoformat(sep=" ", timespec="seconds")
 
             order_ctx = (
                 "当前咨询订单信息：\n"
@@ -280,23 +456,75 @@ def chat(req: ChatRequest):
                 "- 说明：未在系统中找到该订单\n\n"
             )
 
-    merged_user_msg = f"{system_prefix}{product_ctx}{order_ctx}用户问题：{user_msg}"
+    request_ctx = f"{system_prefix}{slots.render()}{product_ctx}{order_ctx}"
 
-    history.append({"role": "user", "content": user_msg})
+    turn_id = uuid.uuid4().hex
+    log_handler = stack.agent_logging.AgentLogHandler(session_id=sid, turn_id=turn_id, engine=stack.engine)
+    turn_usage = llm_usage.begin_turn(sid)
+    try:
+        answer, intermediate_steps = stack.run_agent(
+            executor, user_msg, history, context=request_ctx, history_window=budget["history_window"],
+            callbacks=[log_handler],
+        )
+    finally:
+        llm_usage.end_turn(turn_usage)
+        speculative.finish(tool_cache)
+    usage_summary = turn_usage.summary()
+    if ip is not None:
+        # 预扣的是一轮最多的 LLM 调用数，按实际调用次数退回多扣的令牌
+        unused = cost_of("session") - usage_summary["llm_calls"]
+        LIMITER.refund("session", sid, unused)
+        LIMITER.refund("chat", ip, unused)
 
-    answer, intermediate_steps = run_agent(executor, merged_user_msg, history)
+    history.append({"role": "user", "content": user_msg})
 
     history.append({"role": "assistant", "content": answer})
 
-    # 4) steps
+    # 5) steps
     steps_out: List[StepItem] = []
     for action, obs in intermediate_steps:
-        steps_out.append(StepItem(action=str(action), observation=str(obs)))
-
-    return ChatResponse(session_id=sid, answer=answer, steps=steps_out)
+        steps_out.append(StepItem(
+            action=str(action), observation=str(full_payload(obs)), tool=getattr(action, "tool", None)
+        ))
+
+    # 6) 对话记录异步落库
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    (TRANSCRIPTS if transcripts is None else transcripts).submit(
+        {
+            "session_id": sid,
+            "turn_id": turn_id,
+            "user_message": user_msg,
+            "answer": answer,
+            "iterations": len(intermediate_steps),
+            "latency_ms": int((time.perf_counter() - t_start) * 1000),
+            "prompt_tokens": usage_summary["input_tokens"],
+            "completion_tokens": usage_summary["output_tokens"],
+            "created_at": now,
+        },
+        [
+            {
+                "session_id": sid,
+                "turn_id": turn_id,
+                "seq": i,
+                "tool": getattr(action, "tool", ""),
+                "tool_input": str(getattr(action, "tool_input", "")),
+                "observation": json.dumps(full_payload(obs), ensure_ascii=False, default=str),
+                "latency_ms": getattr(obs, "latency_ms", None),
+                "created_at": now,
+            }
+            for i, (action, obs) in enumerate(intermediate_steps)
+        ],
+    )
+
+    usage_out = None
+    if req.include_usage:
+        usage_out = {**usage_summary, "degraded": budget["degraded"], "model": budget["model"]}
+    return ChatResponse(session_id=sid, answer=answer, steps=steps_out, usage=usage_out)
 
 from fastapi.middleware.cors import CORSMiddleware
 
+# 限流放在 CORS 里层，429 响应也带 CORS 头，前端才能读到 Retry-After
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -306,8 +534,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", "Retry-After"],
 )
 
+
+@app.middleware("http")
+async def _profile_request(request: Request, call_next):
+    # 请求头 X-Profile（需带与 PROFILE_TOKEN 一致的 X-Profile-Token）或按 PROFILE_SAMPLE_RATE 抽样开启剖析，见 backend/profiler.py
+    mode = profiler.decide(request.url.path, request.headers)
+    if mode is None:
+        return await call_next(request)
+    session = profiler.begin(mode, request.method, request.url.path, request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+    finally:
+        meta = await run_in_threadpool(profiler.finish, session)
+    if meta:
+        response.headers["X-Profile-Id"] = meta["request_id"]
+    return response
+
+
+@app.get("/api/admin/profiles")
+def api_list_profiles():
+    # 最近的单请求剖析记录（新的在前）
+    return profiler.list_profiles()
+
+
+@app.get("/api/admin/profiles/{request_id}")
+def api_download_profile(request_id: str):
+    path = profiler.artifact_path(request_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(path, filename=os.path.basename(path), media_type="application/octet-stream")
+
 class CreateOrderReq(BaseModel):
     product_id: str
     qty: int = 1
@@ -319,51 +578,42 @@ class CreateOrderResp(BaseModel):
     status: str
     total_amount: float
 
-def _gen_order_no() -> str:
-    return datetime.now().strftime("%Y%m%d%H%M%S") + uuid.uuid4().hex[:6].upper()
-
-def _get_product_snapshot(product_id: str) -> Dict[str, Any]:
-
-    p = get_product_by_id(product_id)
-    if not p:
-        raise HTTPException(status_code=404, detail="product not found")
-    return p
+def _place_order(items: List[Dict[str, Any]], receiver: Optional[str], phone_tail: Optional[str],
+                 idempotency_key: Optional[str], response: Response) -> Dict[str, Any]:
+    try:
+        result, replayed = checkout.place_order(items, receiver, phone_tail, idempotency_key)
+    except checkout.CheckoutError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
 
 @app.post("/api/orders", response_model=CreateOrderResp)
-def create_order(req: CreateOrderReq):
-    if req.qty <= 0:
-        raise HTTPException(status_code=400, detail="qty must be > 0")
-
-    p = _get_product_snapshot(req.product_id)
-    order_no = _gen_order_no()
-    price = float(p.get("price", 0))
-    total = price * req.qty
-    
-    # 获取商品图片URL：优先使用轮播图的第一张，否则使用 image_url
-    image_url = ""
-    carousel_images = p.get("carousel_images", [])
-    if carousel_images and isinstance(carousel_images, list) and len(carousel_images) > 0:
-        image_url = carousel_images[0]
-    else:
-        image_url = p.get("image_url", "")
+def create_order(req: CreateOrderReq, response: Response,
+                 idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")):
+    result = _place_order([{"product_id": req.product_id, "qty": req.qty}], req.receiver, req.phone_tail,
+                          idempotency_key, response)
+    return CreateOrderResp(order_no=result["order_no"], status=result["status"], total_amount=result["total_amount"])
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO orders(order_no, status, receiver, phone_tail, total_amount) VALUES(%s,%s,%s,%s,%s)",
-                (order_no, "PAID", req.receiver, req.phone_tail, total),
-            )
-            order_id = cur.lastrowid
-            cur.execute(
-                "INSERT INTO order_items(order_id, product_id, shop_id, title, price, qty, image_url) VALUES(%s,%s,%s,%s,%s,%s,%s)",
-                (order_id, p["product_id"], p["shop_id"], p["title"], price, req.qty, image_url),
-            )
+class CheckoutItem(BaseModel):
+    product_id: str
+    qty: int = 1
+
+class CheckoutReq(BaseModel):
+    items: List[CheckoutItem]
+    receiver: Optional[str] = None
+    phone_tail: Optional[str] = None
 
-    return CreateOrderResp(order_no=order_no, status="PAID", total_amount=total)
+@app.post("/api/orders/checkout")
+def checkout_order(req: CheckoutReq, response: Response,
+                   idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")):
+    # 多商品下单；带 Idempotency-Key 时重试返回同一订单
+    return _place_order([it.model_dump() for it in req.items], req.receiver, req.phone_tail, idempotency_key, response)
 
 @app.get("/api/orders")
 def list_orders():
-    with get_conn() as conn:
+    # 刚下单 / 改过订单时走主库，列表里能立刻看到（读己之写）
+    with get_read_conn(ORDER_LIST_KEY) as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
@@ -382,23 +632,41 @@ def list_orders():
 
 @app.get("/api/orders/{order_no}")
 def get_order(order_no: str):
-    with get_conn() as conn:
+    with get_read_conn(order_no) as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
-                "FROM orders WHERE order_no=%s",
-                (order_no,),
-            )
-            o = cur.fetchone()
+            # 热表查不到再查归档表
+            for orders_table, items_table in ORDER_TABLES:
+                cur.execute(
+                    "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
+                    f"FROM {orders_table} WHERE order_no=%s",
+                    (order_no,),
+                )
+                o = cur.fetchone()
+                if o:
+                    break
             if not o:
                 raise HTTPException(status_code=404, detail="order not found")
             cur.execute(
-                "SELECT product_id, shop_id, title, price, qty, image_url FROM order_items WHERE order_id=%s",
+                f"SELECT product_id, shop_id, title, price, qty, image_url FROM {items_table} WHERE order_id=%s",
                 (o["id"],),
             )
             o["items"] = cur.fetchall()
+            o["archived"] = orders_table != "orders"
     return o
 
+@app.get("/api/orders/{order_no}/insight")
+def get_order_insight_api(order_no: str, phone_tail: Optional[str] = None, receiver: Optional[str] = None,
+                          tracking_no: Optional[str] = None):
+    # 订单 + 明细 + 是否可退 + 物流，一次返回
+    data = load_order_insight(order_no)
+    if data is None:
+        raise HTTPException(status_code=404, detail="order not found")
+    err = verify_order_identity(data["order"], phone_tail, receiver)
+    if err:
+        raise HTTPException(status_code=403, detail=err)
+    tracking = get_tracking(tracking_no)["tracking"] if tracking_no else None
+    return {**data, "tracking": tracking}
+
 from pydantic import BaseModel
 from typing import Optional
 import uuid
@@ -412,7 +680,15 @@ class RefundResp(BaseModel):
     status: str
 
 def _gen_after_sale_no() -> str:
-    return "AS" + uuid.uuid4().hex[:10].upper()
+    return new_after_sale_no()
+
+def _order_missing(cur, order_no: str) -> HTTPException:
+    """热表查不到的订单：已归档的明确拒绝写操作（409），否则 404。"""
+    cur.execute("SELECT status FROM orders_archive WHERE order_no=%s", (order_no,))
+    archived = cur.fetchone()
+    if archived:
+        return HTTPException(status_code=409, detail=f"order archived ({archived['status']}), read-only")
+    return HTTPException(status_code=404, detail="order not found")
 
 @app.post("/api/orders/{order_no}/refund", response_model=RefundResp)
 def refund_order(order_no: str, req: RefundReq):
@@ -422,7 +698,7 @@ def refund_order(order_no: str, req: RefundReq):
             cur.execute("SELECT order_no, status FROM orders WHERE order_no=%s", (order_no,))
             o = cur.fetchone()
             if not o:
-                raise HTTPException(status_code=404, detail="order not found")
+                raise _order_missing(cur, order_no)
 
             # 2) 简单规则：PAID 才允许退
             if o["status"] not in ("PAID", "SHIPPED", "DELIVERED"):
@@ -430,6 +706,7 @@ def refund_order(order_no: str, req: RefundReq):
 
             after_sale_no = _gen_after_sale_no()
             reason = (req.reason or "用户申请退货退款").strip()
+            facts = order_stats.capture(cur, [order_no], lock=True)
 
             cur.execute(
                 "INSERT INTO after_sales(after_sale_no, order_no, type, reason, status) VALUES(%s,%s,%s,%s,%s)",
@@ -439,6 +716,12 @@ def refund_order(order_no: str, req: RefundReq):
             # 3) 同步把订单状态改成 REFUNDING
             cur.execute("UPDATE orders SET status=%s WHERE order_no=%s", ("REFUNDING", order_no))
 
+            # 4) 看板汇总表随同一事务更新
+            order_stats.record_after_sale(cur, after_sale_no)
+            order_stats.record_transition(cur, facts, "REFUNDING")
+    mark_written(order_no, ORDER_LIST_KEY)
+    invalidate_order_insight(order_no)
+
     return RefundResp(after_sale_no=after_sale_no, status="REFUNDING")
 
 
@@ -447,17 +730,46 @@ class AdminUpdateOrderReq(BaseModel):
 
 @app.patch("/api/admin/orders/{order_no}")
 def admin_update_order(order_no: str, req: AdminUpdateOrderReq):
-    allow = {"PAID", "SHIPPED", "DELIVERED", "CANCELLED", "REFUNDING", "REFUNDED"}
+    allow = order_admin.ORDER_STATUSES
     if req.status not in allow:
         raise HTTPException(status_code=400, detail=f"invalid status, allow: {sorted(list(allow))}")
 
     with get_conn() as conn:
         with conn.cursor() as cur:
+            facts = order_stats.capture(cur, [order_no], lock=True)
+            if not facts:
+                raise _order_missing(cur, order_no)
             cur.execute("UPDATE orders SET status=%s WHERE order_no=%s", (req.status, order_no))
-            if cur.rowcount == 0:
-                raise HTTPException(status_code=404, detail="order not found")
+            order_stats.record_transition(cur, facts, req.status)
+    mark_written(order_no, ORDER_LIST_KEY)
+    invalidate_order_insight(order_no)
     return {"ok": True, "order_no": order_no, "status": req.status}
 
+class BulkStatusReq(BaseModel):
+    order_nos: List[str]
+    status: str
+
+@app.post("/api/admin/orders/bulk_status")
+def admin_bulk_update_status(req: BulkStatusReq):
+    # 分组事务批量改状态，按状态流转规则逐单校验
+    if req.status not in order_admin.ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"invalid status, allow: {sorted(order_admin.ORDER_STATUSES)}")
+    return order_admin.bulk_transition(req.order_nos, req.status)
+
+@app.get("/api/admin/orders/export")
+def admin_export_orders(format: str = "ndjson", status: Optional[str] = None,
+                        created_from: Optional[datetime] = None, created_to: Optional[datetime] = None):
+    # 按主键分页流式导出，不限行数
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    media = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"orders_{datetime.now().strftime('%Y%m%d%H%M%S')}.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        order_admin.iter_export(format, status, created_from, created_to),
+        media_type=media,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
 @app.delete("/api/orders/{order_no}")
 def delete_order(order_no: str):
     with get_conn() as conn:
@@ -466,9 +778,11 @@ def delete_order(order_no: str):
             cur.execute("SELECT id FROM orders WHERE order_no=%s", (order_no,))
             o = cur.fetchone()
             if not o:
-                raise HTTPException(status_code=404, detail="order not found")
+                raise _order_missing(cur, order_no)
             
             order_id = o["id"]
+            facts = order_stats.capture(cur, [order_no], lock=True)
+            after_sales = order_stats.capture_after_sales(cur, [order_no])
             
             # 2. 删除订单商品
             cur.execute("DELETE FROM order_items WHERE order_id=%s", (order_id,))
@@ -478,7 +792,9 @@ def delete_order(order_no: str):
             
             # 4. 删除订单
             cur.execute("DELETE FROM orders WHERE id=%s", (order_id,))
-            
+            order_stats.record_deleted(cur, facts, after_sales)
+    mark_written(order_no, ORDER_LIST_KEY)
+    invalidate_order_insight(order_no)
     return {"ok": True, "order_no": order_no}
 
 @app.delete("/api/admin/orders/{order_no}")
@@ -489,9 +805,11 @@ def admin_delete_order(order_no: str):
             cur.execute("SELECT id FROM orders WHERE order_no=%s", (order_no,))
             o = cur.fetchone()
             if not o:
-                raise HTTPException(status_code=404, detail="order not found")
+                raise _order_missing(cur, order_no)
             
             order_id = o["id"]
+            facts = order_stats.capture(cur, [order_no], lock=True)
+            after_sales = order_stats.capture_after_sales(cur, [order_no])
             
             # 2. 删除订单商品
             cur.execute("DELETE FROM order_items WHERE order_id=%s", (order_id,))
@@ -501,53 +819,38 @@ def admin_delete_order(order_no: str):
             
             # 4. 删除订单
             cur.execute("DELETE FROM orders WHERE id=%s", (order_id,))
-            
+            order_stats.record_deleted(cur, facts, after_sales)
+    mark_written(order_no, ORDER_LIST_KEY)
+    invalidate_order_insight(order_no)
     return {"ok": True, "order_no": order_no, "message": "订单已删除"}
 
-import json as _json
+class RedeemCouponReq(BaseModel):
+    order_no: Optional[str] = None
 
-def _db_product_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
-    # specs_json 可能是 str / dict
-    specs = row.get("specs_json")
-    if isinstance(specs, str):
-        try:
-            specs = _json.loads(specs)
-        except:
-            specs = {}
-    if specs is None:
-        specs = {}
-    row["specs"] = specs
-    row.pop("specs_json", None)
-    
-    # Handle JSON fields
-    if row.get("carousel_images"):
-        try:
-            row["carousel_images"] = json.loads(row["carousel_images"]) if isinstance(row["carousel_images"], str) else row["carousel_images"]
-        except:
-            row["carousel_images"] = []
-    else:
-        row["carousel_images"] = []
-    
-    if row.get("detail_images"):
-        try:
-            row["detail_images"] = json.loads(row["detail_images"]) if isinstance(row["detail_images"], str) else row["detail_images"]
-        except:
-            row["detail_images"] = []
-    else:
-        row["detail_images"] = []
-    
-    return row
+@app.post("/api/coupons/{code}/redeem")
+def redeem_coupon(code: str, req: RedeemCouponReq):
+    r = COUPONS.redeem(code, req.order_no)
+    if not r["ok"]:
+        raise HTTPException(status_code=400, detail=r["message"])
+    return r
+
+@app.get("/api/admin/coupons")
+def admin_list_coupons(receiver: str, limit: int = 50):
+    # 按收件人查发放记录（含尚未落库的）
+    return COUPONS.list_by_receiver(receiver, min(limit, 200))
+
+import json as _json
 
 @app.get("/api/products_db")
 def api_products_db():
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT product_id, shop_id, title, category, price, description, specs_json, image_url, carousel_images, detail_images, detailed_text, is_active "
                 "FROM products ORDER BY id DESC LIMIT 200"
             )
             rows = cur.fetchall()
-    return [_db_product_to_dict(r) for r in rows]
+    return FastJSONResponse(PRODUCT.many(rows))
 
 @app.post("/api/admin/upload")
 async def admin_upload(file: UploadFile = File(...)):
@@ -556,6 +859,7 @@ async def admin_upload(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="只允许 jpg/jpeg/png/webp")
 
     name = f"{uuid.uuid4().hex}{ext}"
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
     save_path = os.path.join(UPLOAD_DIR, name)
 
     content = await file.read()
@@ -565,7 +869,7 @@ async def admin_upload(file: UploadFile = File(...)):
     return {"url": f"/uploads/{name}"}
 
 @app.post("/api/admin/products")
-async def admin_create_product(
+def admin_create_product(
     product_id: str = Form(""),
     shop_id: str = Form(...),
     title: str = Form(...),
@@ -577,6 +881,7 @@ async def admin_create_product(
     carousel_images: str = Form("[]"),
     detailed_text: str = Form(""),
 ):
+    # 同步 def：写库和 product_index 增量更新都是阻塞调用，由 FastAPI 放到线程池，不占事件循环
     if not product_id.strip():
         product_id = "P" + uuid.uuid4().hex[:8].upper()   # 自动生成 PXXXXXXXX
 
@@ -603,10 +908,15 @@ async def admin_create_product(
                 "VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
                 (product_id, shop_id, title, category, price, description, specs_json, image_url, carousel_images, detailed_text),
             )
+    mark_written(product_id)
+    product_index.on_product_saved({
+        "product_id": product_id, "title": title, "category": category,
+        "description": description, "specs": specs_json, "is_active": 1,
+    })
     return {"ok": True, "product_id": product_id}
 
 @app.put("/api/admin/products/{pid}")
-async def admin_update_product(
+def admin_update_product(
     pid: str,
     title: str = Form(...),
     category: str = Form(""),
@@ -642,6 +952,13 @@ async def admin_update_product(
             )
             if cur.rowcount == 0:
                 raise HTTPException(status_code=404, detail="product not found")
+            cur.execute("SELECT is_active FROM products WHERE product_id=%s", (pid,))
+            is_active = cur.fetchone()["is_active"]
+    mark_written(pid)
+    product_index.on_product_saved({
+        "product_id": pid, "title": title, "category": category,
+        "description": description, "specs": specs_json, "is_active": is_active,
+    })
     return {"ok": True}
 
 @app.delete("/api/admin/products/{pid}")
@@ -651,6 +968,8 @@ def admin_delete_product(pid: str):
             cur.execute("DELETE FROM products WHERE product_id=%s", (pid,))
             if cur.rowcount == 0:
                 raise HTTPException(status_code=404, detail="product not found")
+    mark_written(pid)
+    product_index.on_product_deleted(pid)
     return {"ok": True}
 
 class AdminToggleReq(BaseModel):
@@ -666,6 +985,8 @@ def admin_toggle_product(product_id: str, req: AdminToggleReq):
             )
             if cur.rowcount == 0:
                 raise HTTPException(status_code=404, detail="product not found")
+    mark_written(product_id)
+    product_index.on_product_toggled(product_id, req.is_active)
     return {"ok": True, "product_id": product_id, "is_active": req.is_active}
 
 
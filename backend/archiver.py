@@ -0,0 +1,205 @@
+# backend/archiver.py
+"""冷订单归档：把已结束的订单连同明细、售后记录从热表搬到 *_archive 表。
+
+归档条件：
+- REFUNDED / CANCELLED：下单超过 ARCHIVE_CLOSED_AFTER_DAYS 天；
+- DELIVERED：下单超过 ARCHIVE_DELIVERED_AFTER_DAYS 天（过了退货期）。
+
+每次最多搬 ARCHIVE_CHUNK_SIZE 个订单，一个事务内 INSERT ... SELECT 到归档表再从热表删除，
+两批之间暂停 ARCHIVE_PAUSE_SECONDS 秒限速；一轮最多 ARCHIVE_MAX_CHUNKS 批。
+多进程部署时用 MySQL GET_LOCK 保证同一时刻只有一个进程在归档。
+
+lookup_order / get_order 等查询在热表查不到时会自动回落到归档表（见 order_tools.ORDER_TABLES）；
+归档订单只读，退款、删单、后台改状态等写接口对它返回 409。
+
+用法：
+    python -m backend.archiver run        # 立即跑一轮
+    python -m backend.archiver status     # 待归档数量
+后台线程每 ARCHIVE_INTERVAL_SECONDS 秒跑一轮，设为 0 关闭。
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from backend.database import get_conn
+from backend.log_pipeline import report_error
+from backend.tools.order_tools import invalidate_order_insight
+
+ARCHIVE_CLOSED_AFTER_DAYS = int(os.getenv("ARCHIVE_CLOSED_AFTER_DAYS", "30"))
+ARCHIVE_DELIVERED_AFTER_DAYS = int(os.getenv("ARCHIVE_DELIVERED_AFTER_DAYS", "90"))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "200"))
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_SECONDS", "0.5"))
+ARCHIVE_MAX_CHUNKS = int(os.getenv("ARCHIVE_MAX_CHUNKS", "500"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+CLOSED_STATUSES = ("REFUNDED", "CANCELLED", "CANCELED")
+
+ORDER_COLUMNS = ["id", "order_no", "status", "receiver", "phone_tail", "total_amount", "created_at"]
+ITEM_COLUMNS = ["id", "order_id", "product_id", "shop_id", "title", "price", "qty", "created_at", "image_url"]
+AFTER_SALE_COLUMNS = ["id", "after_sale_no", "order_no", "type", "reason", "status", "created_at"]
+
+_LOCK_NAME = "smart_mall_order_archiver"
+
+
+def _marks(n: int) -> str:
+    return ",".join(["%s"] * n)
+
+
+def _candidates(cur, limit: int) -> List[Dict[str, Any]]:
+    """两条走 (status, created_at) 索引的范围查询。"""
+    now = datetime.now()
+    closed_before = now - timedelta(days=ARCHIVE_CLOSED_AFTER_DAYS)
+    delivered_before = now - timedelta(days=ARCHIVE_DELIVERED_AFTER_DAYS)
+    cur.execute(
+        f"SELECT id, order_no FROM orders WHERE status IN ({_marks(len(CLOSED_STATUSES))}) AND created_at<%s "
+        "ORDER BY created_at LIMIT %s",
+        (*CLOSED_STATUSES, closed_before, limit),
+    )
+    rows = list(cur.fetchall())
+    if len(rows) < limit:
+        cur.execute(
+            "SELECT id, order_no FROM orders WHERE status=%s AND created_at<%s ORDER BY created_at LIMIT %s",
+            ("DELIVERED", delivered_before, limit - len(rows)),
+        )
+        rows += list(cur.fetchall())
+    return rows
+
+
+def _move(cur, table: str, columns: List[str], where: str, args: List[Any]) -> int:
+    cols = ", ".join(columns)
+    cur.execute(f"INSERT INTO {table}_archive({cols}) SELECT {cols} FROM {table} WHERE {where}", args)
+    cur.execute(f"DELETE FROM {table} WHERE {where}", args)
+    return cur.rowcount
+
+
+def archive_chunk(limit: int = ARCHIVE_CHUNK_SIZE) -> List[str]:
+    """搬一批订单，返回已归档的订单号。"""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            rows = _candidates(cur, limit)
+            if not rows:
+                return []
+            ids = [r["id"] for r in rows]
+            # 加锁后复查状态，避免和并发的状态修改冲突
+            cur.execute(
+                f"SELECT id, order_no, status FROM orders WHERE id IN ({_marks(len(ids))}) FOR UPDATE", ids
+            )
+            locked = [r for r in cur.fetchall() if r["status"] in CLOSED_STATUSES + ("DELIVERED",)]
+            if not locked:
+                return []
+            ids = [r["id"] for r in locked]
+            nos = [r["order_no"] for r in locked]
+            _move(cur, "order_items", ITEM_COLUMNS, f"order_id IN ({_marks(len(ids))})", ids)
+            _move(cur, "after_sales", AFTER_SALE_COLUMNS, f"order_no IN ({_marks(len(nos))})", nos)
+            _move(cur, "orders", ORDER_COLUMNS, f"id IN ({_marks(len(ids))})", ids)
+    for no in nos:
+        invalidate_order_insight(no)
+    return nos
+
+
+class Archiver:
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "runs": 0, "archived_orders": 0, "last_run_at": None, "last_run_archived": 0,
+            "last_run_seconds": 0.0, "last_error": None, "skipped_locked": 0,
+        }
+
+    def run_once(self) -> int:
+        """跑一轮，返回归档的订单数；别的进程正在归档时直接返回 0。"""
+        t0 = time.perf_counter()
+        total = 0
+        with get_conn() as lock_conn:
+            with lock_conn.cursor() as cur:
+                cur.execute("SELECT GET_LOCK(%s, 0) AS ok", (_LOCK_NAME,))
+                if not cur.fetchone()["ok"]:
+                    with self._lock:
+                        self.stats["skipped_locked"] += 1
+                    return 0
+                try:
+                    for _ in range(ARCHIVE_MAX_CHUNKS):
+                        if self._stop.is_set():
+                            break
+                        nos = archive_chunk()
+                        total += len(nos)
+                        if len(nos) < ARCHIVE_CHUNK_SIZE:
+                            break
+                        time.sleep(ARCHIVE_PAUSE_SECONDS)
+                finally:
+                    cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["archived_orders"] += total
+            self.stats["last_run_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.stats["last_run_archived"] = total
+            self.stats["last_run_seconds"] = round(time.perf_counter() - t0, 2)
+        return total
+
+    def _loop(self) -> None:
+        while not self._stop.wait(ARCHIVE_INTERVAL_SECONDS):
+            try:
+                self.run_once()
+                err = None
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+                report_error("archiver", "run_failed", e)
+            with self._lock:
+                self.stats["last_error"] = err
+
+    def start(self) -> None:
+        if ARCHIVE_INTERVAL_SECONDS <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="order-archiver", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        t, self._thread = self._thread, None
+        if t is not None:
+            t.join(timeout)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, interval_seconds=ARCHIVE_INTERVAL_SECONDS, chunk_size=ARCHIVE_CHUNK_SIZE)
+
+
+ARCHIVER = Archiver()
+
+
+def pending_counts() -> Dict[str, int]:
+    now = datetime.now()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT COUNT(*) AS n FROM orders WHERE status IN ({_marks(len(CLOSED_STATUSES))}) AND created_at<%s",
+                (*CLOSED_STATUSES, now - timedelta(days=ARCHIVE_CLOSED_AFTER_DAYS)),
+            )
+            closed = cur.fetchone()["n"]
+            cur.execute(
+                "SELECT COUNT(*) AS n FROM orders WHERE status=%s AND created_at<%s",
+                ("DELIVERED", now - timedelta(days=ARCHIVE_DELIVERED_AFTER_DAYS)),
+            )
+            delivered = cur.fetchone()["n"]
+    return {"closed": int(closed), "delivered": int(delivered)}
+
+
+def main(argv: List[str]) -> int:
+    cmd = argv[0] if argv else "status"
+    if cmd == "run":
+        print(f"archived {ARCHIVER.run_once()} order(s)")
+    elif cmd == "status":
+        print(pending_counts())
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,275 @@
+# backend/checkout.py
+"""下单：多商品、单事务、幂等。
+
+一次下单只用一个主库连接、一个事务：
+1. 带 Idempotency-Key 时先插入 order_idempotency_keys 占住该键（主键冲突说明是重试，
+   并发的同键请求会在这一步等待前一个事务提交后再冲突，直接回放已保存的结果）；
+2. 一条 IN 查询取全部商品快照；
+3. 插入订单行，order_items 用一次 executemany 写入，同一事务内累加看板汇总表（backend/order_stats.py）；
+4. 把响应写回幂等表，提交。
+
+同一个键但请求内容不同视为客户端错误（422）。幂等键保留 IDEMPOTENCY_TTL_HOURS 小时，
+用 python -m backend.checkout purge 清理过期键。
+
+压测：python -m backend.checkout bench --workers 16 --orders 2000 --items 3
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+
+from backend import order_stats
+from backend.database import ORDER_LIST_KEY, get_conn, mark_written
+from backend.idgen import new_order_no
+from backend.rowmap import json_list
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+MAX_ORDER_LINES = int(os.getenv("MAX_ORDER_LINES", "50"))
+
+
+class CheckoutError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _merge_lines(items: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
+    """同一商品多行合并数量，保持首次出现的顺序。"""
+    merged: Dict[str, int] = {}
+    for it in items:
+        pid = str(it.get("product_id") or "").strip()
+        qty = int(it.get("qty") or 0)
+        if not pid:
+            raise CheckoutError(400, "product_id required")
+        if qty <= 0:
+            raise CheckoutError(400, "qty must be > 0")
+        merged[pid] = merged.get(pid, 0) + qty
+    if not merged:
+        raise CheckoutError(400, "items required")
+    if len(merged) > MAX_ORDER_LINES:
+        raise CheckoutError(400, f"too many items (max {MAX_ORDER_LINES})")
+    return list(merged.items())
+
+
+def _request_hash(lines: List[Tuple[str, int]], receiver: Optional[str], phone_tail: Optional[str]) -> str:
+    raw = json.dumps({"lines": lines, "receiver": receiver, "phone_tail": phone_tail}, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _image_of(p: Dict[str, Any]) -> str:
+    # 优先使用轮播图的第一张，否则使用 image_url
+    carousel = json_list(p.get("carousel_images"))
+    return carousel[0] if carousel else (p.get("image_url") or "")
+
+
+def _replay(cur, key: str, req_hash: str) -> Dict[str, Any]:
+    cur.execute("SELECT request_hash, response FROM order_idempotency_keys WHERE idem_key=%s", (key,))
+    row = cur.fetchone()
+    if not row or row["response"] is None:
+        raise CheckoutError(409, "request with this Idempotency-Key is still in progress")
+    if row["request_hash"] != req_hash:
+        raise CheckoutError(422, "Idempotency-Key was already used with a different request")
+    resp = row["response"]
+    return json.loads(resp) if isinstance(resp, (str, bytes)) else resp
+
+
+def lookup_idempotent(key: str) -> Optional[Dict[str, Any]]:
+    """快速路径：键已完成时直接取回结果（主键查询，不开写事务）。"""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT request_hash, response FROM order_idempotency_keys WHERE idem_key=%s", (key,))
+            return cur.fetchone()
+
+
+def place_order(items: List[Dict[str, Any]], receiver: Optional[str] = None, phone_tail: Optional[str] = None,
+                idempotency_key: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    """创建订单，返回 (订单结果, 是否为幂等回放)。"""
+    lines = _merge_lines(items)
+    key = (idempotency_key or "").strip() or None
+    if key and len(key) > 64:
+        raise CheckoutError(400, "Idempotency-Key too long (max 64)")
+    req_hash = _request_hash(lines, receiver, phone_tail)
+
+    if key:
+        row = lookup_idempotent(key)
+        if row and row["response"] is not None:
+            if row["request_hash"] != req_hash:
+                raise CheckoutError(422, "Idempotency-Key was already used with a different request")
+            resp = row["response"]
+            return (json.loads(resp) if isinstance(resp, (str, bytes)) else resp), True
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if key:
+                try:
+                    cur.execute(
+                        "INSERT INTO order_idempotency_keys(idem_key, request_hash) VALUES(%s,%s)",
+                        (key, req_hash),
+                    )
+                except pymysql.err.IntegrityError:
+                    conn.rollback()
+                    return _replay(cur, key, req_hash), True
+
+            pids = [pid for pid, _ in lines]
+            cur.execute(
+                "SELECT product_id, shop_id, title, price, image_url, carousel_images, is_active "
+                f"FROM products WHERE product_id IN ({','.join(['%s'] * len(pids))})",
+                pids,
+            )
+            products = {r["product_id"]: r for r in cur.fetchall()}
+            missing = [pid for pid in pids if pid not in products]
+            if missing:
+                raise CheckoutError(404, f"product not found: {', '.join(missing)}")
+            inactive = [pid for pid in pids if not products[pid].get("is_active")]
+            if inactive:
+                raise CheckoutError(400, f"product not available: {', '.join(inactive)}")
+
+            order_no = new_order_no()
+            rows = []
+            total = 0.0
+            for pid, qty in lines:
+                p = products[pid]
+                price = float(p["price"] or 0)
+                total += price * qty
+                rows.append((pid, p["shop_id"], p["title"], price, qty, _image_of(p)))
+            total = round(total, 2)
+
+            cur.execute(
+                "INSERT INTO orders(order_no, status, receiver, phone_tail, total_amount) VALUES(%s,%s,%s,%s,%s)",
+                (order_no, "PAID", receiver, phone_tail, total),
+            )
+            order_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO order_items(order_id, product_id, shop_id, title, price, qty, image_url) "
+                "VALUES(%s,%s,%s,%s,%s,%s,%s)",
+                [(order_id, *r) for r in rows],
+            )
+            order_stats.record_created(cur, [order_no])
+
+            result = {
+                "order_no": order_no,
+                "status": "PAID",
+                "total_amount": total,
+                "items": [{"product_id": r[0], "title": r[2], "price": r[3], "qty": r[4]} for r in rows],
+            }
+            if key:
+                cur.execute(
+                    "UPDATE order_idempotency_keys SET order_no=%s, response=%s WHERE idem_key=%s",
+                    (order_no, json.dumps(result, ensure_ascii=False), key),
+                )
+    mark_written(order_no, ORDER_LIST_KEY)
+    return result, False
+
+
+def purge_idempotency_keys(older_than_hours: int = IDEMPOTENCY_TTL_HOURS, chunk: int = 1000) -> int:
+    cutoff = datetime.now() - timedelta(hours=older_than_hours)
+    total = 0
+    while True:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM order_idempotency_keys WHERE created_at<%s LIMIT %s", (cutoff, chunk))
+                n = cur.rowcount
+        total += n
+        if n < chunk:
+            return total
+
+
+# ========== 压测：并发下单吞吐 + 重试幂等 ==========
+def _pct(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))]
+
+
+def bench(workers: int, orders: int, items: int, dup_rate: float, keep: bool) -> Dict[str, Any]:
+    import random
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT product_id FROM products WHERE is_active=1 ORDER BY id DESC LIMIT 200")
+            pids = [r["product_id"] for r in cur.fetchall()]
+    if not pids:
+        raise SystemExit("no active products to order")
+
+    rnd = random.Random(42)
+    jobs = []
+    for _ in range(orders):
+        key = "BENCH-" + uuid.uuid4().hex
+        lines = [{"product_id": pid, "qty": rnd.randint(1, 3)} for pid in rnd.sample(pids, min(items, len(pids)))]
+        jobs.append((key, lines))
+        if rnd.random() < dup_rate:
+            jobs.append((key, lines))  # 模拟客户端超时重试
+    rnd.shuffle(jobs)
+
+    def run(job):
+        key, lines = job
+        t0 = time.perf_counter()
+        result, replayed = place_order(lines, receiver="压测", phone_tail="0000", idempotency_key=key)
+        return key, result["order_no"], replayed, (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(run, jobs))
+    elapsed = time.perf_counter() - t0
+
+    by_key: Dict[str, set] = {}
+    for key, order_no, _, _ in results:
+        by_key.setdefault(key, set()).add(order_no)
+    lat = sorted(r[3] for r in results)
+    created = {no for nos in by_key.values() for no in nos}
+    summary = {
+        "requests": len(results),
+        "orders_created": len(created),
+        "replays": sum(1 for r in results if r[2]),
+        "keys_with_multiple_orders": sum(1 for nos in by_key.values() if len(nos) > 1),
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(len(results) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(_pct(lat, 0.50), 1),
+        "p95_ms": round(_pct(lat, 0.95), 1),
+        "p99_ms": round(_pct(lat, 0.99), 1),
+    }
+
+    if not keep:
+        nos = list(created)
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                for i in range(0, len(nos), 1000):
+                    part = nos[i:i + 1000]
+                    order_stats.record_deleted(cur, order_stats.capture(cur, part))
+                    cur.execute(f"DELETE FROM orders WHERE order_no IN ({','.join(['%s'] * len(part))})", part)
+                cur.execute("DELETE FROM order_idempotency_keys WHERE idem_key LIKE 'BENCH-%'")
+    return summary
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="下单幂等 / 压测")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="并发下单压测（会真实写库，默认结束后删除压测订单）")
+    b.add_argument("--workers", type=int, default=16)
+    b.add_argument("--orders", type=int, default=2000)
+    b.add_argument("--items", type=int, default=3, help="每单商品行数")
+    b.add_argument("--dup-rate", type=float, default=0.1, help="带相同幂等键重复提交的比例")
+    b.add_argument("--keep", action="store_true", help="保留压测订单")
+    p = sub.add_parser("purge", help="清理过期幂等键")
+    p.add_argument("--hours", type=int, default=IDEMPOTENCY_TTL_HOURS)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "purge":
+        print(f"purged {purge_idempotency_keys(args.hours)} key(s)")
+        return 0
+    r = bench(args.workers, args.orders, args.items, args.dup_rate, args.keep)
+    print(json.dumps(r, ensure_ascii=False))
+    return 1 if r["keys_with_multiple_orders"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
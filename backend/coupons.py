@@ -0,0 +1,356 @@
+# backend/coupons.py
+"""补偿券台账。
+
+- 券码：从 coupon_code_seq 按块（COUPON_BLOCK_SIZE 个）原子地领取一段序号，块内在内存中发放，
+  用完再整块续取；序号经乘法置换成 10 位数字，券码不连续但保证唯一；
+- 限额：同一收件人 COUPON_CAP_WINDOW_DAYS 天内最多 COUPON_MAX_PER_RECEIVER 张，
+  同一订单最多 COUPON_MAX_PER_ORDER 张；一次查询（两个索引各一次范围查找）取库里的数量，
+  再加上本进程已发放但尚未落库的数量；
+- 落库：发放记录先进内存缓冲，后台线程每 COUPON_FLUSH_INTERVAL 秒用 executemany 批量写入，
+  写失败的批次留在缓冲里下次重试，连续失败 COUPON_FLUSH_RETRIES 次后改为逐条写入，
+  逐条仍因数据错误写不进去的记录转入死信（结构化日志里带完整记录，可人工补录），
+  不会让一条坏数据卡住整个台账；进程退出时 close() 刷完。
+
+限额在单进程内是严格的；多进程部署时，各进程未落库的记录彼此不可见，最多多发
+(进程数 - 1) × 一个刷盘周期内的并发量。
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pymysql
+
+from backend.database import get_conn, get_read_conn, mark_written
+from backend.log_pipeline import report_error
+
+COUPON_BLOCK_SIZE = int(os.getenv("COUPON_BLOCK_SIZE", "1000"))
+COUPON_MAX_PER_RECEIVER = int(os.getenv("COUPON_MAX_PER_RECEIVER", "3"))
+COUPON_MAX_PER_ORDER = int(os.getenv("COUPON_MAX_PER_ORDER", "1"))
+COUPON_CAP_WINDOW_DAYS = int(os.getenv("COUPON_CAP_WINDOW_DAYS", "30"))
+COUPON_VALID_DAYS = int(os.getenv("COUPON_VALID_DAYS", "30"))
+COUPON_FLUSH_INTERVAL = float(os.getenv("COUPON_FLUSH_INTERVAL", "0.2"))
+COUPON_BATCH_SIZE = int(os.getenv("COUPON_BATCH_SIZE", "500"))
+COUPON_FLUSH_RETRIES = int(os.getenv("COUPON_FLUSH_RETRIES", "5"))
+COUPON_MAX_AMOUNT = int(os.getenv("COUPON_MAX_AMOUNT", "100"))
+
+# 序号 -> 券码的置换：MULT 与 10^10 互素，n < 10^10 时一一对应
+_CODE_SPACE = 10 ** 10
+_CODE_MULT = 3486784401
+_CODE_OFFSET = 1234567891
+
+COLUMNS = ["code", "receiver", "order_no", "amount", "reason", "status", "issued_at", "expires_at"]
+# 与 migrations/0003 的列宽一致
+MAX_LEN = {"receiver": 64, "order_no": 32, "reason": 255}
+
+_AMOUNT_RE = re.compile(r"^\s*(\d+)(?:\.0+)?\s*元?\s*$")
+
+
+_INSERT_SQL = (
+    "INSERT INTO coupons(code, receiver, order_no, amount, reason, status, issued_at, expires_at) "
+    "VALUES(%s,%s,%s,%s,%s,%s,%s,%s)"
+)
+
+
+def code_of(n: int) -> str:
+    return f"CP{(n * _CODE_MULT + _CODE_OFFSET) % _CODE_SPACE:010d}"
+
+
+class CouponLedger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._block_lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._buf: List[Dict[str, Any]] = []
+        # 已发放未落库的数量，落库成功后扣减
+        self._pending_receiver: Counter = Counter()
+        self._pending_order: Counter = Counter()
+        # 每次落库成功 +1，用于发现“查库之后、加锁之前”刚好有记录落库的情况
+        self._flush_gen = 0
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        # 缓冲头部那批记录连续写失败的次数（按首条券码识别）
+        self._head_failures: Counter = Counter()
+        self.stats = {"issued": 0, "rejected": 0, "invalid": 0, "written": 0, "flush_failures": 0,
+                      "dead_lettered": 0, "blocks": 0}
+
+    # ---------- 券码号段 ----------
+    def _alloc_block(self) -> None:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE coupon_code_seq SET next_val=LAST_INSERT_ID(next_val+%s) WHERE name=%s",
+                    (COUPON_BLOCK_SIZE, "coupon"),
+                )
+                cur.execute("SELECT LAST_INSERT_ID() AS hi")
+                hi = int(cur.fetchone()["hi"])
+        self._next, self._end = hi - COUPON_BLOCK_SIZE, hi
+        self.stats["blocks"] += 1
+
+    def _next_code(self) -> str:
+        with self._block_lock:
+            if self._next >= self._end:
+                self._alloc_block()
+            n = self._next
+            self._next += 1
+        return code_of(n)
+
+    # ---------- 限额 ----------
+    @staticmethod
+    def _db_counts(receiver: str, order_no: Optional[str], since: datetime) -> Dict[str, int]:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT (SELECT COUNT(*) FROM coupons WHERE receiver=%s AND issued_at>=%s) AS by_receiver, "
+                    "(SELECT COUNT(*) FROM coupons WHERE order_no=%s) AS by_order",
+                    (receiver, since, order_no),
+                )
+                row = cur.fetchone()
+        return {"by_receiver": int(row["by_receiver"] or 0), "by_order": int(row["by_order"] or 0)}
+
+    def _reserve(self, receiver: str, order_no: Optional[str]) -> Optional[str]:
+        """检查限额并占位，超限返回提示文案。"""
+        since = datetime.now() - timedelta(days=COUPON_CAP_WINDOW_DAYS)
+        while True:
+            gen = self._flush_gen
+            db = self._db_counts(receiver, order_no, since)
+            with self._lock:
+                if gen != self._flush_gen:
+                    continue  # 期间有记录落库，库里的数量已变，重查
+                if db["by_receiver"] + self._pending_receiver[receiver] >= COUPON_MAX_PER_RECEIVER:
+                    return f"{receiver} 近 {COUPON_CAP_WINDOW_DAYS} 天已领取 {COUPON_MAX_PER_RECEIVER} 张补偿券，已达上限。"
+                if order_no and db["by_order"] + self._pending_order[order_no] >= COUPON_MAX_PER_ORDER:
+                    return f"订单 {order_no} 已发放过补偿券，不能重复发放。"
+                self._pending_receiver[receiver] += 1
+                if order_no:
+                    self._pending_order[order_no] += 1
+                return None
+
+    def _release(self, records: List[Dict[str, Any]]) -> None:
+        for r in records:
+            self._pending_receiver[r["receiver"]] -= 1
+            if self._pending_receiver[r["receiver"]] <= 0:
+                del self._pending_receiver[r["receiver"]]
+            if r["order_no"]:
+                self._pending_order[r["order_no"]] -= 1
+                if self._pending_order[r["order_no"]] <= 0:
+                    del self._pending_order[r["order_no"]]
+
+    # ---------- 发放 ----------
+    @staticmethod
+    def _validate(receiver: str, amount: Any, reason: str, order_no: Optional[str]):
+        """返回 (金额, 错误提示)；在占用限额和券码之前调用，参数不合法不留任何痕迹。"""
+        if not receiver:
+            return None, "缺少收件人，无法发放补偿券。"
+        if isinstance(amount, bool):
+            amount = None
+        elif isinstance(amount, (int, float)):
+            amount = int(amount) if float(amount).is_integer() else None
+        else:
+            m = _AMOUNT_RE.match(str(amount or ""))
+            amount = int(m.group(1)) if m else None
+        if amount is None or not 0 < amount <= COUPON_MAX_AMOUNT:
+            return None, f"补偿券金额需为 1~{COUPON_MAX_AMOUNT} 的整数（元）。"
+        for field, value in (("receiver", receiver), ("order_no", order_no), ("reason", reason)):
+            if value and len(value) > MAX_LEN[field]:
+                return None, f"{field} 过长（最多 {MAX_LEN[field]} 个字符），无法发放补偿券。"
+        return amount, None
+
+    def issue(self, receiver: str, amount: Any, reason: str, order_no: Optional[str] = None) -> Dict[str, Any]:
+        receiver = (receiver or "").strip()
+        order_no = (order_no or "").strip() or None
+        reason = str(reason or "").strip()
+        amount, err = self._validate(receiver, amount, reason, order_no)
+        if err:
+            with self._lock:
+                self.stats["invalid"] += 1
+            return {"ok": False, "message": err, "coupon": None}
+
+        err = self._reserve(receiver, order_no)
+        if err:
+            with self._lock:
+                self.stats["rejected"] += 1
+            return {"ok": False, "message": err, "coupon": None}
+
+        try:
+            code = self._next_code()
+        except Exception:
+            with self._lock:
+                self._release([{"receiver": receiver, "order_no": order_no}])
+            raise
+        now = datetime.now().replace(microsecond=0)
+        record = {
+            "code": code,
+            "receiver": receiver,
+            "order_no": order_no,
+            "amount": amount,
+            "reason": reason,
+            "status": "ISSUED",
+            "issued_at": now,
+            "expires_at": now + timedelta(days=COUPON_VALID_DAYS),
+        }
+        with self._lock:
+            self._buf.append(record)
+            self.stats["issued"] += 1
+            full = len(self._buf) >= COUPON_BATCH_SIZE
+        self.start()
+        if full:
+            self._wake.set()
+        return {
+            "ok": True,
+            "message": "已发放补偿券",
+            "coupon": {
+                "code": code,
+                "amount": record["amount"],
+                "receiver": receiver,
+                "order_no": order_no,
+                "reason": reason,
+                "valid_days": COUPON_VALID_DAYS,
+                "expires_at": record["expires_at"].strftime("%Y-%m-%d %H:%M:%S"),
+            },
+        }
+
+    # ---------- 批量落库 ----------
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop = False
+                self._thread = threading.Thread(target=self._loop, name="coupon-writer", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop:
+            self._wake.wait(COUPON_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """把缓冲里的发放记录写入 coupons，返回写入条数。"""
+        with self._lock:
+            batch, self._buf = self._buf[:COUPON_BATCH_SIZE], self._buf[COUPON_BATCH_SIZE:]
+        if not batch:
+            return 0
+        head = batch[0]["code"]
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.executemany(_INSERT_SQL, [tuple(r[c] for c in COLUMNS) for r in batch])
+        except Exception as e:
+            with self._lock:
+                self.stats["flush_failures"] += 1
+                self._head_failures[head] += 1
+                tries = self._head_failures[head]
+            if tries >= COUPON_FLUSH_RETRIES:
+                # 多半是批里有写不进去的坏记录，逐条写，把它挑出来
+                report_error("coupons", "flush_failed", e, attempt=tries, fallback="row_by_row")
+                return self._flush_rows(batch)
+            with self._lock:
+                self._buf[:0] = batch  # 放回缓冲，下次重试
+            report_error("coupons", "flush_failed", e, attempt=tries, kept_for_retry=len(batch))
+            time.sleep(COUPON_FLUSH_INTERVAL)
+            return 0
+        self._done(batch, written=batch)
+        return len(batch)
+
+    def _flush_rows(self, batch: List[Dict[str, Any]]) -> int:
+        """逐条写入：数据错误的记录转死信，其余照常落库；连接层面的错误整批放回下次再试。"""
+        written, dead = [], []
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    for r in batch:
+                        try:
+                            cur.execute(_INSERT_SQL, tuple(r[c] for c in COLUMNS))
+                            written.append(r)
+                        except (pymysql.err.DataError, pymysql.err.IntegrityError) as e:
+                            dead.append(r)
+                            report_error("coupons", "dead_letter", e, record={c: r[c] for c in COLUMNS})
+        except Exception as e:
+            with self._lock:
+                self._buf[:0] = batch
+            report_error("coupons", "flush_failed", e, fallback="row_by_row", kept_for_retry=len(batch))
+            time.sleep(COUPON_FLUSH_INTERVAL)
+            return 0
+        self._done(batch, written=written, dead=dead)
+        return len(written)
+
+    def _done(self, batch: List[Dict[str, Any]], written: List[Dict[str, Any]],
+              dead: Optional[List[Dict[str, Any]]] = None) -> None:
+        mark_written(*{r["order_no"] for r in written if r["order_no"]})
+        with self._lock:
+            self._head_failures.pop(batch[0]["code"], None)
+            self._release(batch)
+            self._flush_gen += 1
+            self.stats["written"] += len(written)
+            self.stats["dead_lettered"] += len(dead or [])
+
+    def close(self, timeout: float = 10.0) -> None:
+        """停止后台线程并刷完缓冲。"""
+        self._stop = True
+        self._wake.set()
+        t, self._thread = self._thread, None
+        if t is not None:
+            t.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buf)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "pending": len(self._buf),
+                "block_remaining": max(self._end - self._next, 0),
+                "max_per_receiver": COUPON_MAX_PER_RECEIVER,
+                "max_per_order": COUPON_MAX_PER_ORDER,
+            }
+
+    # ---------- 查询 / 核销 ----------
+    def list_by_receiver(self, receiver: str, limit: int = 50) -> List[Dict[str, Any]]:
+        with get_read_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT code, receiver, order_no, amount, reason, status, issued_at, expires_at, "
+                    "redeemed_at, redeemed_order_no FROM coupons WHERE receiver=%s ORDER BY issued_at DESC LIMIT %s",
+                    (receiver, limit),
+                )
+                rows = cur.fetchall()
+        with self._lock:
+            buffered = [dict(r) for r in self._buf if r["receiver"] == receiver]
+        return buffered[::-1] + list(rows)
+
+    def redeem(self, code: str, order_no: Optional[str] = None) -> Dict[str, Any]:
+        # 刚发的券可能还在缓冲里，先落库
+        while self.pending():
+            if not self.flush():
+                break
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE coupons SET status=%s, redeemed_at=%s, redeemed_order_no=%s "
+                    "WHERE code=%s AND status=%s AND expires_at>=%s",
+                    ("REDEEMED", datetime.now(), order_no, code, "ISSUED", datetime.now()),
+                )
+                if cur.rowcount:
+                    return {"ok": True, "message": "核销成功", "code": code}
+                cur.execute("SELECT status, expires_at FROM coupons WHERE code=%s", (code,))
+                row = cur.fetchone()
+        if not row:
+            return {"ok": False, "message": f"券码 {code} 不存在", "code": code}
+        if row["status"] != "ISSUED":
+            return {"ok": False, "message": f"券码 {code} 状态为 {row['status']}，不能核销", "code": code}
+        return {"ok": False, "message": f"券码 {code} 已过期", "code": code}
+
+
+LEDGER = CouponLedger()
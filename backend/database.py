@@ -1,7 +1,12 @@
 # backend/database.py
 import os
+import threading
+import time
 import pymysql
 from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from backend.log_pipeline import report_error
 
 MYSQL_HOST = os.getenv("MYSQL_HOST", "127.0.0.1")
 MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3306"))
@@ -9,18 +14,52 @@ MYSQL_USER = os.getenv("MYSQL_USER", "your_username")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "your_password")
 MYSQL_DB = os.getenv("MYSQL_DB", "smart_mall")
 
-@contextmanager
-def get_conn():
-    conn = pymysql.connect(
-        host=MYSQL_HOST,
-        port=MYSQL_PORT,
+# 只读从库，逗号分隔 host:port，例如 "10.0.0.2:3306,10.0.0.3:3306"；为空则读写都走主库
+MYSQL_REPLICAS = os.getenv("MYSQL_REPLICAS", "")
+# 从库连接失败后摘除多久再重试（秒）
+REPLICA_RETRY_SECONDS = float(os.getenv("MYSQL_REPLICA_RETRY_SECONDS", "30"))
+# 写入后多久内同一 key 的读请求仍走主库（读己之写，需大于从库复制延迟）。
+# 粘滞记录在进程内存里、按实体 key（订单号等）记：多 worker / 多实例部署时，请求落到没做过这次写的
+# 进程上仍可能读到从库旧数据；需要跨进程保证时把前端 sticky 到同一实例，或缩短复制延迟。
+STICKY_SECONDS = float(os.getenv("MYSQL_STICKY_SECONDS", "5"))
+
+
+def _parse_replicas(s: str) -> List[Tuple[str, int]]:
+    out = []
+    for part in s.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        host, _, port = part.partition(":")
+        out.append((host, int(port or MYSQL_PORT)))
+    return out
+
+
+REPLICAS = _parse_replicas(MYSQL_REPLICAS)
+
+_lock = threading.Lock()
+_rr = 0
+_down_until: Dict[int, float] = {}
+_sticky_until: Dict[str, float] = {}
+
+
+def _connect(host: str, port: int, **kwargs):
+    return pymysql.connect(
+        host=host,
+        port=port,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         database=MYSQL_DB,
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
         autocommit=False,
+        **kwargs,
     )
+
+
+@contextmanager
+def get_conn():
+    conn = _connect(MYSQL_HOST, MYSQL_PORT)
     try:
         yield conn
         conn.commit()
@@ -29,3 +68,115 @@ def get_conn():
         raise
     finally:
         conn.close()
+
+
+# 订单列表这类不按单号读的查询用的粘滞 key：每次写订单时和订单号一起标记
+ORDER_LIST_KEY = "orders:list"
+
+
+def mark_written(*keys: Optional[str]) -> None:
+    """写主库后调用：这些 key（订单号、会话ID等）在 STICKY_SECONDS 内的读都走主库（仅限本进程）。"""
+    until = time.monotonic() + STICKY_SECONDS
+    with _lock:
+        for k in keys:
+            if k:
+                _sticky_until[k] = until
+        if len(_sticky_until) > 10000:
+            now = time.monotonic()
+            for k in [k for k, t in _sticky_until.items() if t < now]:
+                del _sticky_until[k]
+
+
+def _is_sticky(keys) -> bool:
+    now = time.monotonic()
+    with _lock:
+        return any(k and _sticky_until.get(k, 0) > now for k in keys)
+
+
+def _replica_order() -> List[int]:
+    """轮询起点后移一位，跳过仍在摘除期内的从库。"""
+    global _rr
+    now = time.monotonic()
+    with _lock:
+        start = _rr
+        _rr = (_rr + 1) % len(REPLICAS)
+        return [
+            i for i in ((start + j) % len(REPLICAS) for j in range(len(REPLICAS)))
+            if _down_until.get(i, 0) <= now
+        ]
+
+
+def _mark_down(i: int) -> None:
+    with _lock:
+        _down_until[i] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+@contextmanager
+def get_read_conn(*sticky_keys: Optional[str]):
+    """只读连接：轮询选择健康从库；无从库、全部不可用或 key 刚写过时回落主库。"""
+    if not REPLICAS or _is_sticky(sticky_keys):
+        with get_conn() as conn:
+            yield conn
+        return
+
+    conn = None
+    for i in _replica_order():
+        host, port = REPLICAS[i]
+        try:
+            conn = _connect(host, port, connect_timeout=2)
+            break
+        except pymysql.MySQLError:
+            _mark_down(i)
+    if conn is None:
+        with get_conn() as conn:
+            yield conn
+        return
+
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def check_replicas() -> List[Dict[str, object]]:
+    """逐个 ping 从库，刷新健康状态，返回 [{host, port, ok}]。"""
+    out = []
+    for i, (host, port) in enumerate(REPLICAS):
+        ok = True
+        try:
+            conn = _connect(host, port, connect_timeout=2)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            finally:
+                conn.close()
+            with _lock:
+                _down_until.pop(i, None)
+        except pymysql.MySQLError:
+            ok = False
+            _mark_down(i)
+        out.append({"host": host, "port": port, "ok": ok})
+    return out
+
+
+def start_replica_health_checker(interval: float = 10.0) -> Optional[threading.Thread]:
+    """后台定时 ping 从库，提前摘除/恢复节点；没有配置从库时不启动。"""
+    if not REPLICAS:
+        return None
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                check_replicas()
+            except Exception as e:
+                # 不能让一次意外异常结束巡检线程，否则摘除的从库再也不会被恢复
+                report_error("database", "replica_check_failed", e)
+
+    t = threading.Thread(target=_loop, name="replica-health", daemon=True)
+    t.start()
+    return t
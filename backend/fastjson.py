@@ -0,0 +1,59 @@
+# backend/fastjson.py
+"""快速 JSON 序列化与响应类。
+
+FastAPI 默认先用 jsonable_encoder 递归转换整个返回值（Decimal / datetime 走逐个 isinstance 判断），
+再 json.dumps 一遍；商品目录这种上万行的响应大部分时间都耗在这里。
+FastJSONResponse 直接把 dict / list 交给 orjson（未安装时回退到标准库 json），
+Decimal 和 datetime 在序列化时一次处理，转换规则与 jsonable_encoder 一致：
+- Decimal：没有小数部分的转 int，否则转 float；
+- datetime / date：ISO 8601 字符串。
+
+注意：端点直接 return 普通对象时 FastAPI 仍会先跑 jsonable_encoder，
+热点接口要 return FastJSONResponse(data) 才能完全绕开。
+"""
+import datetime
+import json
+from decimal import Decimal
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, Decimal):
+        return int(o) if o.as_tuple().exponent >= 0 else float(o)
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    if isinstance(o, bytes):
+        return o.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _OPTS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTS)
+
+    def loads(s: Any) -> Any:
+        return orjson.loads(s)
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+    def loads(s: Any) -> Any:
+        return json.loads(s)
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,243 @@
+# backend/idgen.py
+"""不依赖数据库的 ID 生成（Snowflake 风格：时间 + worker id + 序列号）。
+
+- 同一进程内单调递增；热路径只有一次 itertools.count 自增（CPython 下原子），
+  只有进入新的时间片或序列号用完时才加锁；
+- worker id 一律在本机用文件锁抢占，同机多进程互不冲突；fork 出的子进程会重新抢占。
+  多机部署时每台机器配置不重叠的号段 ID_WORKER_ID（起点）+ ID_WORKER_SPAN（个数，
+  不小于本机 worker 进程数），号段用完时启动报错而不是重复发号；
+- 时钟回拨时沿用上一个时间片继续发号，不会生成更小或重复的 ID。
+
+对外保持原有的前缀与格式：
+    订单号   20251223153000 + 6 位十六进制        new_order_no()
+    售后单号 AS + 10 位秒级时间戳 + 8 位数字       new_after_sale_no()
+    工单号   TK + 10 位秒级时间戳 + 8 位数字       new_ticket_no()
+券码由 backend/coupons.py 按号段发放，不走这里。
+
+AS / TK 原来是 10 位时间戳 + 3 位随机数，每秒只有 1000 个号且会撞号；现在末尾是 worker（8 bit）
+和序列号（16 bit）拼成的十进制数，最大 16777215，固定补齐 8 位，单号共 20 个字符。
+下游只按字符串整体使用：after_sales.after_sale_no 是 varchar(32)，工单号不落库，没有按位解析的地方。
+
+压测：python -m backend.idgen bench --threads 8 --procs 4 --n 200000
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 单号里只有 6 位十六进制（24 bit）留给 worker + 序列：8 bit worker，每秒每 worker 65536 个
+WORKER_BITS = 8
+SEQ_BITS = 16
+MAX_WORKERS = 1 << WORKER_BITS
+
+ID_WORKER_LOCK_DIR = os.getenv("ID_WORKER_LOCK_DIR", tempfile.gettempdir())
+
+_worker_lock_fd: Optional[int] = None
+
+
+def _try_lock(wid: int) -> Optional[int]:
+    path = os.path.join(ID_WORKER_LOCK_DIR, f"smart_mall_idgen_{wid}.lock")
+    fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _claim_worker_id() -> int:
+    """ID_WORKER_ID 给出本机号段起点（共 ID_WORKER_SPAN 个），否则整个 [0, MAX_WORKERS) 都可用；
+    号段内用文件锁抢一个空闲编号，抢不到说明编号已被本机其他进程占用，直接报错。"""
+    global _worker_lock_fd
+    env = os.getenv("ID_WORKER_ID")
+    if env:
+        base, span = int(env), int(os.getenv("ID_WORKER_SPAN", "1"))
+        if not (0 <= base and span >= 1 and base + span <= MAX_WORKERS):
+            raise ValueError(f"ID_WORKER_ID + ID_WORKER_SPAN must be within [0, {MAX_WORKERS}]")
+        candidates = list(range(base, base + span))
+    else:
+        start = os.getpid() % MAX_WORKERS
+        candidates = [(start + i) % MAX_WORKERS for i in range(MAX_WORKERS)]
+    if fcntl is None:
+        return candidates[0] if env else os.getpid() % MAX_WORKERS
+
+    if _worker_lock_fd is not None:
+        os.close(_worker_lock_fd)
+        _worker_lock_fd = None
+    for wid in candidates:
+        fd = _try_lock(wid)
+        if fd is not None:
+            _worker_lock_fd = fd  # 进程存活期间一直持有
+            return wid
+    if env:
+        raise RuntimeError(
+            f"id worker {candidates[0]}..{candidates[-1]} already claimed by another process on this host "
+            f"(ID_WORKER_ID={env}); raise ID_WORKER_SPAN to at least the number of worker processes"
+        )
+    raise RuntimeError(f"no free id worker slot in {ID_WORKER_LOCK_DIR} (max {MAX_WORKERS})")
+
+
+class Snowflake:
+    """tick_seconds 为时间片长度；生成 (时间片, worker, 序列号)，按此顺序比较即单调。"""
+
+    def __init__(self, worker_id: int, seq_bits: int = SEQ_BITS, tick_seconds: float = 1.0):
+        self.worker_id = worker_id
+        self.seq_max = 1 << seq_bits
+        self.tick_seconds = tick_seconds
+        self._lock = threading.Lock()
+        # (时间片, 该时间片内的序列号计数器)，整体替换，读取无需加锁
+        self._state: Tuple[int, "itertools.count[int]"] = (0, itertools.count())
+
+    def _now(self) -> int:
+        return int(time.time() / self.tick_seconds)
+
+    def next(self) -> Tuple[int, int]:
+        """返回 (时间片, 序列号)。"""
+        tick = self._now()
+        state = self._state
+        if state[0] == tick:
+            seq = next(state[1])
+            if seq < self.seq_max:
+                return tick, seq
+        return self._next_slow(tick)
+
+    def _next_slow(self, tick: int) -> Tuple[int, int]:
+        with self._lock:
+            cur_tick, counter = self._state
+            if cur_tick >= tick:
+                # 同一时间片（被别的线程抢先切换）或时钟回拨：继续用当前时间片
+                seq = next(counter)
+                if seq < self.seq_max:
+                    return cur_tick, seq
+                # 序列号用完：借用下一个时间片
+                tick = cur_tick + 1
+            self._state = (tick, itertools.count(1))
+            return tick, 0
+
+
+_gen: Optional[Snowflake] = None
+_gen_lock = threading.Lock()
+
+
+def _generator() -> Snowflake:
+    global _gen
+    if _gen is None:
+        with _gen_lock:
+            if _gen is None:
+                _gen = Snowflake(_claim_worker_id())
+    return _gen
+
+
+def _reset_after_fork() -> None:
+    global _gen, _gen_lock
+    _gen = None
+    _gen_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _next() -> Tuple[int, int, int]:
+    g = _generator()
+    tick, seq = g.next()
+    return tick, g.worker_id, seq
+
+
+def new_order_no() -> str:
+    tick, worker, seq = _next()
+    return datetime.fromtimestamp(tick).strftime("%Y%m%d%H%M%S") + f"{(worker << SEQ_BITS) | seq:06X}"
+
+
+def _numbered(prefix: str) -> str:
+    tick, worker, seq = _next()
+    return f"{prefix}{tick}{(worker << SEQ_BITS) | seq:08d}"
+
+
+def new_after_sale_no() -> str:
+    return _numbered("AS")
+
+
+def new_ticket_no() -> str:
+    return _numbered("TK")
+
+
+# ========== 压测：吞吐 + 唯一性 ==========
+def _bench_worker(n: int, threads: int) -> Tuple[List[str], float]:
+    per = n // threads
+    out: List[List[str]] = [[] for _ in range(threads)]
+
+    def run(i: int) -> None:
+        out[i] = [new_order_no() for _ in range(per)]
+
+    ts = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    ids = [x for chunk in out for x in chunk]
+    # 每个线程内必须严格递增（单号定长，字符串比较即数值比较）
+    for chunk in out:
+        if any(a >= b for a, b in zip(chunk, chunk[1:])):
+            raise AssertionError("ids not monotonic within a thread")
+    return ids, elapsed
+
+
+def bench(n: int, threads: int, procs: int) -> Dict[str, float]:
+    if procs <= 1:
+        ids, elapsed = _bench_worker(n, threads)
+        results = [(ids, elapsed)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(procs, mp_context=ctx) as pool:
+            results = list(pool.map(_bench_worker, [n] * procs, [threads] * procs))
+
+    total = sum(len(ids) for ids, _ in results)
+    unique = len({x for ids, _ in results for x in ids})
+    wall = max(e for _, e in results)
+    return {
+        "ids": total,
+        "unique": unique,
+        "duplicates": total - unique,
+        "seconds": round(wall, 3),
+        "ids_per_second": int(total / wall) if wall else 0,
+    }
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="ID 生成器")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="多线程 / 多进程压测吞吐与唯一性")
+    b.add_argument("--n", type=int, default=200000, help="每个进程生成的数量")
+    b.add_argument("--threads", type=int, default=8)
+    b.add_argument("--procs", type=int, default=1)
+    sub.add_parser("sample", help="打印各类单号示例")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "sample":
+        for fn in (new_order_no, new_after_sale_no, new_ticket_no):
+            print(f"{fn.__name__}: {fn()}")
+        return 0
+
+    r = bench(args.n, args.threads, args.procs)
+    print(r)
+    return 1 if r["duplicates"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
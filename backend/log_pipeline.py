@@ -0,0 +1,119 @@
+# backend/log_pipeline.py
+"""结构化、非阻塞的日志管道（不依赖 LangChain，后台任务可直接导入）。
+
+每条日志是一个 dict，经 QueueHandler 放入有界队列，由后台 QueueListener 按行写成 JSON
+到 stdout（或 AGENT_LOG_FILE）；队列满时丢弃并计数，不阻塞调用线程。
+agent_logging（Agent 运行日志）和 report_error（后台任务错误）共用这一条队列。
+
+后台任务（限流后端、券落库、看板刷新、归档、profiler、对话记录）出错时调用
+report_error("组件", "事件", e, ...)：写一条 level=ERROR 的事件并按 组件.事件 计数，
+计数见 /api/admin/error_stats。
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+AGENT_LOG_QUEUE_SIZE = int(os.getenv("AGENT_LOG_QUEUE_SIZE", "10000"))
+AGENT_LOG_FILE = os.getenv("AGENT_LOG_FILE", "")
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃，不阻塞调用线程。"""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 事件本身已是 dict，不需要 QueueHandler 默认的 format + 清空 args
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event = record.msg if isinstance(record.msg, dict) else {"message": record.getMessage()}
+        return json.dumps(event, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+_setup_lock = threading.Lock()
+_queue_handler: Optional[_DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """挂在共享队列上的 logger，不向 root 传播。"""
+    ensure_started()
+    log = logging.getLogger(name)
+    if _queue_handler not in log.handlers:
+        log.addHandler(_queue_handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+    return log
+
+
+def ensure_started() -> None:
+    global _queue_handler, _listener
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        if _queue_handler is None:
+            _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=AGENT_LOG_QUEUE_SIZE))
+        out = logging.FileHandler(AGENT_LOG_FILE, encoding="utf-8") if AGENT_LOG_FILE else logging.StreamHandler(sys.stdout)
+        out.setFormatter(_JsonFormatter())
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, out)
+        _listener.start()
+
+
+def shutdown() -> None:
+    """停止后台写线程并写完队列里剩余的事件。"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def queue_stats() -> Dict[str, int]:
+    return {
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+    }
+
+
+# ========== 后台任务错误 ==========
+_errors_lock = threading.Lock()
+_errors: Counter = Counter()
+
+
+def report_error(component: str, event: str, error: BaseException, **fields: Any) -> None:
+    """记一条后台任务错误事件，并按 组件.事件 计数。"""
+    with _errors_lock:
+        _errors[f"{component}.{event}"] += 1
+    rec = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "event": event,
+        "component": component,
+        "error": f"{type(error).__name__}: {error}",
+    }
+    rec.update({k: v for k, v in fields.items() if v is not None})
+    get_logger("smart_mall." + component).error(rec)
+
+
+def error_stats() -> Dict[str, int]:
+    with _errors_lock:
+        return dict(sorted(_errors.items()))
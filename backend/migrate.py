@@ -0,0 +1,106 @@
+# backend/migrate.py
+"""数据库结构版本化迁移。
+
+smart_mall.sql 是基线结构（版本 0），之后的结构变更按
+backend/migrations/NNNN_xxx.sql 递增编号存放，已执行的版本记录在 schema_migrations 表。
+
+用法：
+    python -m backend.migrate status
+    python -m backend.migrate up
+"""
+import os
+import re
+import sys
+from typing import List, Tuple
+
+from backend.database import get_conn
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+_FILE_RE = re.compile(r"^(\d{4})_([\w\-]+)\.sql$")
+
+
+def _ensure_table(cur) -> None:
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version int NOT NULL PRIMARY KEY,"
+        " name varchar(128) NOT NULL,"
+        " applied_at datetime NOT NULL DEFAULT CURRENT_TIMESTAMP"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    )
+
+
+def list_migrations() -> List[Tuple[int, str, str]]:
+    """返回 [(version, name, path)]，按版本号升序。"""
+    out = []
+    for fn in os.listdir(MIGRATIONS_DIR):
+        m = _FILE_RE.match(fn)
+        if m:
+            out.append((int(m.group(1)), m.group(2), os.path.join(MIGRATIONS_DIR, fn)))
+    out.sort()
+    return out
+
+
+def split_statements(sql: str) -> List[str]:
+    """按行尾分号切分语句，忽略 -- 注释行。"""
+    stmts, buf = [], []
+    for line in sql.splitlines():
+        if line.strip().startswith("--") or not line.strip():
+            continue
+        buf.append(line)
+        if line.rstrip().endswith(";"):
+            stmts.append("\n".join(buf).rstrip().rstrip(";"))
+            buf = []
+    if buf:
+        stmts.append("\n".join(buf))
+    return stmts
+
+
+def applied_versions() -> List[int]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_table(cur)
+            cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+            return [r["version"] for r in cur.fetchall()]
+
+
+def migrate_up() -> List[int]:
+    """依次执行未应用的迁移，返回本次执行的版本号。
+
+    MySQL 的 DDL 会隐式提交，因此每个迁移文件执行完立刻记录版本，失败时停在该版本。
+    """
+    done = set(applied_versions())
+    ran = []
+    for version, name, path in list_migrations():
+        if version in done:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            stmts = split_statements(f.read())
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                for stmt in stmts:
+                    cur.execute(stmt)
+                cur.execute(
+                    "INSERT INTO schema_migrations(version, name) VALUES(%s,%s)",
+                    (version, name),
+                )
+        ran.append(version)
+    return ran
+
+
+def main(argv: List[str]) -> int:
+    cmd = argv[0] if argv else "status"
+    if cmd == "up":
+        ran = migrate_up()
+        print("applied: " + (", ".join(f"{v:04d}" for v in ran) if ran else "nothing"))
+        return 0
+    if cmd == "status":
+        done = set(applied_versions())
+        for version, name, _ in list_migrations():
+            print(f"[{'x' if version in done else ' '}] {version:04d} {name}")
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
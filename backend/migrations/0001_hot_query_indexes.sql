@@ -0,0 +1,12 @@
+-- 0001: 热点查询索引
+-- after_sales 按 order_no 删除/查询退款记录
+ALTER TABLE `after_sales` ADD INDEX `idx_after_sales_order_no`(`order_no` ASC) USING BTREE;
+
+-- 按收件人 + 手机尾号找订单
+ALTER TABLE `orders` ADD INDEX `idx_orders_receiver_phone`(`receiver` ASC, `phone_tail` ASC) USING BTREE;
+
+-- 后台按状态 + 时间列表
+ALTER TABLE `orders` ADD INDEX `idx_orders_status_created`(`status` ASC, `created_at` ASC) USING BTREE;
+
+-- 前台商品列表：WHERE is_active=1 ORDER BY id DESC
+ALTER TABLE `products` ADD INDEX `idx_products_active_id`(`is_active` ASC, `id` ASC) USING BTREE;
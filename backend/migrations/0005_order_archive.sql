@@ -0,0 +1,9 @@
+-- 0005: 冷数据归档表（backend/archiver.py），结构与热表一致，另加归档时间
+CREATE TABLE `orders_archive` LIKE `orders`;
+ALTER TABLE `orders_archive` ADD COLUMN `archived_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE TABLE `order_items_archive` LIKE `order_items`;
+ALTER TABLE `order_items_archive` ADD COLUMN `archived_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE TABLE `after_sales_archive` LIKE `after_sales`;
+ALTER TABLE `after_sales_archive` ADD COLUMN `archived_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP;
@@ -0,0 +1,24 @@
+-- 0006: 订单 / 售后看板汇总表（backend/order_stats.py），随下单、退款、改状态、删除在同一事务内增量维护
+-- shop_id='' 的行是订单级汇总（gmv 取 total_amount），其余行按店铺拆分（gmv 取该店明细 price*qty 之和）
+CREATE TABLE `order_stats_daily`  (
+  `day` date NOT NULL,
+  `shop_id` varchar(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL DEFAULT '',
+  `status` varchar(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL,
+  `orders` int NOT NULL DEFAULT 0,
+  `gmv` decimal(16, 2) NOT NULL DEFAULT 0.00,
+  `updated_at` datetime(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+  PRIMARY KEY (`day`, `shop_id`, `status`) USING BTREE,
+  INDEX `idx_order_stats_daily_updated`(`updated_at` ASC) USING BTREE
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = DYNAMIC;
+
+CREATE TABLE `after_sale_stats_daily`  (
+  `day` date NOT NULL,
+  `type` varchar(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL,
+  `status` varchar(32) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL,
+  `cnt` int NOT NULL DEFAULT 0,
+  `updated_at` datetime(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+  PRIMARY KEY (`day`, `type`, `status`) USING BTREE,
+  INDEX `idx_after_sale_stats_daily_updated`(`updated_at` ASC) USING BTREE
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = DYNAMIC;
+
+-- 已有数据用 python -m backend.order_stats rebuild 回填
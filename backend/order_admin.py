@@ -0,0 +1,160 @@
+# backend/order_admin.py
+"""后台批量订单操作：批量改状态、流式导出。
+
+批量改状态按 BULK_CHUNK_SIZE 个订单号一组，每组一个事务：
+    SELECT ... WHERE order_no IN (...) FOR UPDATE   锁住并取当前状态
+    UPDATE ... WHERE order_no IN (...)              只更新允许流转的那部分
+不存在或不允许流转的订单逐个返回原因，不影响同组其它订单。
+
+导出按主键 keyset 分页（id > 上一页末尾 ORDER BY id LIMIT EXPORT_CHUNK_ROWS），每页一个短连接，
+边读边输出 NDJSON / CSV：内存占用与行数无关，不会整场导出占着一个从库连接，客户端断开后也不再读后续页。
+各页分别读取，导出期间被修改的订单按读到那一页时的状态输出。
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from backend import order_stats
+from backend.database import ORDER_LIST_KEY, get_conn, get_read_conn, mark_written
+from backend.tools.order_tools import invalidate_order_insight
+
+ORDER_STATUSES = {"PAID", "SHIPPED", "DELIVERED", "CANCELLED", "REFUNDING", "REFUNDED"}
+
+# 当前状态 -> 允许流转到的状态
+ALLOWED_TRANSITIONS: Dict[str, set] = {
+    "CREATED": {"PAID", "CANCELLED"},
+    "PAID": {"SHIPPED", "CANCELLED", "REFUNDING"},
+    "SHIPPED": {"DELIVERED", "REFUNDING"},
+    "DELIVERED": {"REFUNDING"},
+    "REFUNDING": {"REFUNDED", "PAID", "SHIPPED", "DELIVERED"},  # 退款驳回时退回原状态
+    "REFUNDED": set(),
+    "CANCELLED": set(),
+}
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+EXPORT_FLUSH_ROWS = 500
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+EXPORT_COLUMNS = ["id", "order_no", "status", "receiver", "phone_tail", "total_amount", "created_at"]
+
+
+def _chunks(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_transition(order_nos: List[str], status: str) -> Dict[str, Any]:
+    """批量把订单改成 status；返回 updated / unchanged / skipped（订单号 -> 原因）。"""
+    nos = list(dict.fromkeys(n.strip() for n in order_nos if n and n.strip()))
+    updated: List[str] = []
+    unchanged: List[str] = []
+    skipped: Dict[str, str] = {}
+
+    for chunk in _chunks(nos, BULK_CHUNK_SIZE):
+        marks = ",".join(["%s"] * len(chunk))
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT order_no, status FROM orders WHERE order_no IN ({marks}) FOR UPDATE", chunk)
+                current = {r["order_no"]: r["status"] for r in cur.fetchall()}
+
+                todo = []
+                for no in chunk:
+                    cur_status = current.get(no)
+                    if cur_status is None:
+                        skipped[no] = "order not found"
+                    elif cur_status == status:
+                        unchanged.append(no)
+                    elif status not in ALLOWED_TRANSITIONS.get(cur_status, set()):
+                        skipped[no] = f"transition {cur_status} -> {status} not allowed"
+                    else:
+                        todo.append(no)
+
+                if todo:
+                    facts = order_stats.capture(cur, todo)  # 已在上面 FOR UPDATE 锁住
+                    cur.execute(
+                        f"UPDATE orders SET status=%s WHERE order_no IN ({','.join(['%s'] * len(todo))})",
+                        [status, *todo],
+                    )
+                    order_stats.record_transition(cur, facts, status)
+        # 事务已提交
+        if todo:
+            mark_written(*todo, ORDER_LIST_KEY)
+            for no in todo:
+                invalidate_order_insight(no)
+            updated.extend(todo)
+
+    return {
+        "status": status,
+        "requested": len(nos),
+        "updated": len(updated),
+        "unchanged": len(unchanged),
+        "skipped": skipped,
+    }
+
+
+def _export_query(status: Optional[str], created_from: Optional[datetime], created_to: Optional[datetime],
+                  after_id: int, limit: int):
+    where, args = ["id>%s"], [after_id]
+    if status:
+        where.append("status=%s")
+        args.append(status)
+    if created_from:
+        where.append("created_at>=%s")
+        args.append(created_from)
+    if created_to:
+        where.append("created_at<%s")
+        args.append(created_to)
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM orders WHERE " + " AND ".join(where)
+    return sql + " ORDER BY id LIMIT %s", args + [limit]
+
+
+def _iter_rows(status, created_from, created_to) -> Iterator[Dict[str, Any]]:
+    """逐页读取，每页取完就归还连接，页与页之间不持有连接。"""
+    after_id, limit = 0, EXPORT_CHUNK_ROWS
+    while True:
+        sql, args = _export_query(status, created_from, created_to, after_id, limit)
+        with get_read_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, args)
+                rows = cur.fetchall()
+        yield from rows
+        if len(rows) < limit:
+            return
+        after_id = rows[-1]["id"]
+
+
+def _plain(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(row)
+    out["total_amount"] = float(out.get("total_amount") or 0)
+    out["created_at"] = str(out.get("created_at"))
+    return out
+
+
+def iter_export(fmt: str = "ndjson", status: Optional[str] = None,
+                created_from: Optional[datetime] = None, created_to: Optional[datetime] = None) -> Iterator[str]:
+    """按 fmt（ndjson / csv）逐块产出导出内容，每 EXPORT_FLUSH_ROWS 行一块。"""
+    buf = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        buf.write("\ufeff")  # 让 Excel 按 UTF-8 打开
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+
+    n = 0
+    for row in _iter_rows(status, created_from, created_to):
+        row = _plain(row)
+        if writer is not None:
+            writer.writerow([row[c] for c in EXPORT_COLUMNS])
+        else:
+            buf.write(json.dumps(row, ensure_ascii=False) + "\n")
+        n += 1
+        if n % EXPORT_FLUSH_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    tail = buf.getvalue()
+    if tail:
+        yield tail
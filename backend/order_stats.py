@@ -0,0 +1,617 @@
+# backend/order_stats.py
+"""订单 / 售后看板统计：汇总表增量维护 + NumPy 列式快照查询。
+
+写入侧（与业务写操作同一个事务）：
+- order_stats_daily：(下单日, 店铺, 状态) -> 订单数、GMV；shop_id='' 为订单级汇总；
+- after_sale_stats_daily：(申请日, 类型, 状态) -> 售后单数。
+下单、退款、改状态、删单在改动前用 capture() 取订单当前口径，改完后调用 record_* 把增量
+合并成一条 INSERT ... ON DUPLICATE KEY UPDATE 写回，统计与订单要么一起提交要么一起回滚。
+归档只是换表，不影响统计。
+
+读取侧：OrderStats 把两张汇总表加载成列式数组（字典编码的维度 + 日期序数拼成的排序键、数值矩阵及其前缀和），
+后台线程每 ORDER_STATS_REFRESH_SECONDS 秒按 updated_at 增量合并一次（本进程有写入时提前刷新），
+每 ORDER_STATS_FULL_RELOAD_SECONDS 秒全量重载一次。
+查询不访问数据库：各分组的区间合计是两次 searchsorted 加一次前缀和相减，日序列用 np.bincount。
+
+用法：
+    python -m backend.order_stats rebuild   # 从订单表（含归档表）重算汇总表，上线迁移后执行一次
+    python -m backend.order_stats check     # 对比汇总表与订单表，有偏差时返回 1
+    python -m backend.order_stats bench     # 快照查询耗时
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.database import get_conn, get_read_conn
+from backend.log_pipeline import report_error
+
+ORDER_STATS_REFRESH_SECONDS = float(os.getenv("ORDER_STATS_REFRESH_SECONDS", "5"))
+ORDER_STATS_FULL_RELOAD_SECONDS = float(os.getenv("ORDER_STATS_FULL_RELOAD_SECONDS", "600"))
+# 增量合并时多回看的秒数，覆盖长事务晚提交和从库复制延迟（行里存的是绝对值，重复合并无害）
+ORDER_STATS_OVERLAP_SECONDS = float(os.getenv("ORDER_STATS_OVERLAP_SECONDS", "60"))
+ORDER_STATS_DEFAULT_DAYS = int(os.getenv("ORDER_STATS_DEFAULT_DAYS", "30"))
+ORDER_STATS_MAX_DAYS = int(os.getenv("ORDER_STATS_MAX_DAYS", "3660"))
+ORDER_STATS_TOP_SHOPS = int(os.getenv("ORDER_STATS_TOP_SHOPS", "10"))
+
+ALL_SHOPS = ""
+REFUND_STATUSES = ("REFUNDING", "REFUNDED")
+# 不计入净 GMV 的状态
+NON_NET_STATUSES = REFUND_STATUSES + ("CANCELLED", "CANCELED")
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _marks(n: int) -> str:
+    return ",".join(["%s"] * n)
+
+
+# ========== 写入侧 ==========
+def capture(cur, order_nos: Iterable[str], lock: bool = False) -> Dict[str, Dict[str, Any]]:
+    """取订单当前口径：order_no -> {day, status, total, shops: {shop_id: 明细金额}}。
+
+    必须在改动之前、同一事务内调用；lock=True 时先 FOR UPDATE 锁住订单行，避免并发改状态重复记账。
+    """
+    nos = list(dict.fromkeys(order_nos))
+    if not nos:
+        return {}
+    marks = _marks(len(nos))
+    if lock:
+        cur.execute(f"SELECT id FROM orders WHERE order_no IN ({marks}) FOR UPDATE", nos)
+    cur.execute(
+        "SELECT o.order_no, o.status, DATE(o.created_at) AS day, o.total_amount, "
+        "i.shop_id, SUM(i.price * i.qty) AS amount "
+        f"FROM orders o LEFT JOIN order_items i ON i.order_id=o.id WHERE o.order_no IN ({marks}) "
+        "GROUP BY o.id, i.shop_id",
+        nos,
+    )
+    facts: Dict[str, Dict[str, Any]] = {}
+    for r in cur.fetchall():
+        f = facts.get(r["order_no"])
+        if f is None:
+            f = facts[r["order_no"]] = {
+                "day": r["day"], "status": r["status"], "total": float(r["total_amount"] or 0), "shops": {},
+            }
+        if r["shop_id"] is not None:
+            f["shops"][r["shop_id"]] = float(r["amount"] or 0)
+    return facts
+
+
+def capture_after_sales(cur, order_nos: Iterable[str]) -> List[Tuple[date, str, str]]:
+    """订单下全部售后单的 (申请日, 类型, 状态)，删单前调用。"""
+    nos = list(dict.fromkeys(order_nos))
+    if not nos:
+        return []
+    cur.execute(
+        f"SELECT DATE(created_at) AS day, type, status FROM after_sales WHERE order_no IN ({_marks(len(nos))})",
+        nos,
+    )
+    return [(r["day"], r["type"], r["status"]) for r in cur.fetchall()]
+
+
+class Delta:
+    """一个事务内累积的汇总表增量。"""
+
+    def __init__(self):
+        self.orders: Dict[Tuple[date, str, str], List[float]] = defaultdict(lambda: [0, 0.0])
+        self.after_sales: Dict[Tuple[date, str, str], int] = defaultdict(int)
+
+    def add_order(self, facts: Dict[str, Any], status: str, sign: int) -> None:
+        if facts["day"] is None:
+            return
+        for shop, amount in ((ALL_SHOPS, facts["total"]), *facts["shops"].items()):
+            acc = self.orders[(facts["day"], shop, status)]
+            acc[0] += sign
+            acc[1] += sign * amount
+
+    def add_after_sale(self, day: Optional[date], type_: str, status: str, sign: int) -> None:
+        if day is not None:
+            self.after_sales[(day, type_, status)] += sign
+
+    def flush(self, cur) -> None:
+        # 按主键排序写入，并发事务加行锁的顺序一致，避免互相死锁
+        rows = [(*k, n, round(g, 2)) for k, (n, g) in sorted(self.orders.items()) if n or round(g, 2)]
+        after_rows = [(*k, n) for k, n in sorted(self.after_sales.items()) if n]
+        if rows:
+            cur.executemany(
+                "INSERT INTO order_stats_daily(day, shop_id, status, orders, gmv) VALUES(%s,%s,%s,%s,%s) "
+                "ON DUPLICATE KEY UPDATE orders=orders+VALUES(orders), gmv=gmv+VALUES(gmv)",
+                rows,
+            )
+        if after_rows:
+            cur.executemany(
+                "INSERT INTO after_sale_stats_daily(day, type, status, cnt) VALUES(%s,%s,%s,%s) "
+                "ON DUPLICATE KEY UPDATE cnt=cnt+VALUES(cnt)",
+                after_rows,
+            )
+        if rows or after_rows:
+            ORDER_STATS.touch()
+
+
+def record_created(cur, order_nos: Iterable[str]) -> None:
+    """订单和明细插入之后调用。"""
+    d = Delta()
+    for f in capture(cur, order_nos).values():
+        d.add_order(f, f["status"], 1)
+    d.flush(cur)
+
+
+def record_transition(cur, facts: Dict[str, Dict[str, Any]], status: str) -> None:
+    """facts 为改状态前 capture() 的结果，只传实际被更新的订单。"""
+    d = Delta()
+    for f in facts.values():
+        if f["status"] != status:
+            d.add_order(f, f["status"], -1)
+            d.add_order(f, status, 1)
+    d.flush(cur)
+
+
+def record_deleted(cur, facts: Dict[str, Dict[str, Any]],
+                   after_sales: Iterable[Tuple[date, str, str]] = ()) -> None:
+    d = Delta()
+    for f in facts.values():
+        d.add_order(f, f["status"], -1)
+    for day, type_, status in after_sales:
+        d.add_after_sale(day, type_, status, -1)
+    d.flush(cur)
+
+
+def record_after_sale(cur, after_sale_no: str) -> None:
+    """售后单插入之后调用。"""
+    cur.execute("SELECT DATE(created_at) AS day, type, status FROM after_sales WHERE after_sale_no=%s",
+                (after_sale_no,))
+    r = cur.fetchone()
+    if r:
+        d = Delta()
+        d.add_after_sale(r["day"], r["type"], r["status"], 1)
+        d.flush(cur)
+
+
+# ========== 读取侧 ==========
+_DAY_BITS = 20   # date 序数（公元 1 年起）不超过 2^20
+_DIM_BITS = 20
+_DAY_MASK = (1 << _DAY_BITS) - 1
+_D0_SHIFT = _DIM_BITS + _DAY_BITS
+
+
+class _Frame:
+    """不可变的列式快照，刷新时整体替换，查询线程无需加锁。
+
+    行按复合键 (维度0, 维度1, day) 升序排列，cum 是数值列沿行方向的前缀和（首行补 0），
+    任意 (维度0, 维度1) 组合在日期区间内的合计 = cum[j] - cum[i]，i / j 由 searchsorted 得到。
+    rollup 是把维度1 合并掉的同结构快照（维度1 恒为 0），按维度0 排行时查询量与维度1 的取值数无关。
+    """
+
+    __slots__ = ("key", "day", "vals", "cum", "rollup")
+
+    def __init__(self, key: np.ndarray, vals: np.ndarray, rollup: bool = False):
+        self.key, self.vals = key, vals
+        self.day = key & _DAY_MASK
+        self.cum = np.vstack([np.zeros((1, vals.shape[1])), np.cumsum(vals, axis=0)])
+        self.rollup: Optional["_Frame"] = None
+        if rollup:
+            rk, inv = np.unique((key >> _D0_SHIFT << _D0_SHIFT) | self.day, return_inverse=True)
+            rv = np.stack([np.bincount(inv, weights=vals[:, c], minlength=len(rk)) for c in range(vals.shape[1])], axis=1)
+            self.rollup = _Frame(rk, rv)
+
+    @classmethod
+    def empty(cls, nvals: int, rollup: bool = False) -> "_Frame":
+        return cls(np.empty(0, np.int64), np.empty((0, nvals), np.float64), rollup)
+
+    def bounds(self, d0: np.ndarray, d1: np.ndarray, lo: int, hi: int) -> Tuple[np.ndarray, np.ndarray]:
+        prefix = (d0.astype(np.int64) << _D0_SHIFT) | (d1.astype(np.int64) << _DAY_BITS)
+        return np.searchsorted(self.key, prefix | lo, "left"), np.searchsorted(self.key, prefix | hi, "right")
+
+    def sums(self, d0: np.ndarray, d1: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        """每个 (d0[k], d1[k]) 在 [lo, hi] 内的合计，形状 (k, 数值列数)。"""
+        i, j = self.bounds(d0, d1, lo, hi)
+        return self.cum[j] - self.cum[i]
+
+    def rows(self, d0: np.ndarray, d1: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        """这些组合在 [lo, hi] 内的行下标。"""
+        i, j = self.bounds(d0, d1, lo, hi)
+        return np.concatenate([np.arange(a, b) for a, b in zip(i, j)]) if len(i) else np.empty(0, np.int64)
+
+
+class _Columns:
+    """一张汇总表 (day, 维度0, 维度1) -> 数值列 的列式快照。
+
+    底层数组按首次出现顺序追加（行下标稳定，增量合并只改对应行），
+    发布快照时按复合键排好序并算前缀和；取值没变时不重新发布。
+    """
+
+    def __init__(self, dims: Tuple[str, str], values: Tuple[str, ...], rollup: bool = False):
+        self.dims, self.values, self.with_rollup = dims, values, rollup
+        self.names: Tuple[List[str], List[str]] = ([], [])
+        self._codes: Tuple[Dict[str, int], Dict[str, int]] = ({}, {})
+        self._pos: Dict[int, int] = {}
+        self._key = np.empty(0, np.int64)
+        self._vals = np.empty((0, len(values)), np.float64)
+        self._order = np.empty(0, np.int64)
+        self.frame = _Frame.empty(len(values), rollup)
+
+    def code(self, k: int, name: str) -> int:
+        c = self._codes[k].get(name)
+        if c is None:
+            c = self._codes[k][name] = len(self.names[k])
+            self.names[k].append(name)
+        return c
+
+    def lookup(self, k: int, name: str) -> int:
+        return self._codes[k].get(name, -1)
+
+    def merge(self, rows: List[Dict[str, Any]], full: bool) -> bool:
+        """把汇总表行（绝对值）合并进快照；full=True 时整体替换。返回快照是否有变化。"""
+        if full:
+            self._pos = {}
+            self._key = np.empty(0, np.int64)
+            self._vals = np.empty((0, len(self.values)), np.float64)
+        pos, n = self._pos, len(self._key)
+        vals = self._vals.copy() if not full else self._vals
+        new_keys, new_vals = [], []
+        changed = full
+        for r in rows:
+            key = ((self.code(0, r[self.dims[0]]) << _D0_SHIFT)
+                   | (self.code(1, r[self.dims[1]]) << _DAY_BITS) | r["day"].toordinal())
+            v = [float(r[c] or 0) for c in self.values]
+            i = pos.get(key)
+            if i is None:
+                pos[key] = n + len(new_keys)
+                new_keys.append(key)
+                new_vals.append(v)
+            elif i >= n:
+                new_vals[i - n] = v
+            elif not np.array_equal(vals[i], v):
+                vals[i] = v
+                changed = True
+        if new_keys:
+            self._key = np.concatenate([self._key, np.asarray(new_keys, dtype=np.int64)])
+            vals = np.concatenate([vals, np.asarray(new_vals, dtype=np.float64)])
+            self._order = np.argsort(self._key, kind="stable")
+            changed = True
+        self._vals = vals
+        if changed:
+            self.frame = _Frame(self._key[self._order], vals[self._order], self.with_rollup)
+        return changed
+
+
+def _to_ordinal(v: Optional[date]) -> Optional[int]:
+    return v.toordinal() if v is not None else None
+
+
+def _days_iso(lo: int, n: int) -> List[str]:
+    return (np.arange(lo - _EPOCH_ORDINAL, lo - _EPOCH_ORDINAL + n).astype("datetime64[D]")).astype(str).tolist()
+
+
+class OrderStats:
+    def __init__(self):
+        self.orders = _Columns(("shop_id", "status"), ("orders", "gmv"), rollup=True)
+        self.after_sales = _Columns(("type", "status"), ("cnt",))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._dirty = threading.Event()
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._db_now: Optional[datetime] = None
+        self._loaded_at = 0.0
+        self._full_at = 0.0
+        self.stats: Dict[str, Any] = {
+            "refreshes": 0, "full_reloads": 0, "rows_merged": 0, "keys": 0,
+            "last_refresh_ms": 0.0, "last_refresh_at": None, "last_error": None,
+        }
+
+    # ----- 刷新 -----
+    def touch(self) -> None:
+        """本进程写过汇总表，后台线程提前刷新。"""
+        self._dirty.set()
+
+    def refresh(self, full: bool = False) -> None:
+        with self._refresh_lock:
+            t0 = time.perf_counter()
+            full = full or self._db_now is None or time.monotonic() - self._full_at >= ORDER_STATS_FULL_RELOAD_SECONDS
+            with get_read_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT NOW(3) AS now")
+                    db_now = cur.fetchone()["now"]
+                    if full:
+                        cur.execute("SELECT day, shop_id, status, orders, gmv FROM order_stats_daily")
+                        order_rows = cur.fetchall()
+                        cur.execute("SELECT day, type, status, cnt FROM after_sale_stats_daily")
+                        after_rows = cur.fetchall()
+                    else:
+                        since = self._db_now - timedelta(seconds=ORDER_STATS_OVERLAP_SECONDS)
+                        cur.execute(
+                            "SELECT day, shop_id, status, orders, gmv FROM order_stats_daily WHERE updated_at>=%s",
+                            (since,),
+                        )
+                        order_rows = cur.fetchall()
+                        cur.execute(
+                            "SELECT day, type, status, cnt FROM after_sale_stats_daily WHERE updated_at>=%s",
+                            (since,),
+                        )
+                        after_rows = cur.fetchall()
+            self.orders.merge(list(order_rows), full)
+            self.after_sales.merge(list(after_rows), full)
+            self._db_now = db_now
+            self._loaded_at = time.monotonic()
+            if full:
+                self._full_at = self._loaded_at
+            with self._lock:
+                self.stats["refreshes"] += 1
+                self.stats["full_reloads"] += int(full)
+                self.stats["rows_merged"] += len(order_rows) + len(after_rows)
+                self.stats["keys"] = len(self.orders.frame.day) + len(self.after_sales.frame.day)
+                self.stats["last_refresh_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+                self.stats["last_refresh_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            if self._dirty.wait(ORDER_STATS_REFRESH_SECONDS):
+                # 写入方在提交前 touch，稍等一下再读
+                self._stop.wait(0.2)
+                self._dirty.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+                err = None
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+                report_error("order_stats", "refresh_failed", e)
+            with self._lock:
+                self.stats["last_error"] = err
+
+    def start(self) -> None:
+        if ORDER_STATS_REFRESH_SECONDS <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="order-stats", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._dirty.set()
+        t, self._thread = self._thread, None
+        if t is not None:
+            t.join(timeout)
+
+    def _ensure_fresh(self) -> None:
+        # 后台线程关闭时查询前同步增量刷新；开启时只在首次查询前加载一次
+        if self._db_now is None or self._thread is None:
+            self.refresh()
+
+    # ----- 查询 -----
+    def query(self, date_from: Optional[date] = None, date_to: Optional[date] = None,
+              shop_id: Optional[str] = None, top_shops: int = ORDER_STATS_TOP_SHOPS) -> Dict[str, Any]:
+        """[date_from, date_to] 闭区间的看板指标；默认最近 ORDER_STATS_DEFAULT_DAYS 天。日期不合法时抛 ValueError。"""
+        self._ensure_fresh()
+        t0 = time.perf_counter()
+        hi = _to_ordinal(date_to) or date.today().toordinal()
+        lo = _to_ordinal(date_from) or hi - ORDER_STATS_DEFAULT_DAYS + 1
+        if lo > hi:
+            raise ValueError("date_from must not be after date_to")
+        if hi - lo + 1 > ORDER_STATS_MAX_DAYS:
+            raise ValueError(f"date range too large (max {ORDER_STATS_MAX_DAYS} days)")
+        span = hi - lo + 1
+
+        cols = self.orders
+        f = cols.frame
+        statuses = cols.names[1][:]
+        st = np.arange(len(statuses))
+        shop = np.full(len(st), cols.lookup(0, shop_id if shop_id else ALL_SHOPS))
+
+        by = f.sums(shop, st, lo, hi)  # (状态数, [orders, gmv])
+        idx = f.rows(shop, st, lo, hi)
+        daily_orders = np.bincount(f.day[idx] - lo, weights=f.vals[idx, 0], minlength=span)
+        daily_gmv = np.bincount(f.day[idx] - lo, weights=f.vals[idx, 1], minlength=span)
+
+        refund_mask = np.array([name in REFUND_STATUSES for name in statuses], dtype=bool)
+        non_net_mask = np.array([name in NON_NET_STATUSES for name in statuses], dtype=bool)
+        total_orders = int(round(by[:, 0].sum()))
+        gmv = float(by[:, 1].sum())
+        refund_orders = int(round(by[refund_mask, 0].sum()))
+
+        out: Dict[str, Any] = {
+            "date_from": date.fromordinal(lo).isoformat(),
+            "date_to": date.fromordinal(hi).isoformat(),
+            "shop_id": shop_id,
+            "orders": total_orders,
+            "gmv": round(gmv, 2),
+            "net_gmv": round(gmv - float(by[non_net_mask, 1].sum()), 2),
+            "avg_order_value": round(gmv / total_orders, 2) if total_orders else 0.0,
+            "refund_orders": refund_orders,
+            "refund_rate": round(refund_orders / total_orders, 4) if total_orders else 0.0,
+            "by_status": {
+                statuses[i]: {"orders": int(round(by[i, 0])), "gmv": round(float(by[i, 1]), 2)}
+                for i in np.flatnonzero(np.round(by[:, 0]))
+            },
+            "daily": {
+                "day": _days_iso(lo, span),
+                "orders": np.rint(daily_orders).astype(np.int64).tolist(),
+                "gmv": np.round(daily_gmv, 2).tolist(),
+            },
+        }
+
+        if not shop_id:
+            # 各店铺的区间合计（不分状态），取 GMV 前 N
+            shops = np.arange(len(cols.names[0]))
+            shops = shops[shops != cols.lookup(0, ALL_SHOPS)]
+            per_shop = f.rollup.sums(shops, np.zeros_like(shops), lo, hi)
+            top = np.argsort(-per_shop[:, 1], kind="stable")[:top_shops]
+            out["top_shops"] = [
+                {"shop_id": cols.names[0][shops[i]], "orders": int(round(per_shop[i, 0])),
+                 "gmv": round(float(per_shop[i, 1]), 2)}
+                for i in top if per_shop[i, 0] >= 0.5
+            ]
+
+            # 售后不分店铺，只在全店视图里返回
+            a = self.after_sales
+            types, a_status = len(a.names[0]), len(a.names[1])
+            counts = a.frame.sums(np.repeat(np.arange(types), a_status), np.tile(np.arange(a_status), types), lo, hi)[:, 0]
+            by_type: Dict[str, Dict[str, int]] = {}
+            for c in np.flatnonzero(np.round(counts)):
+                by_type.setdefault(a.names[0][c // a_status], {})[a.names[1][c % a_status]] = int(round(counts[c]))
+            after_total = int(round(counts.sum()))
+            out["after_sales"] = {
+                "total": after_total,
+                "per_order": round(after_total / total_orders, 4) if total_orders else 0.0,
+                "by_type": by_type,
+            }
+
+        out["snapshot_age_ms"] = round((time.monotonic() - self._loaded_at) * 1000, 1)
+        out["query_us"] = round((time.perf_counter() - t0) * 1e6, 1)
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, refresh_seconds=ORDER_STATS_REFRESH_SECONDS)
+
+
+ORDER_STATS = OrderStats()
+
+
+# ========== 回填 / 校验 ==========
+# 热表和归档表各自分组后再合并（一个订单只会在其中一处）
+_REBUILD_ORDERS = """
+SELECT day, '' AS shop_id, status, SUM(n) AS orders, SUM(g) AS gmv FROM (
+  SELECT DATE(created_at) AS day, status, COUNT(*) AS n, SUM(total_amount) AS g
+  FROM orders WHERE created_at IS NOT NULL GROUP BY DATE(created_at), status
+  UNION ALL
+  SELECT DATE(created_at) AS day, status, COUNT(*) AS n, SUM(total_amount) AS g
+  FROM orders_archive WHERE created_at IS NOT NULL GROUP BY DATE(created_at), status
+) x GROUP BY day, status
+UNION ALL
+SELECT day, shop_id, status, SUM(n) AS orders, SUM(g) AS gmv FROM (
+  SELECT DATE(o.created_at) AS day, i.shop_id, o.status, COUNT(DISTINCT o.id) AS n, SUM(i.price * i.qty) AS g
+  FROM orders o JOIN order_items i ON i.order_id=o.id WHERE o.created_at IS NOT NULL
+  GROUP BY DATE(o.created_at), i.shop_id, o.status
+  UNION ALL
+  SELECT DATE(o.created_at) AS day, i.shop_id, o.status, COUNT(DISTINCT o.id) AS n, SUM(i.price * i.qty) AS g
+  FROM orders_archive o JOIN order_items_archive i ON i.order_id=o.id WHERE o.created_at IS NOT NULL
+  GROUP BY DATE(o.created_at), i.shop_id, o.status
+) y GROUP BY day, shop_id, status
+"""
+
+_REBUILD_AFTER_SALES = """
+SELECT day, type, status, SUM(n) AS cnt FROM (
+  SELECT DATE(created_at) AS day, type, status, COUNT(*) AS n FROM after_sales GROUP BY DATE(created_at), type, status
+  UNION ALL
+  SELECT DATE(created_at) AS day, type, status, COUNT(*) AS n FROM after_sales_archive
+  GROUP BY DATE(created_at), type, status
+) x GROUP BY day, type, status
+"""
+
+
+def rebuild() -> Dict[str, int]:
+    """一个事务内清空并重算两张汇总表。INSERT ... SELECT 会给源表加共享锁，期间的下单 / 改状态会等它提交。"""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM order_stats_daily")
+            cur.execute(f"INSERT INTO order_stats_daily(day, shop_id, status, orders, gmv) {_REBUILD_ORDERS}")
+            orders = cur.rowcount
+            cur.execute("DELETE FROM after_sale_stats_daily")
+            cur.execute(f"INSERT INTO after_sale_stats_daily(day, type, status, cnt) {_REBUILD_AFTER_SALES}")
+            after_sales = cur.rowcount
+    return {"order_rows": orders, "after_sale_rows": after_sales}
+
+
+def check() -> List[str]:
+    """汇总表与从订单表现算的结果逐键对比，返回不一致的描述（计数为 0 的行视为不存在）。"""
+    def as_map(rows, dims, values):
+        out = {}
+        for r in rows:
+            v = tuple(round(float(r[c] or 0), 2) for c in values)
+            if any(v):
+                out[(str(r["day"]), *(r[d] for d in dims))] = v
+        return out
+
+    diffs = []
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            for table, sql, dims, values in (
+                ("order_stats_daily", _REBUILD_ORDERS, ("shop_id", "status"), ("orders", "gmv")),
+                ("after_sale_stats_daily", _REBUILD_AFTER_SALES, ("type", "status"), ("cnt",)),
+            ):
+                cur.execute(sql)
+                expected = as_map(cur.fetchall(), dims, values)
+                cur.execute(f"SELECT day, {', '.join(dims)}, {', '.join(values)} FROM {table}")
+                actual = as_map(cur.fetchall(), dims, values)
+                for key in sorted(expected.keys() | actual.keys()):
+                    if expected.get(key) != actual.get(key):
+                        diffs.append(f"{table} {key}: expected {expected.get(key)}, got {actual.get(key)}")
+    return diffs
+
+
+def _fake_load(stats: OrderStats, days: int, shops: int) -> None:
+    rng = np.random.default_rng(0)
+    today = date.today()
+    statuses = ["PAID", "SHIPPED", "DELIVERED", "REFUNDING", "REFUNDED", "CANCELLED"]
+    order_rows, after_rows = [], []
+    for d in range(days):
+        day = today - timedelta(days=d)
+        for st in statuses:
+            n = int(rng.integers(0, 500))
+            order_rows.append({"day": day, "shop_id": ALL_SHOPS, "status": st, "orders": n, "gmv": n * 199.0})
+            for s in range(shops):
+                order_rows.append({"day": day, "shop_id": f"S{s:04d}", "status": st,
+                                   "orders": n // shops, "gmv": n * 199.0 / shops})
+        after_rows.append({"day": day, "type": "REFUND", "status": "CREATED", "cnt": int(rng.integers(0, 50))})
+    stats.orders.merge(order_rows, True)
+    stats.after_sales.merge(after_rows, True)
+    stats._db_now = datetime.now()
+    stats._loaded_at = time.monotonic()
+
+
+def bench(days: int, shops: int, repeat: int) -> Dict[str, Any]:
+    """造一份内存快照（不连库），测区间查询耗时。"""
+    stats = OrderStats()
+    _fake_load(stats, days, shops)
+    stats._thread = threading.current_thread()  # 跳过查询前的同步刷新
+    out: Dict[str, Any] = {"rows": len(stats.orders.frame.day)}
+    for name, kw in (
+        ("last_30_days_us", {}),
+        ("last_365_days_us", {"date_from": date.today() - timedelta(days=364)}),
+        ("one_shop_365_days_us", {"date_from": date.today() - timedelta(days=364), "shop_id": "S0001"}),
+    ):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            stats.query(**kw)
+            best = min(best, time.perf_counter() - t0)
+        out[name] = round(best * 1e6, 1)
+    return out
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="订单 / 售后看板汇总表")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild", help="从订单表（含归档表）重算汇总表")
+    sub.add_parser("check", help="对比汇总表与订单表")
+    b = sub.add_parser("bench", help="快照查询耗时（内存造数，不连库）")
+    b.add_argument("--days", type=int, default=730)
+    b.add_argument("--shops", type=int, default=200)
+    b.add_argument("--repeat", type=int, default=50, help="取最快一次")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "rebuild":
+        print(json.dumps(rebuild()))
+    elif args.cmd == "check":
+        diffs = check()
+        for d in diffs[:50]:
+            print(d)
+        print(f"{len(diffs)} mismatch(es)")
+        return 1 if diffs else 0
+    else:
+        print(json.dumps(bench(args.days, args.shops, args.repeat)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
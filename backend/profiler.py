@@ -0,0 +1,229 @@
+# backend/profiler.py
+"""按需的单请求性能剖析。
+
+开启方式（二选一）：
+- 请求头 X-Profile: sample | cprofile，且 X-Profile-Token 与 PROFILE_TOKEN 一致（未配置 PROFILE_TOKEN 时忽略该请求头）；
+- 按比例抽样：PROFILE_SAMPLE_RATE（0~1，默认 0），只对 PROFILE_PATHS 里的路径生效（默认 /chat）。
+
+两种模式：
+- sample（默认）：后台线程每 PROFILE_INTERVAL_MS 毫秒抓一次请求线程的调用栈，开销与函数调用次数无关；
+  产物是 folded stacks（<request_id>.folded），可直接喂给 flamegraph.pl / speedscope；
+- cprofile：确定性剖析，产物是 <request_id>.pstats，开销较大，只适合偶尔排查，且只对加了 @profiled 的端点生效。
+
+同步端点在线程池里执行，需要加 @profiled 才能定位到真正干活的线程；
+未加装饰器的端点按事件循环线程采样（async 端点正好在这里执行）。
+产物写到 PROFILE_DIR，只保留最近 PROFILE_KEEP 个。剖析 id 由服务端生成，通过响应头 X-Profile-Id 返回；
+客户端带的 X-Request-Id 只记在元数据里（client_request_id）便于关联，不参与文件命名。
+"""
+import contextvars
+import cProfile
+import functools
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.log_pipeline import report_error
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BASE_DIR, "data", "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_PATHS = [p.strip() for p in os.getenv("PROFILE_PATHS", "/chat").split(",") if p.strip()]
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+MODES = ("sample", "cprofile")
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_EXTS = (".folded", ".pstats")
+
+_current: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar("profile_session", default=None)
+
+
+def _frame_label(frame) -> str:
+    co = frame.f_code
+    return f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})"
+
+
+class ProfileSession:
+    """一次请求的剖析；sample 模式下起一个采样线程，cprofile 模式在 @profiled 内开关。"""
+
+    def __init__(self, request_id: str, mode: str, method: str, path: str, client_request_id: Optional[str] = None):
+        self.request_id = request_id
+        self.client_request_id = client_request_id
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.started_ts = time.time()
+        self.started_at = datetime.fromtimestamp(self.started_ts).strftime("%Y-%m-%d %H:%M:%S")
+        self.samples: Counter = Counter()
+        self.profile: Optional[cProfile.Profile] = None
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._t0 = time.perf_counter()
+        self.duration_ms = 0
+
+    def start(self) -> None:
+        if self.mode == "sample":
+            self._thread = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000.0
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def attach(self) -> int:
+        """把采样目标切到当前线程，返回原目标以便恢复。"""
+        prev, self._target = self._target, threading.get_ident()
+        return prev
+
+    def detach(self, prev: int) -> None:
+        self._target = prev
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self.duration_ms = int((time.perf_counter() - self._t0) * 1000)
+
+    def save(self) -> Optional[Dict[str, Any]]:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.request_id)
+        if self.mode == "cprofile":
+            if self.profile is None:
+                return None
+            self.profile.dump_stats(base + ".pstats")
+            artifact = base + ".pstats"
+            samples = None
+        else:
+            if not self.samples:
+                return None
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for stack, n in self.samples.most_common():
+                    f.write(f"{stack} {n}\n")
+            artifact = base + ".folded"
+            samples = sum(self.samples.values())
+        meta = {
+            "request_id": self.request_id,
+            "client_request_id": self.client_request_id,
+            "mode": self.mode,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "started_ts": self.started_ts,
+            "duration_ms": self.duration_ms,
+            "samples": samples,
+            "file": os.path.basename(artifact),
+        }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        _prune()
+        return meta
+
+
+def decide(path: str, headers) -> Optional[str]:
+    """返回本次请求的剖析模式，不剖析返回 None。"""
+    mode = (headers.get("x-profile") or "").strip().lower()
+    if mode and PROFILE_TOKEN and hmac.compare_digest(headers.get("x-profile-token") or "", PROFILE_TOKEN):
+        return mode if mode in MODES else "sample"
+    if PROFILE_SAMPLE_RATE > 0 and path in PROFILE_PATHS and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def begin(mode: str, method: str, path: str, client_request_id: Optional[str] = None) -> ProfileSession:
+    client_rid = client_request_id if client_request_id and _ID_RE.match(client_request_id) else None
+    session = ProfileSession(uuid.uuid4().hex, mode, method, path, client_rid)
+    session.start()
+    _current.set(session)
+    return session
+
+
+def finish(session: ProfileSession) -> Optional[Dict[str, Any]]:
+    session.stop()
+    try:
+        return session.save()
+    except OSError as e:
+        report_error("profiler", "save_failed", e, request_id=session.request_id)
+        return None
+
+
+def profiled(fn: Callable) -> Callable:
+    """同步端点用：让采样 / cProfile 落在线程池里实际执行端点的线程上。"""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        session = _current.get()
+        if session is None:
+            return fn(*args, **kwargs)
+        if session.mode == "cprofile":
+            session.profile = session.profile or cProfile.Profile()
+            session.profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                session.profile.disable()
+        prev = session.attach()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            session.detach(prev)
+
+    return wrapper
+
+
+def _list_meta() -> List[Dict[str, Any]]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    out.sort(key=lambda m: m.get("started_ts") or 0, reverse=True)
+    return out
+
+
+def _prune() -> None:
+    for meta in _list_meta()[PROFILE_KEEP:]:
+        base = os.path.join(PROFILE_DIR, meta["request_id"])
+        for ext in _EXTS + (".json",):
+            try:
+                os.remove(base + ext)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    return _list_meta()
+
+
+def artifact_path(request_id: str) -> Optional[str]:
+    if not _ID_RE.match(request_id or ""):
+        return None
+    for ext in _EXTS:
+        p = os.path.join(PROFILE_DIR, request_id + ext)
+        if os.path.isfile(p):
+            return p
+    return None
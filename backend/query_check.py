@@ -0,0 +1,250 @@
+# backend/query_check.py
+"""SQL 执行计划回归检查。
+
+静态扫描 CHECKED_MODULES 里所有 cur.execute(...) 的 SQL（含 f-string：IN 占位符、
+模块常量、热表 / 归档表名都会展开），对其中的 SELECT / UPDATE / DELETE 执行 EXPLAIN，
+若某条语句在超过阈值行数的表上走全表扫描（type=ALL）则判定失败；展开不了又没登记在
+UNANALYZABLE_OK 里的语句同样判失败。进程以非 0 退出，可直接挂到 CI。
+
+用法（请在本地测试库执行，--seed 会写入 QC 前缀的造数数据）：
+    python -m backend.query_check --seed 5000
+    python -m backend.query_check --max-rows 1000
+    python -m backend.query_check --cleanup
+"""
+import argparse
+import ast
+import os
+import re
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+from backend.database import get_conn
+from backend.tools.order_tools import ORDER_TABLES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHECKED_MODULES = [
+    os.path.join(BASE_DIR, "api_server.py"),
+    os.path.join(BASE_DIR, "tools", "order_tools.py"),
+    os.path.join(BASE_DIR, "tools", "product_tools.py"),
+    os.path.join(BASE_DIR, "coupons.py"),
+    os.path.join(BASE_DIR, "checkout.py"),
+    os.path.join(BASE_DIR, "order_stats.py"),
+    os.path.join(BASE_DIR, "order_admin.py"),
+    os.path.join(BASE_DIR, "archiver.py"),
+    os.path.join(BASE_DIR, "transcripts.py"),
+]
+
+# f-string 里的表名变量，按取值逐一展开（热表 + 归档表）
+TEMPLATE_VALUES = {
+    "orders_table": [orders for orders, _ in ORDER_TABLES],
+    "items_table": [items for _, items in ORDER_TABLES],
+}
+
+# 无法静态展开、已人工确认的语句：(文件, SQL 片段)
+UNANALYZABLE_OK = [
+    ("archiver.py", "FROM {table} WHERE {where}"),  # _move：where 是 id / order_id IN (...)，走主键或外键索引
+    ("order_stats.py", "FROM {table}"),             # check：逐张读汇总表，同 ALLOW_FULL_SCAN
+    ("order_stats.py", "{sql}"),                    # check：即 _REBUILD_*，全量重算，按设计扫全表
+    ("order_admin.py", "{sql}"),                    # 导出：_export_query 拼条件，按 id keyset 分页
+    ("transcripts.py", "{ddl}"),                    # SQLite 建表
+    ("transcripts.py", "{_insert_sql("),            # 只有 INSERT
+]
+
+MAX_FULL_SCAN_ROWS = int(os.getenv("QUERY_CHECK_MAX_SCAN_ROWS", "1000"))
+
+# 按设计就要扫全表的语句（SQL 片段），不算回归
+ALLOW_FULL_SCAN = [
+    "FROM products WHERE is_active=1 ORDER BY id DESC",  # /api/products 全量商品目录
+    "REPLACE(title, ' ', '') LIKE",                       # 商品名模糊搜索，前导通配符无法走索引
+    "FROM order_stats_daily",                             # 看板快照加载 / 重算，汇总表按天聚合、行数有限
+    "FROM after_sale_stats_daily",
+]
+
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+_WRITE_ONLY = ("INSERT", "REPLACE", "CREATE")
+_LIMIT_PARAM_RE = re.compile(r"(LIMIT\s+)%s", re.IGNORECASE)
+_HOLE_RE = re.compile(r"\{[^{}]+\}")
+
+
+def _string_names(nodes: Iterable[ast.AST]) -> Dict[str, str]:
+    """直接赋值的字符串常量（如 _REBUILD_ORDERS）和占位符串（marks = _marks(n)）。"""
+    out = {}
+    for node in nodes:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)):
+            continue
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            out[node.targets[0].id] = node.value.value
+        elif _is_placeholders(node.value):
+            out[node.targets[0].id] = "%s"
+    return out
+
+
+def _is_placeholders(node: ast.expr) -> bool:
+    """_marks(n) 或 ",".join(["%s"] * n)：渲染成单个 %s。"""
+    if not isinstance(node, ast.Call):
+        return False
+    if isinstance(node.func, ast.Name) and node.func.id == "_marks":
+        return True
+    if isinstance(node.func, ast.Attribute) and node.func.attr == "join" and len(node.args) == 1:
+        arg = node.args[0]
+        return (isinstance(arg, ast.BinOp) and isinstance(arg.op, ast.Mult) and isinstance(arg.left, ast.List)
+                and [ast.literal_eval(e) for e in arg.left.elts] == ["%s"])
+    return False
+
+
+def _render(node: ast.expr, names: Dict[str, str]) -> List[str]:
+    """把 execute 的第一个参数展开成可能的 SQL 文本；无法静态确定的部分保留为 {源码}。"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.JoinedStr):
+        out = [""]
+        for part in node.values:
+            pieces = _render(part.value if isinstance(part, ast.FormattedValue) else part, names)
+            out = [a + b for a in out for b in pieces]
+        return out
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return [a + b for a in _render(node.left, names) for b in _render(node.right, names)]
+    if _is_placeholders(node):
+        return ["%s"]
+    if isinstance(node, ast.Name):
+        if node.id in names:
+            return [names[node.id]]
+        if node.id in TEMPLATE_VALUES:
+            return list(TEMPLATE_VALUES[node.id])
+    return ["{" + ast.unparse(node) + "}"]
+
+
+def collect_statements(paths: List[str] = None) -> List[Tuple[str, int, str]]:
+    """返回 [(文件, 行号, SQL)]。f-string / 字符串拼接按 TEMPLATE_VALUES 展开成多条，
+    展开不了的部分以 {源码} 留在 SQL 里，由 check() 判为无法分析。"""
+    out = []
+    for path in paths or CHECKED_MODULES:
+        with open(path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        module_names = _string_names(tree.body)
+        # 每个 execute 调用用它所在（最内层）函数的局部赋值 + 模块常量来展开
+        names_of: Dict[ast.Call, Dict[str, str]] = {}
+        for scope in [tree] + [n for n in ast.walk(tree) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]:
+            names = module_names if scope is tree else {**module_names, **_string_names(ast.walk(scope))}
+            for node in ast.walk(scope):
+                if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                        and node.func.attr in ("execute", "executemany") and node.args):
+                    names_of[node] = names
+        where = os.path.relpath(path, BASE_DIR)
+        for node, names in sorted(names_of.items(), key=lambda kv: kv[0].lineno):
+            for sql in dict.fromkeys(_render(node.args[0], names)):
+                out.append((where, node.lineno, sql))
+    return out
+
+
+def unanalyzable(where: str, sql: str) -> bool:
+    """SQL 里还有未展开的 {源码}，且不是纯写入语句、也不在 UNANALYZABLE_OK 里。"""
+    if not _HOLE_RE.search(sql) or sql.lstrip().upper().startswith(_WRITE_ONLY):
+        return False
+    return not any(where == f and frag in sql for f, frag in UNANALYZABLE_OK)
+
+
+def _bind_dummy(sql: str) -> str:
+    """把 %s 占位符替换成可 EXPLAIN 的字面量：LIMIT 用数字，其余用字符串。"""
+    sql = _LIMIT_PARAM_RE.sub(r"\g<1>10", sql)
+    return sql.replace("%s", "'0'")
+
+
+def _table_rows(cur, table: str, cache: Dict[str, int]) -> int:
+    if table not in cache:
+        cur.execute(f"SELECT COUNT(*) AS n FROM `{table}`")
+        cache[table] = int(cur.fetchone()["n"])
+    return cache[table]
+
+
+def check(max_rows: int = MAX_FULL_SCAN_ROWS) -> List[str]:
+    """返回失败信息列表，空列表表示全部通过。"""
+    failures = []
+    sizes: Dict[str, int] = {}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            for where, lineno, sql in collect_statements():
+                if unanalyzable(where, sql):
+                    failures.append(f"{where}:{lineno} 无法静态分析的 SQL: {' '.join(sql.split())}")
+                    continue
+                if _HOLE_RE.search(sql) or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+                    continue
+                if any(frag in sql for frag in ALLOW_FULL_SCAN):
+                    continue
+                cur.execute("EXPLAIN " + _bind_dummy(sql))
+                for row in cur.fetchall():
+                    table = row.get("table")
+                    if row.get("type") != "ALL" or not table or table.startswith("<"):
+                        continue
+                    n = _table_rows(cur, table, sizes)
+                    if n > max_rows:
+                        failures.append(f"{where}:{lineno} 全表扫描 {table}（{n} 行）: {' '.join(sql.split())}")
+    return failures
+
+
+def seed(n: int) -> None:
+    """造 n 个商品/订单（含明细与售后单），前缀 QC，便于 --cleanup 清理。"""
+    products = [
+        (f"QC{i:08d}", f"QS{i % 50:04d}", f"造数商品{i}", "测试", 9.9 + i % 100, "造数", "{}", 1 if i % 10 else 0)
+        for i in range(n)
+    ]
+    orders = [
+        (f"QC{i:012d}", ("PAID", "SHIPPED", "DELIVERED", "REFUNDED")[i % 4], f"收件人{i % 997}", f"{i % 10000:04d}", 9.9)
+        for i in range(n)
+    ]
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO products(product_id, shop_id, title, category, price, description, specs_json, is_active) "
+                "VALUES(%s,%s,%s,%s,%s,%s,%s,%s)",
+                products,
+            )
+            cur.executemany(
+                "INSERT INTO orders(order_no, status, receiver, phone_tail, total_amount) VALUES(%s,%s,%s,%s,%s)",
+                orders,
+            )
+            cur.execute("SELECT id, order_no FROM orders WHERE order_no LIKE 'QC%'")
+            rows = cur.fetchall()
+            cur.executemany(
+                "INSERT INTO order_items(order_id, product_id, shop_id, title, price, qty) VALUES(%s,%s,%s,%s,%s,%s)",
+                [(r["id"], "QC00000000", "QS0000", "造数商品", 9.9, 1) for r in rows],
+            )
+            cur.executemany(
+                "INSERT INTO after_sales(after_sale_no, order_no, type, reason, status) VALUES(%s,%s,%s,%s,%s)",
+                [("QCAS" + r["order_no"][2:], r["order_no"], "REFUND", "造数", "CREATED") for r in rows[::4]],
+            )
+            cur.execute("ANALYZE TABLE products, orders, order_items, after_sales")
+            cur.fetchall()
+
+
+def cleanup() -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM after_sales WHERE order_no LIKE 'QC%'")
+            cur.execute("DELETE FROM orders WHERE order_no LIKE 'QC%'")  # order_items 级联删除
+            cur.execute("DELETE FROM products WHERE product_id LIKE 'QC%'")
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="EXPLAIN 全表扫描回归检查")
+    ap.add_argument("--seed", type=int, default=0, help="先造 N 条数据")
+    ap.add_argument("--cleanup", action="store_true", help="删除 QC 造数数据后退出")
+    ap.add_argument("--max-rows", type=int, default=MAX_FULL_SCAN_ROWS, help="超过该行数的表禁止全表扫描")
+    args = ap.parse_args(argv)
+
+    if args.cleanup:
+        cleanup()
+        return 0
+    if args.seed:
+        seed(args.seed)
+
+    failures = check(args.max_rows)
+    for f in failures:
+        print("FAIL " + f)
+    print(f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
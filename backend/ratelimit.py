@@ -0,0 +1,249 @@
+# backend/ratelimit.py
+"""令牌桶限流。
+
+一轮 /chat 最多触发 6 次 LLM 调用，单个脚本客户端就能耗尽整个 DashScope 配额，所以按成本限流：
+- 每个请求按「接口类别」扣令牌：chat 预扣 RATE_LIMIT_CHAT_COST（默认 6，即一轮最多的 LLM 调用数），
+  本轮结束后按实际 LLM 调用次数退回多扣的部分；其它接口扣 1；
+- 客户端 IP × 接口类别 各一个桶，由 RateLimitMiddleware 在进入路由前检查；
+- /chat 另按 session_id 一个桶（会话 id 在请求体里，由 chat() 解析后调用 LIMITER.hit 检查）。
+
+桶参数用 RATE_LIMIT_<NAME>=<每秒补充令牌>:<桶容量> 配置，例如 RATE_LIMIT_CHAT=0.5:60。
+被限流时返回 429 + Retry-After（秒）。
+
+存储后端：
+- memory（默认）：进程内 dict + 锁，单次检查几微秒；多 worker 时各算各的；
+- redis://host:port/db：多 worker 共享，Lua 脚本原子扣减（需要安装 redis 包）。
+"""
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from backend.log_pipeline import report_error
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_CHAT_COST = int(os.getenv("RATE_LIMIT_CHAT_COST", "6"))
+# 反向代理后面部署时置 1，取 X-Forwarded-For 的第一个地址作为客户端 IP
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+RATE_LIMIT_EXEMPT = [p for p in os.getenv("RATE_LIMIT_EXEMPT", "/health,/ready,/metrics,/uploads").split(",") if p]
+MEMORY_MAX_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_MAX_KEYS", "100000"))
+
+# 名称 -> (每秒补充令牌, 桶容量)
+_DEFAULT_LIMITS = {
+    "chat": "0.5:60",     # 每 IP：持续约 5 轮/分钟，突发 10 轮
+    "session": "0.3:36",  # 每会话：持续约 3 轮/分钟，突发 6 轮
+    "write": "2:40",
+    "read": "20:200",
+    "admin": "20:200",
+}
+
+
+def _parse_limit(s: str) -> Tuple[float, float]:
+    rate, _, burst = s.partition(":")
+    return float(rate), float(burst or rate)
+
+
+LIMITS: Dict[str, Tuple[float, float]] = {
+    name: _parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default)) for name, default in _DEFAULT_LIMITS.items()
+}
+
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """接口类别；不限流的路径返回 None。"""
+    if method == "OPTIONS" or any(path == p or path.startswith(p + "/") for p in RATE_LIMIT_EXEMPT):
+        return None
+    if path == "/chat":
+        return "chat"
+    if path.startswith("/api/admin/"):
+        return "admin"
+    return "write" if method in _WRITE_METHODS else "read"
+
+
+def cost_of(bucket: str) -> int:
+    return RATE_LIMIT_CHAT_COST if bucket in ("chat", "session") else 1
+
+
+class MemoryBackend:
+    """进程内令牌桶：key -> [剩余令牌, 上次更新时间]。"""
+
+    def __init__(self, max_keys: int = MEMORY_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, list] = {}
+        self.max_keys = max_keys
+
+    def take(self, key: str, cost: float, rate: float, capacity: float) -> float:
+        """扣 cost 个令牌，成功返回 0，否则返回需要等待的秒数。"""
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._evict(now)
+                b = self._buckets[key] = [capacity, now]
+            tokens = min(capacity, b[0] + (now - b[1]) * rate)
+            b[1] = now
+            if tokens >= cost:
+                b[0] = tokens - cost
+                return 0.0
+            b[0] = tokens
+            return (cost - tokens) / rate if rate > 0 else float("inf")
+
+    def refund(self, key: str, amount: float, capacity: float) -> None:
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is not None:
+                b[0] = min(capacity, b[0] + amount)
+
+    def _evict(self, now: float) -> None:
+        # 超过上限时先丢一小时没访问的桶（早已补满，丢掉等价于满桶），仍不够就丢最久未访问的一半
+        idle = [k for k, (_, ts) in self._buckets.items() if now - ts > 3600]
+        for k in idle:
+            del self._buckets[k]
+        if len(self._buckets) >= self.max_keys:
+            for k, _ in sorted(self._buckets.items(), key=lambda kv: kv[1][1])[: len(self._buckets) // 2]:
+                del self._buckets[k]
+
+
+_REDIS_TAKE = """
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local rate, cap, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(b[1]) or cap
+local ts = tonumber(b[2]) or now
+tokens = math.min(cap, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(cap / rate) + 60)
+return tostring(wait)
+"""
+
+_REDIS_REFUND = """
+local t = tonumber(redis.call('HGET', KEYS[1], 't'))
+if t then redis.call('HSET', KEYS[1], 't', math.min(tonumber(ARGV[2]), t + tonumber(ARGV[1]))) end
+return 1
+"""
+
+
+class RedisBackend:
+    """多 worker 共享的令牌桶，时间取 Redis 服务器时间，避免各机器时钟不一致。"""
+
+    def __init__(self, url: str):
+        import redis  # 可选依赖，只有配置了 redis:// 才需要
+
+        self._r = redis.Redis.from_url(url)
+        self._take = self._r.register_script(_REDIS_TAKE)
+        self._refund = self._r.register_script(_REDIS_REFUND)
+
+    def _now(self) -> float:
+        sec, usec = self._r.time()
+        return sec + usec / 1e6
+
+    def take(self, key: str, cost: float, rate: float, capacity: float) -> float:
+        return float(self._take(keys=["rl:" + key], args=[rate, capacity, cost, self._now()]))
+
+    def refund(self, key: str, amount: float, capacity: float) -> None:
+        self._refund(keys=["rl:" + key], args=[amount, capacity])
+
+
+def _make_backend(spec: str):
+    if spec.startswith("redis://") or spec.startswith("rediss://"):
+        return RedisBackend(spec)
+    return MemoryBackend()
+
+
+class RateLimiter:
+    def __init__(self, backend=None):
+        self.backend = backend or _make_backend(RATE_LIMIT_BACKEND)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {name: {"allowed": 0, "limited": 0} for name in LIMITS}
+        # 非内存后端每次扣减都是一次网络往返（Redis EVAL），异步调用方要放到线程池里
+        self.blocking = not isinstance(self.backend, MemoryBackend)
+
+    def hit(self, bucket: str, key: str, cost: Optional[float] = None) -> float:
+        """在 bucket 类别下给 key 扣令牌；允许返回 0，否则返回 Retry-After 秒数。"""
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        rate, capacity = LIMITS[bucket]
+        try:
+            wait = self.backend.take(f"{bucket}:{key}", cost_of(bucket) if cost is None else cost, rate, capacity)
+        except Exception as e:
+            # 共享存储不可用时放行，限流不能变成单点故障
+            report_error("ratelimit", "take_failed", e, bucket=bucket)
+            wait = 0.0
+        with self._lock:
+            self.stats[bucket]["limited" if wait else "allowed"] += 1
+        return wait
+
+    def refund(self, bucket: str, key: str, amount: float) -> None:
+        if not RATE_LIMIT_ENABLED or amount <= 0:
+            return
+        try:
+            self.backend.refund(f"{bucket}:{key}", amount, LIMITS[bucket][1])
+        except Exception as e:
+            report_error("ratelimit", "refund_failed", e, bucket=bucket)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            return {
+                name: {**counts, "rate_per_second": LIMITS[name][0], "capacity": LIMITS[name][1]}
+                for name, counts in self.stats.items()
+            }
+
+
+LIMITER = RateLimiter()
+
+
+def retry_after_header(wait: float) -> str:
+    return str(max(1, math.ceil(wait)))
+
+
+def client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope.get("headers") or []:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """纯 ASGI 中间件：按 客户端IP × 接口类别 限流，不读请求体。
+    内存后端直接在事件循环里扣减（几微秒）；Redis 后端放到线程池，网络往返不阻塞事件循环。"""
+
+    def __init__(self, app, limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = limiter or LIMITER
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        bucket = classify(scope["method"], scope["path"])
+        if not bucket:
+            wait = 0.0
+        elif self.limiter.blocking:
+            wait = await run_in_threadpool(self.limiter.hit, bucket, client_ip(scope))
+        else:
+            wait = self.limiter.hit(bucket, client_ip(scope))
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+        retry = retry_after_header(wait)
+        body = json.dumps({"detail": "too many requests", "retry_after": int(retry)}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
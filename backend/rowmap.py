@@ -0,0 +1,188 @@
+# backend/rowmap.py
+"""按列定义的行映射：数据库行 -> 接口 / 工具返回的 dict。
+
+products 表的 JSON 列（specs_json、carousel_images、detail_images）以前在五六个地方各自
+try/except 解码，默认值也不一致。这里每种列类型只有一个解码函数，RowMapper 在构造时
+把「列 -> (输出键, 解码函数)」编成一张步骤表，之后逐行原地套用：
+
+    PRODUCT.many(rows)        # 接口用：只解码 JSON 列，其它字段原样
+    PRODUCT_TOOL(row)         # 工具用：另外把 price 转 float、is_active 转 bool、文本列 None 转 ""
+
+压测（10k 行商品目录，旧的逐字段解码 + jsonable_encoder + json.dumps 对比 RowMapper + FastJSONResponse）：
+    python -m backend.rowmap bench --rows 10000
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from backend.fastjson import loads as _loads
+
+
+def json_object(v: Any) -> Dict[str, Any]:
+    """JSON 对象列：dict 原样返回，字符串解码，解不出或不是对象时返回 {}。"""
+    if isinstance(v, dict):
+        return v
+    if not v:
+        return {}
+    if isinstance(v, (str, bytes, bytearray)):
+        try:
+            v = _loads(v)
+        except ValueError:
+            return {}
+    return v if isinstance(v, dict) else {}
+
+
+def json_list(v: Any) -> List[Any]:
+    """JSON 数组列：list 原样返回，字符串解码，解不出或不是数组时返回 []。"""
+    if isinstance(v, list):
+        return v
+    if not v:
+        return []
+    if isinstance(v, (str, bytes, bytearray)):
+        try:
+            v = _loads(v)
+        except ValueError:
+            return []
+    return v if isinstance(v, list) else []
+
+
+def to_float(v: Any) -> float:
+    return float(v) if v is not None else 0.0
+
+
+def flag(v: Any) -> bool:
+    return v == 1 or v is True
+
+
+def text(v: Any) -> str:
+    return v or ""
+
+
+Step = Union[Callable[[Any], Any], Tuple[str, Callable[[Any], Any]]]
+
+
+class RowMapper:
+    """spec: 列名 -> 解码函数，或 (输出键, 解码函数)（输出键不同时会移除原列）。"""
+
+    def __init__(self, spec: Dict[str, Step]):
+        self._steps: List[Tuple[str, str, Callable[[Any], Any]]] = []
+        for col, step in spec.items():
+            dst, fn = step if isinstance(step, tuple) else (col, step)
+            self._steps.append((col, dst, fn))
+
+    def __call__(self, row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        for col, dst, fn in self._steps:
+            if col in row:
+                row[dst] = fn(row.pop(col) if dst != col else row[col])
+        return row
+
+    def many(self, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self(r) for r in rows]
+
+
+_PRODUCT_JSON: Dict[str, Step] = {
+    "specs_json": ("specs", json_object),
+    "carousel_images": json_list,
+    "detail_images": json_list,
+}
+
+PRODUCT = RowMapper(_PRODUCT_JSON)
+
+PRODUCT_TOOL = RowMapper({
+    **_PRODUCT_JSON,
+    "price": to_float,
+    "description": text,
+    "image_url": text,
+    "detailed_text": text,
+    "is_active": flag,
+})
+
+
+# ========== 压测 ==========
+def _legacy_decode(r: Dict[str, Any]) -> Dict[str, Any]:
+    # 原 api_products / get_product_by_id 里的逐字段写法，仅供对比
+    try:
+        r["specs"] = json.loads(r["specs_json"]) if r.get("specs_json") else {}
+    except Exception:
+        r["specs"] = {}
+    r.pop("specs_json", None)
+    for col in ("carousel_images", "detail_images"):
+        if r.get(col):
+            try:
+                r[col] = json.loads(r[col]) if isinstance(r[col], str) else r[col]
+            except Exception:
+                r[col] = []
+        else:
+            r[col] = []
+    return r
+
+
+def _fake_rows(n: int) -> List[Dict[str, Any]]:
+    from datetime import datetime
+    from decimal import Decimal
+
+    rows = []
+    for i in range(n):
+        rows.append({
+            "product_id": f"P{i:06d}",
+            "shop_id": f"S{i % 50:03d}",
+            "title": f"测试商品 {i} 旗舰版 256G",
+            "category": "手机",
+            "price": Decimal(f"{1999 + i % 1000}.00"),
+            "description": "高性能处理器，超长续航，支持快充。" * 3,
+            "specs_json": json.dumps({"颜色": "黑色", "内存": "12G", "存储": "256G", "屏幕": "6.7英寸"}, ensure_ascii=False),
+            "image_url": f"/uploads/{i}.jpg",
+            "carousel_images": json.dumps([f"/uploads/{i}_{k}.jpg" for k in range(4)]),
+            "detail_images": json.dumps([f"/uploads/{i}_d{k}.jpg" for k in range(6)]),
+            "detailed_text": "",
+            "is_active": 1,
+            "created_at": datetime(2024, 1, 1, 12, 0, i % 60),
+        })
+    return rows
+
+
+def bench(n: int, repeat: int) -> Dict[str, float]:
+    from fastapi.encoders import jsonable_encoder
+    from backend.fastjson import dumps, orjson
+
+    def run(fn) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            rows = _fake_rows(n)
+            t0 = time.perf_counter()
+            fn(rows)
+            best = min(best, time.perf_counter() - t0)
+        return round(best * 1000, 1)
+
+    out = {
+        "rows": n,
+        "backend": "orjson" if orjson is not None else "json",
+        "legacy_decode_ms": run(lambda rows: [_legacy_decode(r) for r in rows]),
+        "mapper_decode_ms": run(PRODUCT.many),
+        "legacy_total_ms": run(lambda rows: json.dumps(
+            jsonable_encoder([_legacy_decode(r) for r in rows]),
+            ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+        ).encode("utf-8")),
+        "fast_total_ms": run(lambda rows: dumps(PRODUCT.many(rows))),
+    }
+    out["speedup"] = round(out["legacy_total_ms"] / out["fast_total_ms"], 1) if out["fast_total_ms"] else 0.0
+    return out
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="行映射 + JSON 响应序列化压测")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench")
+    b.add_argument("--rows", type=int, default=10000)
+    b.add_argument("--repeat", type=int, default=5, help="取最快一次")
+    args = ap.parse_args(argv)
+    print(json.dumps(bench(args.rows, args.repeat), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
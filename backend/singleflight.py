@@ -0,0 +1,117 @@
+# backend/singleflight.py
+"""进程内 single-flight：相同 key 的并发请求只执行一次，其余等待并共享结果。
+
+秒杀时大量会话同时问同一个商品，同样的 Prompt / 同样的商品查询会在多个线程里并发执行。
+这里按分组（llm / search_products_by_name / get_product_detail ...）维护正在执行的调用：
+- 第一个到达的请求（leader）真正执行，结果或异常共享给同 key 的等待者（follower）；
+- follower 最多等待该分组的 wait 秒，超时后自己执行一次（退化为原来的行为），不会被拖死；
+- 结果只在执行期间共享，执行结束即移除，不做缓存；非 str 结果给 follower 的是深拷贝；
+- call() 额外返回 shared 标志（是否拿的是别人的结果），调用方据此把用量记到自己名下。
+
+SINGLEFLIGHT_ENABLED=0 关闭；统计见 GET /api/admin/singleflight_stats。
+"""
+import copy
+import functools
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+# follower 最长等待时间（秒）：LLM 生成本身就慢，工具查询应当很快
+LLM_WAIT = float(os.getenv("SINGLEFLIGHT_LLM_WAIT", "30"))
+TOOL_WAIT = float(os.getenv("SINGLEFLIGHT_TOOL_WAIT", "5"))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str, wait: float):
+        self.name = name
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, _Call] = {}
+        self.stats = {"executed": 0, "collapsed": 0, "timeouts": 0, "errors": 0}
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        return self.call(key, fn)[0]
+
+    def call(self, key: Any, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """返回 (结果, shared)；shared=True 表示结果来自同 key 的 leader，本线程没有执行 fn。"""
+        if not SINGLEFLIGHT_ENABLED:
+            return fn(), False
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executed"] += 1
+            else:
+                call.followers += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    if call.error is not None:
+                        self.stats["errors"] += 1
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(self.wait):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            return fn(), False
+        with self._lock:
+            self.stats["collapsed"] += 1
+        if call.error is not None:
+            raise call.error
+        return (call.result if isinstance(call.result, str) else copy.deepcopy(call.result)), True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, inflight=len(self._calls), wait_seconds=self.wait)
+
+
+_GROUPS: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def group(name: str, wait: float) -> SingleFlight:
+    with _groups_lock:
+        g = _GROUPS.get(name)
+        if g is None:
+            g = _GROUPS[name] = SingleFlight(name, wait)
+        return g
+
+
+def single_flight(name: str, key: Callable[..., Any], wait: float) -> Callable:
+    """装饰器：key(*args, **kwargs) 返回归一化后的 key（需可哈希）。"""
+    g = group(name, wait)
+
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return g.do(key(*args, **kwargs), lambda: fn(*args, **kwargs))
+        return wrapper
+
+    return deco
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    with _groups_lock:
+        groups = list(_GROUPS.values())
+    return {g.name: g.snapshot() for g in groups}
@@ -0,0 +1,87 @@
+# backend/startup_check.py
+"""启动耗时回归检查。
+
+在全新子进程里用 python -X importtime 导入 backend.api_server：
+- 总耗时（取多次中的最小值）超过 --budget-ms 判定失败；
+- LangChain / DashScope / Agent 模块出现在导入链里也判定失败（它们应由 _agent_stack 按需加载）。
+失败时进程以非 0 退出，可直接挂到 CI。
+
+用法：
+    python -m backend.startup_check
+    python -m backend.startup_check --budget-ms 1200 --repeat 5 --top 15
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+IMPORT_BUDGET_MS = int(os.getenv("IMPORT_BUDGET_MS", "1000"))
+
+TARGET = "backend.api_server"
+
+# 这些模块（及其子模块）不允许在导入 api_server 时被加载
+LAZY_MODULES = ["langchain", "langchain_core", "langchain_community", "dashscope", "backend.agent.react_agent"]
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure() -> Tuple[int, Dict[str, int]]:
+    """返回 (api_server 累计导入耗时 us, 模块 -> 自身耗时 us)。"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+        cwd=root, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr[-2000:])
+    total = 0
+    self_us: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if not m:
+            continue
+        name = m.group(4)
+        self_us[name] = int(m.group(1))
+        if name == TARGET:
+            total = int(m.group(2))
+    return total, self_us
+
+
+def lazy_violations(modules: Dict[str, int]) -> List[str]:
+    return sorted(
+        name for name in modules
+        if any(name == p or name.startswith(p + ".") for p in LAZY_MODULES)
+    )
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="api_server 导入耗时回归检查")
+    ap.add_argument("--budget-ms", type=int, default=IMPORT_BUDGET_MS)
+    ap.add_argument("--repeat", type=int, default=3, help="重复测量次数，取最小值")
+    ap.add_argument("--top", type=int, default=10, help="列出自身耗时最高的 N 个模块")
+    args = ap.parse_args(argv)
+
+    runs = [measure() for _ in range(max(1, args.repeat))]
+    total_us, modules = min(runs, key=lambda r: r[0])
+    total_ms = total_us / 1000
+
+    for name, us in sorted(modules.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"{us / 1000:8.1f} ms  {name}")
+    print(f"import {TARGET}: {total_ms:.0f} ms (budget {args.budget_ms} ms)")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.0f} ms exceeds budget {args.budget_ms} ms")
+    eager = lazy_violations(modules)
+    if eager:
+        failures.append(f"{len(eager)} lazily-loaded module(s) imported eagerly, e.g. {', '.join(eager[:5])}")
+    for f in failures:
+        print("FAIL " + f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,58 @@
+# tests/test_archived_orders.py
+"""已归档的订单只读：退款、删单、后台改状态 / 删单明确返回 409，不动热表；假连接，不连库。"""
+from contextlib import contextmanager
+
+import pytest
+from fastapi import HTTPException
+
+import backend.api_server as api
+
+
+@pytest.fixture
+def db(monkeypatch):
+    executed = []
+    archive = {"A1": {"status": "DELIVERED"}}
+
+    class Cur:
+        def execute(self, sql, args=None):
+            executed.append(sql)
+            self.sql, self.args = sql, args
+
+        def fetchone(self):
+            if "FROM orders_archive" in self.sql:
+                return archive.get(self.args[0])
+            return None
+
+        def fetchall(self):
+            return []
+
+    class Conn:
+        def cursor(self):
+            return contextmanager(lambda: (yield Cur()))()
+
+    monkeypatch.setattr(api, "get_conn", contextmanager(lambda: (yield Conn())))
+    return executed
+
+
+CALLS = [
+    lambda no: api.refund_order(no, api.RefundReq()),
+    lambda no: api.delete_order(no),
+    lambda no: api.admin_delete_order(no),
+    lambda no: api.admin_update_order(no, api.AdminUpdateOrderReq(status="CANCELLED")),
+]
+
+
+@pytest.mark.parametrize("call", CALLS, ids=["refund", "delete", "admin_delete", "admin_update"])
+def test_archived_order_is_rejected(db, call):
+    with pytest.raises(HTTPException) as e:
+        call("A1")
+    assert e.value.status_code == 409
+    assert "archived" in e.value.detail
+    assert not any(sql.startswith(("UPDATE", "DELETE", "INSERT")) for sql in db)
+
+
+@pytest.mark.parametrize("call", CALLS, ids=["refund", "delete", "admin_delete", "admin_update"])
+def test_unknown_order_is_404(db, call):
+    with pytest.raises(HTTPException) as e:
+        call("NOPE")
+    assert e.value.status_code == 404
@@ -0,0 +1,92 @@
+# tests/test_batch_runner.py
+"""batch_runner.run_conversation：Agent 栈换成桩，不连库、不调 LLM。"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import backend.api_server as api
+from backend.agent import agent_logging, batch_runner, react_agent
+from backend.agent import usage as llm_usage
+from backend.agent.session_slots import SESSION_SLOTS
+from backend.tools import order_tools
+
+
+class _LLM:
+    def __init__(self, **kwargs):
+        pass
+
+
+@pytest.fixture
+def stack(monkeypatch):
+    """build_agent 用真实的 build_tools（带 dry_run），run_agent 每轮调用一次 issue_coupon。"""
+    seen = {"dry_run": []}
+
+    def build_agent(llm, tool_cache=None, slots=None, dry_run=False):
+        seen["dry_run"].append(dry_run)
+        return {t.name: t for t in react_agent.build_tools(tool_cache, slots, dry_run)}
+
+    def run_agent(tools, user_msg, history, context="", history_window=10, callbacks=None):
+        action = SimpleNamespace(tool="issue_coupon", tool_input='{"receiver": "张三", "amount": 5}')
+        obs = tools["issue_coupon"].func(action.tool_input)
+        return f"已处理：{user_msg}", [(action, obs)]
+
+    fake = SimpleNamespace(build_agent=build_agent, run_agent=run_agent, engine="react",
+                           agent_logging=agent_logging, LLM=_LLM)
+    monkeypatch.setattr(api, "_agent_stack", lambda: fake)
+    seen["live_transcripts"] = []
+    monkeypatch.setattr(api.TRANSCRIPTS, "submit", lambda turn, calls: seen["live_transcripts"].append(turn))
+    return seen
+
+
+def test_run_conversation_dry_run_does_not_issue_coupons(stack, monkeypatch):
+    def real_issue(*args, **kwargs):
+        raise AssertionError("dry-run must not touch the coupon ledger")
+
+    monkeypatch.setattr(order_tools.COUPONS, "issue", real_issue)
+    rec = batch_runner.run_conversation({"id": "c1", "turns": [{"message": "东西坏了"}, {"message": "补偿一下"}]})
+
+    assert stack["dry_run"] == [True, True]
+    assert [t["answer"] for t in rec["turns"]] == ["已处理：东西坏了", "已处理：补偿一下"]
+    assert rec["tool_counts"] == {"issue_coupon": 2}
+
+
+def test_run_conversation_cleans_up_session_state(stack, monkeypatch):
+    sids = []
+    orig = llm_usage.begin_turn
+
+    def begin_turn(session_id):
+        sids.append(session_id)
+        return orig(session_id)
+
+    monkeypatch.setattr(llm_usage, "begin_turn", begin_turn)
+    batch_runner.run_conversation({"id": "c2", "turns": [{"message": "你好"}]})
+
+    sid = sids[0]
+    assert sid.startswith("batch-c2-")
+    assert sid not in api.SESSIONS
+    assert sid not in SESSION_SLOTS
+    assert sid not in llm_usage.LEDGER.sessions
+
+
+def test_run_conversation_live_runs_write_tools(stack, monkeypatch):
+    issued = []
+    monkeypatch.setattr(order_tools.COUPONS, "issue",
+                        lambda receiver, amount, reason, order_no=None: issued.append(receiver) or {"ok": True})
+    batch_runner.run_conversation({"id": "c3", "turns": [{"message": "补偿"}]}, dry_run=False)
+
+    assert stack["dry_run"] == [False]
+    assert issued == ["张三"]
+
+
+def test_run_batch_writes_transcripts_to_own_sink(stack, tmp_path):
+    convs = tmp_path / "convs.jsonl"
+    convs.write_text('{"id": "c4", "turns": ["你好", "再见"]}\n', encoding="utf-8")
+    replay = tmp_path / "replay.jsonl"
+    summary = batch_runner.run_batch(str(convs), str(tmp_path / "out.jsonl"),
+                                     transcripts_sink=f"jsonl:{replay}")
+
+    assert summary["ok"] == 1
+    assert stack["live_transcripts"] == []
+    kinds = [json.loads(line)["kind"] for line in replay.read_text(encoding="utf-8").splitlines()]
+    assert kinds.count("turn") == 2
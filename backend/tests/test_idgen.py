@@ -0,0 +1,68 @@
+# tests/test_idgen.py
+"""idgen：多线程、同机两个 worker 进程发的售后单号 / 工单号不重复。"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+from backend import idgen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+NUMBERED = re.compile(r"^(AS|TK)\d{10}\d{8}$")
+
+# 子进程：先抢 worker id 并报告，等父进程通知后再多线程发号，保证两个进程同时持有编号
+CHILD = """
+import json, sys, threading
+from backend import idgen
+print(idgen._generator().worker_id, flush=True)
+sys.stdin.readline()
+out = [[] for _ in range(4)]
+def run(i):
+    out[i] = [f() for _ in range(2000) for f in (idgen.new_after_sale_no, idgen.new_ticket_no)]
+ts = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+for t in ts: t.start()
+for t in ts: t.join()
+print(json.dumps([x for chunk in out for x in chunk]), flush=True)
+"""
+
+
+def _generate(threads, n):
+    out = [[] for _ in range(threads)]
+
+    def run(i):
+        out[i] = [f() for _ in range(n) for f in (idgen.new_after_sale_no, idgen.new_ticket_no)]
+
+    ts = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return [x for chunk in out for x in chunk]
+
+
+def test_threads_never_collide():
+    ids = _generate(threads=8, n=5000)
+    assert len(set(ids)) == len(ids)
+    assert all(NUMBERED.match(x) for x in ids)
+
+
+def test_two_workers_claim_distinct_ids_and_never_collide(tmp_path):
+    env = {**os.environ, "PYTHONPATH": ROOT, "ID_WORKER_LOCK_DIR": str(tmp_path),
+           "ID_WORKER_ID": "10", "ID_WORKER_SPAN": "2"}
+    procs = [subprocess.Popen([sys.executable, "-c", CHILD], cwd=ROOT, env=env, text=True,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE) for _ in range(2)]
+    try:
+        workers = {int(p.stdout.readline()) for p in procs}
+        assert workers == {10, 11}
+        for p in procs:
+            p.stdin.write("go\n")
+            p.stdin.flush()
+        ids = [x for p in procs for x in json.loads(p.stdout.readline())]
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+    assert len(ids) == 2 * 4 * 2000 * 2
+    assert len(set(ids)) == len(ids)
@@ -0,0 +1,47 @@
+# tests/test_llm_usage_shared.py
+"""single-flight 合并的 LLM 调用：follower 这一轮也要记上用量，上游用量只算一次。"""
+import threading
+import time
+from types import SimpleNamespace
+
+from backend.agent import llm_aliyun
+from backend.agent import usage as llm_usage
+
+
+def test_collapsed_follower_records_usage(monkeypatch):
+    calls = []
+
+    def fake_call(**kwargs):
+        calls.append(kwargs)
+        time.sleep(0.3)
+        return SimpleNamespace(
+            status_code=200,
+            usage={"input_tokens": 100, "output_tokens": 20},
+            output=SimpleNamespace(choices=[{"message": {"content": "好的"}}]),
+        )
+
+    monkeypatch.setattr(llm_aliyun.dashscope.Generation, "call", fake_call)
+    monkeypatch.setattr(llm_usage, "LEDGER", llm_usage._Ledger())
+    llm = llm_aliyun.AliyunQwenLLM(model_name="qwen-turbo", api_key="x")
+    turns = {}
+
+    def run(sid):
+        turn = llm_usage.begin_turn(sid)
+        assert llm._call("同一个问题") == "好的"
+        turns[sid] = turn.totals()
+        llm_usage.end_turn(turn)
+
+    threads = [threading.Thread(target=run, args=(f"s{i}",)) for i in range(2)]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    for sid in ("s0", "s1"):
+        assert turns[sid]["llm_calls"] == 1
+        assert turns[sid]["input_tokens"] == 100
+        assert llm_usage.LEDGER.session_tokens(sid) == 120
+    assert llm_usage.LEDGER.models["qwen-turbo"]["calls"] == 1
+    assert llm_usage.LEDGER.shared["qwen-turbo"]["calls"] == 1
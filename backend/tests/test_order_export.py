@@ -0,0 +1,53 @@
+# tests/test_order_export.py
+"""order_admin.iter_export：按 id keyset 分页，每页一个短连接；假连接，不连库。"""
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+from backend import order_admin
+
+ROWS = [{"id": i, "order_no": f"O{i}", "status": "PAID", "receiver": "张三", "phone_tail": "1234",
+         "total_amount": 10, "created_at": datetime(2025, 12, 23)} for i in range(1, 8)]
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    opened = []
+
+    class Cur:
+        def execute(self, sql, args):
+            assert sql.endswith("WHERE id>%s ORDER BY id LIMIT %s")
+            after_id, limit = args
+            self.rows = [r for r in ROWS if r["id"] > after_id][:limit]
+
+        def fetchall(self):
+            return self.rows
+
+    class Conn:
+        def cursor(self):
+            return contextmanager(lambda: (yield Cur()))()
+
+    @contextmanager
+    def get_read_conn(*keys):
+        opened.append(len(opened))
+        yield Conn()
+
+    monkeypatch.setattr(order_admin, "get_read_conn", get_read_conn)
+    monkeypatch.setattr(order_admin, "EXPORT_CHUNK_ROWS", 3)
+    monkeypatch.setattr(order_admin, "EXPORT_FLUSH_ROWS", 1)
+    return opened
+
+
+def test_export_reads_every_row_in_pages(pages):
+    out = "".join(order_admin.iter_export("ndjson"))
+    assert [json.loads(line)["id"] for line in out.splitlines()] == list(range(1, 8))
+    assert len(pages) == 3
+
+
+def test_closed_export_stops_reading(pages):
+    it = order_admin.iter_export("ndjson")
+    next(it)
+    it.close()
+    assert len(pages) == 1
@@ -0,0 +1,104 @@
+# tests/test_query_check.py
+"""query_check：f-string SQL 的展开与无法分析语句的判定；EXPLAIN 先用假连接测，
+再对真实库跑一遍（连不上 MySQL 时跳过）。"""
+from contextlib import contextmanager
+
+import pymysql
+import pytest
+
+import backend.query_check as qc
+from backend.database import get_conn
+
+SAMPLE = '''
+_BASE = "SELECT id FROM orders"
+
+
+def _marks(n):
+    return ",".join(["%s"] * n)
+
+
+def by_nos(cur, nos):
+    cur.execute(f"{_BASE} WHERE order_no IN ({_marks(len(nos))})", nos)
+
+
+def by_table(cur, no):
+    for orders_table, _ in ORDER_TABLES:
+        cur.execute(f"SELECT id FROM {orders_table} WHERE order_no=%s", (no,))
+
+
+def dynamic(cur, where):
+    marks = ",".join(["%s"] * 3)
+    cur.execute(f"DELETE FROM orders WHERE {where} AND id IN ({marks})")
+    cur.execute(f"INSERT INTO orders({where}) VALUES({marks})")
+'''
+
+
+def _collect(tmp_path):
+    path = tmp_path / "sample.py"
+    path.write_text(SAMPLE, encoding="utf-8")
+    return [(sql, qc.unanalyzable(where, sql)) for where, _, sql in qc.collect_statements([str(path)])]
+
+
+def test_fstring_placeholders_constants_and_tables_are_expanded(tmp_path):
+    got = _collect(tmp_path)
+    assert ("SELECT id FROM orders WHERE order_no IN (%s)", False) in got
+    assert ("SELECT id FROM orders WHERE order_no=%s", False) in got
+    assert ("SELECT id FROM orders_archive WHERE order_no=%s", False) in got
+
+
+def test_unresolved_parts_are_flagged_except_writes(tmp_path):
+    got = dict(_collect(tmp_path))
+    assert got["DELETE FROM orders WHERE {where} AND id IN (%s)"] is True
+    assert got["INSERT INTO orders({where}) VALUES(%s)"] is False
+
+
+def test_repo_modules_are_fully_analyzable():
+    stmts = qc.collect_statements()
+    assert [s for s in stmts if qc.unanalyzable(s[0], s[2])] == []
+    sqls = {" ".join(sql.split()) for _, _, sql in stmts}
+    assert any("FROM products WHERE product_id IN (%s)" in s for s in sqls)  # checkout 商品批量查询
+    assert any("FROM orders_archive WHERE order_no=%s" in s for s in sqls)   # 归档表回落
+    assert any(w == "archiver.py" for w, _, _ in stmts)
+
+
+def test_check_reports_full_scans_and_unanalyzable_sql(tmp_path, monkeypatch):
+    path = tmp_path / "sample.py"
+    path.write_text(SAMPLE, encoding="utf-8")
+    monkeypatch.setattr(qc, "CHECKED_MODULES", [str(path)])
+    explained = []
+
+    class Cur:
+        def execute(self, sql, args=None):
+            self.sql = sql
+            if sql.startswith("EXPLAIN"):
+                explained.append(sql)
+
+        def fetchall(self):
+            scan = "archive" in self.sql
+            return [{"table": "orders_archive" if scan else "orders", "type": "ALL" if scan else "ref"}]
+
+        def fetchone(self):
+            return {"n": 5000}
+
+    class Conn:
+        def cursor(self):
+            return contextmanager(lambda: (yield Cur()))()
+
+    monkeypatch.setattr(qc, "get_conn", contextmanager(lambda: (yield Conn())))
+    failures = qc.check(max_rows=1000)
+
+    assert len(explained) == 3
+    assert "EXPLAIN SELECT id FROM orders WHERE order_no IN ('0')" in explained
+    assert len(failures) == 2
+    assert any("全表扫描 orders_archive（5000 行）" in f for f in failures)
+    assert any("无法静态分析" in f and "{where}" in f for f in failures)
+
+
+def test_check_against_database():
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+    except pymysql.MySQLError as e:
+        pytest.skip(f"MySQL 不可用: {e}")
+    assert qc.check() == []
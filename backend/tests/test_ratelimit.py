@@ -0,0 +1,48 @@
+# tests/test_ratelimit.py
+"""RateLimitMiddleware：共享存储（Redis）的扣减不在事件循环线程上执行。"""
+import asyncio
+import threading
+
+import backend.ratelimit as rl
+
+
+class _SlowBackend:
+    def __init__(self):
+        self.threads = []
+
+    def take(self, key, cost, rate, capacity):
+        self.threads.append(threading.get_ident())
+        return 0.0
+
+    def refund(self, key, amount, capacity):
+        pass
+
+
+def _request(limiter):
+    served = []
+
+    async def app(scope, receive, send):
+        served.append(scope["path"])
+
+    async def run():
+        scope = {"type": "http", "method": "GET", "path": "/api/products", "client": ("1.2.3.4", 1)}
+        await rl.RateLimitMiddleware(app, limiter)(scope, None, None)
+        return threading.get_ident()
+
+    return asyncio.run(run()), served
+
+
+def test_shared_backend_hit_runs_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(rl, "RATE_LIMIT_ENABLED", True)
+    backend = _SlowBackend()
+    loop_thread, served = _request(rl.RateLimiter(backend))
+    assert served == ["/api/products"]
+    assert backend.threads and backend.threads[0] != loop_thread
+
+
+def test_memory_backend_hit_stays_inline(monkeypatch):
+    monkeypatch.setattr(rl, "RATE_LIMIT_ENABLED", True)
+    limiter = rl.RateLimiter(rl.MemoryBackend())
+    assert limiter.blocking is False
+    _, served = _request(limiter)
+    assert served == ["/api/products"]
@@ -0,0 +1,44 @@
+# tests/test_react_tools.py
+"""react_agent 的工具缓存：同一轮里 lookup_order 与 check_return_eligibility 只查一次订单。"""
+from backend.agent import react_agent
+from backend.agent.tool_cache import ToolCache
+
+ORDER = {"order_id": "O1", "order_no": "O1", "status": "PAID", "created_at": "2025-12-23 15:30:00", "items": []}
+
+
+def _tools(monkeypatch, cache):
+    queries = []
+
+    def lookup_order(order_id, phone_tail=None, receiver=None):
+        queries.append(order_id)
+        if order_id != "O1":
+            return {"ok": False, "message": f"未找到订单 {order_id}", "order": None}
+        return {"ok": True, "message": "查询成功", "order": ORDER}
+
+    def check_return_eligibility(order_id):
+        raise AssertionError("有缓存时不应再单独查订单")
+
+    monkeypatch.setattr(react_agent, "lookup_order", lookup_order)
+    monkeypatch.setattr(react_agent, "check_return_eligibility", check_return_eligibility)
+    tools = {t.name: t.func for t in react_agent.build_tools(cache)}
+    return tools, queries
+
+
+def test_eligibility_reuses_cached_lookup(monkeypatch):
+    tools, queries = _tools(monkeypatch, ToolCache())
+    tools["lookup_order"]('{"order_id": "O1"}')
+    obs = tools["check_return_eligibility"]('{"order_id": "O1"}')
+    tools["check_return_eligibility"]('{"order_id": "O1"}')
+
+    assert queries == ["O1"]
+    assert obs.payload["ok"] is True and obs.payload["eligible"] is True
+
+
+def test_eligibility_first_then_lookup_queries_once(monkeypatch):
+    tools, queries = _tools(monkeypatch, ToolCache())
+    tools["check_return_eligibility"]('{"order_id": "O1"}')
+    tools["lookup_order"]('{"order_id": "O1"}')
+    missing = tools["check_return_eligibility"]('{"order_id": "NOPE"}')
+
+    assert queries == ["O1", "NOPE"]
+    assert missing.payload == {"ok": False, "eligible": False, "reason": "未找到订单 NOPE"}
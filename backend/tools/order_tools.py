@@ -3,9 +3,12 @@ import os
 import json
 import time
 import random
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
-from backend.database import get_conn
+from backend.database import get_read_conn
+from backend.idgen import new_after_sale_no, new_ticket_no
+from backend.coupons import LEDGER as COUPONS
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -13,6 +16,9 @@ FAKE_DB_PATH = os.path.join(DATA_DIR, "fake_db.json")
 AFTER_SALE_DB_PATH = os.path.join(DATA_DIR, "after_sale_db.json")
 TICKET_DB_PATH = os.path.join(DATA_DIR, "ticket_db.json")
 
+# (订单表, 明细表)：热表查不到时回落到归档表（见 backend/archiver.py）
+ORDER_TABLES = [("orders", "order_items"), ("orders_archive", "order_items_archive")]
+
 
 def _read_json(path: str, default):
     if not os.path.exists(path):
@@ -38,6 +44,15 @@ def _find_order_by_id(order_id: str) -> Optional[Dict[str, Any]]:
             return o
     return None
 
+def verify_order_identity(order: Dict[str, Any], phone_tail: Optional[str] = None, receiver: Optional[str] = None) -> Optional[str]:
+    """校验手机号尾号/收件人，通过返回 None，不通过返回提示文案。"""
+    if phone_tail and str(order.get("phone_tail") or "").strip() != str(phone_tail).strip():
+        return "手机号尾号不匹配，无法查询该订单。"
+    if receiver and str(order.get("receiver") or "").strip() != str(receiver).strip():
+        return "收件人姓名不匹配，无法查询该订单。"
+    return None
+
+
 def lookup_order(order_id: str, phone_tail: Optional[str] = None, receiver: Optional[str] = None) -> Dict[str, Any]:
     """
     MySQL版：根据订单号查询订单（order_id 就当作 order_no 使用）。
@@ -48,27 +63,29 @@ def lookup_order(order_id: str, phone_tail: Optional[str] = None, receiver: Opti
     if not order_no:
         return {"ok": False, "message": "缺少订单号，请先提供订单号（如 20251223xxxxxx）。", "order": None}
 
-    with get_conn() as conn:
+    with get_read_conn(order_no) as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
-                "FROM orders WHERE order_no=%s",
-                (order_no,),
-            )
-            o = cur.fetchone()
+            for orders_table, items_table in ORDER_TABLES:
+                cur.execute(
+                    "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
+                    f"FROM {orders_table} WHERE order_no=%s",
+                    (order_no,),
+                )
+                o = cur.fetchone()
+                if o:
+                    break
 
             if not o:
                 return {"ok": False, "message": f"未找到订单 {order_no}", "order": None}
 
             # 身份校验（可选）
-            if phone_tail and str(o.get("phone_tail") or "").strip() != str(phone_tail).strip():
-                return {"ok": False, "message": "手机号尾号不匹配，无法查询该订单。", "order": None}
-            if receiver and str(o.get("receiver") or "").strip() != str(receiver).strip():
-                return {"ok": False, "message": "收件人姓名不匹配，无法查询该订单。", "order": None}
+            err = verify_order_identity(o, phone_tail, receiver)
+            if err:
+                return {"ok": False, "message": err, "order": None}
 
             # 订单明细
             cur.execute(
-                "SELECT product_id, shop_id, title, price, qty FROM order_items WHERE order_id=%s",
+                f"SELECT product_id, shop_id, title, price, qty FROM {items_table} WHERE order_id=%s",
                 (o["id"],),
             )
             items = cur.fetchall()
@@ -89,15 +106,18 @@ def _get_order_from_mysql(order_no: str) -> Optional[Dict[str, Any]]:
     order_no = (order_no or "").strip()
     if not order_no:
         return None
-    with get_conn() as conn:
+    with get_read_conn(order_no) as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
-                "FROM orders WHERE order_no=%s",
-                (order_no,),
-            )
-            o = cur.fetchone()
-            return o
+            for orders_table, _ in ORDER_TABLES:
+                cur.execute(
+                    "SELECT id, order_no, status, receiver, phone_tail, total_amount, created_at "
+                    f"FROM {orders_table} WHERE order_no=%s",
+                    (order_no,),
+                )
+                o = cur.fetchone()
+                if o:
+                    return o
+    return None
 
 # ========== 工具2：物流轨迹（完全模拟，不需要真实快递 API） ==========
 def get_tracking(tracking_no: str) -> Dict[str, Any]:
@@ -203,7 +223,11 @@ def check_return_eligibility(order_id: str) -> Dict[str, Any]:
     o = _get_order_from_mysql(order_id)
     if not o:
         return {"ok": False, "eligible": False, "reason": f"未找到订单 {order_id}"}
+    return {"ok": True, **evaluate_return_rules(o)}
 
+
+def evaluate_return_rules(o: Dict[str, Any]) -> Dict[str, Any]:
+    """按订单状态和下单时间判断是否可退，返回 eligible / reason，不访问数据库。"""
     status = str(o.get("status") or "").upper()
     created_at = o.get("created_at")
 
@@ -219,21 +243,126 @@ def check_return_eligibility(order_id: str) -> Dict[str, Any]:
     days = (datetime.now() - created_dt).days
 
     if status in ["CANCELED", "REFUNDING", "REFUNDED"]:
-        return {"ok": True, "eligible": False, "reason": f"订单状态为 {status}，不支持重复申请退货/退款。"}
+        return {"eligible": False, "reason": f"订单状态为 {status}，不支持重复申请退货/退款。"}
 
     if status == "PAID":
-        return {"ok": True, "eligible": True, "reason": "订单已支付未发货，可直接申请退款（模拟规则）。"}
+        return {"eligible": True, "reason": "订单已支付未发货，可直接申请退款（模拟规则）。"}
 
     if status in ["SHIPPED", "DELIVERING"]:
-        return {"ok": True, "eligible": True, "reason": "订单已发货/运输中，可申请拦截或拒收退回（模拟规则）。"}
+        return {"eligible": True, "reason": "订单已发货/运输中，可申请拦截或拒收退回（模拟规则）。"}
 
     if status == "DELIVERED":
         if days <= 7:
-            return {"ok": True, "eligible": True, "reason": f"已签收 {days} 天内，支持 7 天退货（模拟规则）。"}
-        return {"ok": True, "eligible": False, "reason": f"已签收超过 7 天（{days} 天），不支持无理由退货（模拟规则）。"}
+            return {"eligible": True, "reason": f"已签收 {days} 天内，支持 7 天退货（模拟规则）。"}
+        return {"eligible": False, "reason": f"已签收超过 7 天（{days} 天），不支持无理由退货（模拟规则）。"}
 
     # 兜底
-    return {"ok": True, "eligible": True, "reason": "符合退货条件（默认规则）。"}
+    return {"eligible": True, "reason": "符合退货条件（默认规则）。"}
+
+
+# ========== 工具3b：订单综合信息（订单 + 明细 + 可退判断 + 物流，一次返回） ==========
+# 按订单号缓存“订单 + 明细 + 可退判断”，退款 / 后台改状态 / 删除订单时调用 invalidate_order_insight()。
+# 缓存只在本进程内失效，多进程部署时其它进程最多滞后 ORDER_INSIGHT_TTL 秒。
+ORDER_INSIGHT_TTL = float(os.getenv("ORDER_INSIGHT_TTL", "300"))
+
+_insight_lock = threading.Lock()
+_insight_cache: Dict[str, Any] = {}  # order_no -> (过期时间, 数据)
+_insight_gen: Dict[str, int] = {}    # order_no -> 失效次数，防止失效前发起的查询把旧数据写回
+_insight_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _fetch_order_with_items(order_no: str) -> Optional[Dict[str, Any]]:
+    """一条 LEFT JOIN 取订单和全部明细（热表没有再查归档表）。"""
+    with get_read_conn(order_no) as conn:
+        with conn.cursor() as cur:
+            for orders_table, items_table in ORDER_TABLES:
+                cur.execute(
+                    "SELECT o.id, o.order_no, o.status, o.receiver, o.phone_tail, o.total_amount, o.created_at, "
+                    "i.product_id, i.shop_id, i.title, i.price, i.qty "
+                    f"FROM {orders_table} o LEFT JOIN {items_table} i ON i.order_id=o.id "
+                    "WHERE o.order_no=%s ORDER BY i.id",
+                    (order_no,),
+                )
+                rows = cur.fetchall()
+                if rows:
+                    break
+    if not rows:
+        return None
+    o = rows[0]
+    return {
+        "order_id": o["order_no"],
+        "order_no": o["order_no"],
+        "status": o["status"],
+        "receiver": o.get("receiver"),
+        "phone_tail": o.get("phone_tail"),
+        "total_amount": float(o.get("total_amount") or 0),
+        "created_at": o.get("created_at"),
+        "items": [
+            {"product_id": r["product_id"], "shop_id": r["shop_id"], "title": r["title"],
+             "price": float(r["price"] or 0), "qty": r["qty"]}
+            for r in rows if r.get("product_id") is not None
+        ],
+    }
+
+
+def load_order_insight(order_no: str) -> Optional[Dict[str, Any]]:
+    """取订单 + 明细 + 可退判断（未做身份校验），优先走缓存。"""
+    order_no = (order_no or "").strip()
+    now = time.time()
+    with _insight_lock:
+        hit = _insight_cache.get(order_no)
+        if hit and hit[0] > now:
+            _insight_stats["hits"] += 1
+            return hit[1]
+        _insight_stats["misses"] += 1
+        gen = _insight_gen.get(order_no, 0)
+
+    order = _fetch_order_with_items(order_no)
+    if order is None:
+        return None
+    data = {"order": order, "return": evaluate_return_rules(order)}
+    order["created_at"] = str(order["created_at"])
+
+    with _insight_lock:
+        if _insight_gen.get(order_no, 0) == gen:
+            _insight_cache[order_no] = (now + ORDER_INSIGHT_TTL, data)
+    return data
+
+
+def invalidate_order_insight(order_no: str) -> None:
+    order_no = (order_no or "").strip()
+    with _insight_lock:
+        _insight_cache.pop(order_no, None)
+        _insight_gen[order_no] = _insight_gen.get(order_no, 0) + 1
+        _insight_stats["invalidations"] += 1
+
+
+def order_insight_stats() -> Dict[str, Any]:
+    with _insight_lock:
+        return {**_insight_stats, "cached_orders": len(_insight_cache), "ttl_seconds": ORDER_INSIGHT_TTL}
+
+
+def get_order_insight(order_id: str, phone_tail: Optional[str] = None, receiver: Optional[str] = None,
+                      tracking_no: Optional[str] = None) -> Dict[str, Any]:
+    """
+    一次返回订单、明细、是否可退；传了 tracking_no 再附上物流轨迹。
+    phone_tail / receiver 传了就校验，不传不校验。
+    返回：ok / message / order / return / tracking
+    """
+    order_no = (order_id or "").strip()
+    if not order_no:
+        return {"ok": False, "message": "缺少订单号，请先提供订单号（如 20251223xxxxxx）。", "order": None}
+
+    data = load_order_insight(order_no)
+    if data is None:
+        return {"ok": False, "message": f"未找到订单 {order_no}", "order": None}
+
+    err = verify_order_identity(data["order"], phone_tail, receiver)
+    if err:
+        return {"ok": False, "message": err, "order": None}
+
+    tracking = get_tracking(tracking_no)["tracking"] if tracking_no else None
+    return {"ok": True, "message": "查询成功", **data, "tracking": tracking}
 
 # ========== 工具4：创建售后单（模拟） ==========
 def create_after_sale(order_id: str, after_sale_type: str = "退货退款", reason: str = "用户申请") -> Dict[str, Any]:
@@ -245,7 +374,7 @@ def create_after_sale(order_id: str, after_sale_type: str = "退货退款", reas
         return {"ok": False, "message": f"未找到订单 {order_id}", "after_sale": None}
 
     db = _read_json(AFTER_SALE_DB_PATH, [])
-    after_sale_id = f"AS{int(time.time())}{random.randint(100,999)}"
+    after_sale_id = new_after_sale_no()
 
     item = {
         "after_sale_id": after_sale_id,
@@ -268,7 +397,7 @@ def create_ticket(ticket_type: str, detail: str, order_id: Optional[str] = None,
     创建工单（模拟），落盘到 data/ticket_db.json
     """
     db = _read_json(TICKET_DB_PATH, [])
-    ticket_id = f"TK{int(time.time())}{random.randint(100,999)}"
+    ticket_id = new_ticket_no()
     item = {
         "ticket_id": ticket_id,
         "type": ticket_type,
@@ -285,19 +414,9 @@ def create_ticket(ticket_type: str, detail: str, order_id: Optional[str] = None,
 
 
 # ========== 工具6：发放补偿券（模拟） ==========
-def issue_coupon(receiver: str, amount: int = 10, reason: str = "体验补偿") -> Dict[str, Any]:
+def issue_coupon(receiver: str, amount: int = 10, reason: str = "体验补偿", order_id: Optional[str] = None) -> Dict[str, Any]:
     """
-    发放优惠券（模拟），不落盘也行（演示够用）
+    发放补偿券，记入 coupons 台账；同一收件人 / 同一订单有发放上限（见 backend/coupons.py）。
+    返回：ok / message / coupon
     """
-    code = f"CP{random.randint(100000, 999999)}"
-    return {
-        "ok": True,
-        "message": "已发放补偿券（模拟）",
-        "coupon": {
-            "code": code,
-            "amount": amount,
-            "receiver": receiver,
-            "reason": reason,
-            "valid_days": 30
-        }
-    }
\ No newline at end of file
+    return COUPONS.issue(receiver, amount, reason, order_no=order_id)
\ No newline at end of file
@@ -0,0 +1,403 @@
+# tools/product_index.py
+"""本地商品语义检索索引（纯离线，无需模型下载）。
+
+- 编码：标题/类目/描述/参数 的字符 1~3-gram，带符号哈希到 DIM 维，TF-IDF 加权后 L2 归一化；
+- 存储：data/product_index/vectors.f32 为 np.memmap 的 float32 矩阵，ids.json 记录行号 -> product_id；
+- 检索：按块做矩阵-向量点积（即余弦相似度）+ argpartition 取 top-k，内存占用与商品数无关；
+- 更新：后台新增/修改/上下架/删除商品时按行增量写入，不重建整个索引；
+- 多进程：写入走 index.lock 文件锁，各 worker 按 ids.json 的 mtime 重新加载，互相可见。
+
+IDF 在全量构建时冻结，增量写入沿用当时的 IDF；商品分布变化较大时执行一次 rebuild。
+
+基准测试：python -m backend.tools.product_index bench --n 100000
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from backend.database import get_read_conn
+from backend.rowmap import json_object
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_DIR = os.getenv("PRODUCT_INDEX_DIR", os.path.join(BASE_DIR, "data", "product_index"))
+
+DIM = int(os.getenv("PRODUCT_INDEX_DIM", "512"))
+NGRAMS = (1, 2, 3)
+TITLE_WEIGHT = 2
+BLOCK_ROWS = 65536
+
+_CLEAN_RE = re.compile(r"[^0-9a-z一-鿿]+")
+
+
+def _ngrams(text: str) -> Iterable[str]:
+    text = _CLEAN_RE.sub("", (text or "").lower())
+    for n in NGRAMS:
+        for i in range(len(text) - n + 1):
+            yield text[i:i + n]
+
+
+def _hashed_tf(text: str) -> np.ndarray:
+    """字符 n-gram 带符号哈希词频，crc32 保证跨进程稳定。"""
+    v = np.zeros(DIM, dtype=np.float32)
+    for g in _ngrams(text):
+        h = zlib.crc32(g.encode("utf-8"))
+        v[h % DIM] += 1.0 if (h >> 31) & 1 else -1.0
+    return v
+
+
+def product_text(p: Dict[str, Any]) -> str:
+    specs = json_object(p.get("specs"))
+    spec_text = " ".join(f"{k}{v}" for k, v in specs.items())
+    title = p.get("title") or ""
+    return " ".join([title] * TITLE_WEIGHT + [p.get("category") or "", p.get("description") or "", spec_text])
+
+
+class ProductIndex:
+    """memmap 向量矩阵 + product_id 映射。容量不足时按 2 倍扩容。
+
+    多个 worker 进程共用同一份索引文件：写入方持有 index.lock 排他锁，先按 ids.json 的版本
+    （inode + mtime）重新加载再改，保证元数据不互相覆盖；检索方发现版本变化时在共享锁下重新加载，
+    看得到其他进程的增量写入。ids / active 写时复制，检索只在锁内取快照，矩阵运算在锁外做。
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.index_dir = index_dir
+        self.vec_path = os.path.join(index_dir, "vectors.f32")
+        self.meta_path = os.path.join(index_dir, "ids.json")
+        self.lock_path = os.path.join(index_dir, "index.lock")
+        self.ids: List[Optional[str]] = []
+        self.row_of: Dict[str, int] = {}
+        self.idf = np.ones(DIM, dtype=np.float32)
+        self.mat: Optional[np.memmap] = None
+        self.active = np.zeros(0, dtype=bool)
+        self._version: Optional[Tuple[int, int]] = None
+        self._lock = threading.RLock()  # 只保护 ids/active/mat/idf 的整体替换
+        self._sync_lock = threading.Lock()  # 进程内串行化写入与重新加载
+
+    # ---------- 持久化 ----------
+    def _map(self, path: str, capacity: int, mode: str) -> np.memmap:
+        return np.memmap(path, dtype=np.float32, mode=mode, shape=(max(capacity, 1), DIM))
+
+    def _open(self, capacity: int, mode: str) -> None:
+        self.mat = self._map(self.vec_path, capacity, mode)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        """跨进程锁：写入 / 构建用排他锁，重新加载用共享锁。"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _meta_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _save_meta(self) -> None:
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "dim": DIM,
+                "ids": self.ids,
+                "active": self.active[:len(self.ids)].astype(int).tolist(),
+                "idf": self.idf.tolist(),
+            }, f)
+        os.replace(tmp, self.meta_path)
+        self._version = self._meta_version()
+
+    def load(self) -> bool:
+        version = self._meta_version()
+        if version is None or not os.path.exists(self.vec_path):
+            return False
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("dim") != DIM:
+            return False
+        ids = meta["ids"]
+        capacity = os.path.getsize(self.vec_path) // (DIM * 4)
+        active = np.zeros(capacity, dtype=bool)
+        active[:len(ids)] = np.asarray(meta["active"], dtype=bool)
+        mat = self._map(self.vec_path, capacity, "r+")
+        with self._lock:
+            self.ids, self.active, self.mat = ids, active, mat
+            self.idf = np.asarray(meta["idf"], dtype=np.float32)
+            self.row_of = {pid: i for i, pid in enumerate(ids) if pid}
+            self._version = version
+        return True
+
+    def _refresh(self) -> None:
+        if self._meta_version() != self._version:
+            self.load()
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """写入前拿排他锁并追上其他进程的修改。"""
+        with self._sync_lock, self._file_lock(True):
+            self._refresh()
+            yield
+
+    def open_or_build(self, loader: Callable[[], List[Dict[str, Any]]]) -> None:
+        """先在共享锁下加载；没有索引时拿排他锁再确认一次，只有一个进程负责构建。"""
+        with self._sync_lock:
+            with self._file_lock(False):
+                if self.load():
+                    return
+            with self._file_lock(True):
+                if not self.load():
+                    self._build(loader())
+
+    # ---------- 编码 ----------
+    def encode(self, text: str, idf: Optional[np.ndarray] = None) -> np.ndarray:
+        v = _hashed_tf(text) * (self.idf if idf is None else idf)
+        n = float(np.linalg.norm(v))
+        return v / n if n > 0 else v
+
+    # ---------- 构建 / 增量 ----------
+    def build(self, products: List[Dict[str, Any]]) -> None:
+        """全量构建：统计 IDF 后一次性写入 memmap。"""
+        with self._sync_lock, self._file_lock(True):
+            self._build(products)
+
+    def _build(self, products: List[Dict[str, Any]]) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        tfs = np.stack([_hashed_tf(product_text(p)) for p in products]) if products else np.zeros((0, DIM), np.float32)
+        df = (tfs != 0).sum(axis=0)
+        idf = np.log((1 + len(products)) / (1 + df)).astype(np.float32) + 1.0
+        tfs *= idf
+        norms = np.linalg.norm(tfs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        tfs /= norms
+
+        # 写到临时文件再替换，其他进程已映射的旧文件不会被截断
+        capacity = max(1024, 1 << math.ceil(math.log2(max(len(products), 1))))
+        tmp = self.vec_path + ".tmp"
+        mat = self._map(tmp, capacity, "w+")
+        mat[:len(products)] = tfs
+        mat.flush()
+        os.replace(tmp, self.vec_path)
+        ids = [p["product_id"] for p in products]
+        active = np.zeros(capacity, dtype=bool)
+        active[:len(products)] = [bool(p.get("is_active", 1)) for p in products]
+        with self._lock:
+            self.ids, self.active, self.mat, self.idf = ids, active, mat, idf
+            self.row_of = {pid: i for i, pid in enumerate(ids)}
+        self._save_meta()
+
+    def _grown(self, mat: np.memmap, active: np.ndarray) -> Tuple[np.memmap, np.ndarray]:
+        capacity = mat.shape[0] * 2
+        mat.flush()
+        with open(self.vec_path, "r+b") as f:
+            f.truncate(capacity * DIM * 4)
+        grown = np.zeros(capacity, dtype=bool)
+        grown[:len(active)] = active
+        return self._map(self.vec_path, capacity, "r+"), grown
+
+    def upsert(self, product: Dict[str, Any]) -> None:
+        with self._writing():
+            pid = product["product_id"]
+            ids, active, mat = self.ids, self.active.copy(), self.mat
+            row = self.row_of.get(pid)
+            if row is None:
+                if len(ids) >= mat.shape[0]:
+                    mat, active = self._grown(mat, active)
+                row = len(ids)
+                ids = ids + [pid]
+            mat[row] = self.encode(product_text(product))
+            mat.flush()
+            active[row] = bool(product.get("is_active", 1))
+            with self._lock:
+                self.ids, self.active, self.mat = ids, active, mat
+                self.row_of[pid] = row
+            self._save_meta()
+
+    def set_active(self, product_id: str, is_active: bool) -> None:
+        with self._writing():
+            row = self.row_of.get(product_id)
+            if row is not None:
+                active = self.active.copy()
+                active[row] = is_active
+                with self._lock:
+                    self.active = active
+                self._save_meta()
+
+    def remove(self, product_id: str) -> None:
+        with self._writing():
+            row = self.row_of.get(product_id)
+            if row is not None:
+                ids, active = list(self.ids), self.active.copy()
+                ids[row] = None
+                active[row] = False
+                with self._lock:
+                    self.ids, self.active = ids, active
+                    del self.row_of[product_id]
+                self.mat[row] = 0
+                self.mat.flush()
+                self._save_meta()
+
+    # ---------- 检索 ----------
+    def _snapshot(self) -> Tuple[Optional[np.memmap], List[Optional[str]], np.ndarray, np.ndarray]:
+        if self._meta_version() != self._version:
+            with self._sync_lock, self._file_lock(False):
+                self._refresh()
+        with self._lock:
+            return self.mat, self.ids, self.active, self.idf
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: List[str], k: int = 5) -> List[List[Tuple[str, float]]]:
+        """多条查询一起算：Q(d x q) 与矩阵分块相乘，每块各取 top-k 再合并。"""
+        mat, ids, active, idf = self._snapshot()
+        n = len(ids)
+        if n == 0 or not queries:
+            return [[] for _ in queries]
+        q = np.stack([self.encode(t, idf) for t in queries]).T  # (DIM, nq)
+        best_s = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_i = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, n, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, n)
+            scores = (mat[start:end] @ q).T  # (nq, rows)
+            scores[:, ~active[start:end]] = -np.inf
+            kk = min(k, end - start)
+            part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            best_s = np.concatenate([best_s, np.take_along_axis(scores, part, axis=1)], axis=1)
+            best_i = np.concatenate([best_i, part + start], axis=1)
+        order = np.argsort(-best_s, axis=1)[:, :k]
+        out = []
+        for qi in range(len(queries)):
+            hits = []
+            for j in order[qi]:
+                s = float(best_s[qi, j])
+                if s > 0:
+                    hits.append((ids[best_i[qi, j]], s))
+            out.append(hits)
+        return out
+
+
+_INDEX: Optional[ProductIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def _load_products_from_db() -> List[Dict[str, Any]]:
+    with get_read_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT product_id, title, category, description, specs_json, is_active FROM products ORDER BY id"
+            )
+            rows = cur.fetchall()
+    for r in rows:
+        r["specs"] = r.pop("specs_json", None)
+    return rows
+
+
+def get_index() -> ProductIndex:
+    """进程内单例；磁盘上没有索引时由抢到排他锁的那个进程从数据库全量构建。"""
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                idx = ProductIndex()
+                idx.open_or_build(_load_products_from_db)
+                _INDEX = idx
+    return _INDEX
+
+
+def rebuild() -> ProductIndex:
+    global _INDEX
+    idx = ProductIndex()
+    idx.build(_load_products_from_db())
+    with _INDEX_LOCK:
+        _INDEX = idx
+    return idx
+
+
+def on_product_saved(product: Dict[str, Any]) -> None:
+    """后台商品写入后调用；索引尚未加载时跳过，首次使用时会从库里构建。"""
+    if _INDEX is not None:
+        _INDEX.upsert(product)
+
+
+def on_product_toggled(product_id: str, is_active: bool) -> None:
+    if _INDEX is not None:
+        _INDEX.set_active(product_id, is_active)
+
+
+def on_product_deleted(product_id: str) -> None:
+    if _INDEX is not None:
+        _INDEX.remove(product_id)
+
+
+def _bench(n: int, queries: int, k: int) -> None:
+    """随机生成 n 行向量测 top-k 延迟（写入临时目录，不碰正式索引）。"""
+    import tempfile
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as d:
+        idx = ProductIndex(d)
+        idx._open(n, "w+")
+        for start in range(0, n, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, n)
+            block = rng.standard_normal((end - start, DIM)).astype(np.float32)
+            block /= np.linalg.norm(block, axis=1, keepdims=True)
+            idx.mat[start:end] = block
+        idx.ids = [f"P{i:08d}" for i in range(n)]
+        idx.active = np.ones(n, dtype=bool)
+        texts = [f"适合打游戏的便宜手机{i}" for i in range(queries)]
+
+        t0 = time.perf_counter()
+        for t in texts:
+            idx.search(t, k)
+        single = (time.perf_counter() - t0) / queries * 1000
+
+        t0 = time.perf_counter()
+        idx.search_batch(texts, k)
+        batch = (time.perf_counter() - t0) / queries * 1000
+        del idx.mat
+    print(f"n={n} dim={DIM} k={k}: single {single:.2f} ms/query, batch({queries}) {batch:.2f} ms/query")
+
+
+def main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="商品语义索引")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("rebuild")
+    b = sub.add_parser("bench")
+    b.add_argument("--n", type=int, nargs="+", default=[100_000, 1_000_000])
+    b.add_argument("--queries", type=int, default=32)
+    b.add_argument("--k", type=int, default=5)
+    args = ap.parse_args(argv)
+    if args.cmd == "rebuild":
+        idx = rebuild()
+        print(f"indexed {len(idx.ids)} products -> {idx.index_dir}")
+    elif args.cmd == "bench":
+        for n in args.n:
+            _bench(n, args.queries, args.k)
+    else:
+        ap.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,9 +2,14 @@
 """商品相关的工具函数"""
 
 from typing import Dict, List, Optional
-from backend.database import get_conn
-import json
+from backend.database import get_read_conn
+from backend.tools.product_index import get_index
+from backend.singleflight import single_flight, TOOL_WAIT
+from backend.rowmap import PRODUCT_TOOL
 
+# SQL 里关键词和标题都去掉了空格再匹配，所以 key 里去掉空格不改变结果
+@single_flight("search_products_by_name", key=lambda name, max_results=5: ((name or "").replace(" ", ""), max_results),
+               wait=TOOL_WAIT)
 def search_products_by_name(name: str, max_results: int = 5) -> Dict[str, any]:
     """根据商品名称模糊查询商品
     
@@ -30,7 +35,7 @@ def search_products_by_name(name: str, max_results: int = 5) -> Dict[str, any]:
     keyword = name.strip()
     
     try:
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             with conn.cursor() as cur:
                 # 使用替换空格的方式进行模糊查询，支持空格不敏感的搜索
                 # 例如：搜索"一加15"可以匹配"一加 15"、"一加   15"等
@@ -41,32 +46,7 @@ def search_products_by_name(name: str, max_results: int = 5) -> Dict[str, any]:
                 )
                 rows = cur.fetchall()
         
-        # 处理查询结果
-        products = []
-        for r in rows:
-            product = {
-                "product_id": r["product_id"],
-                "shop_id": r["shop_id"],
-                "title": r["title"],
-                "category": r["category"],
-                "price": float(r["price"]),
-                "description": r["description"] or "",
-                "image_url": r["image_url"] or "",
-                "is_active": r["is_active"] == 1
-            }
-            
-            # 处理 JSON 字段
-            try:
-                product["specs"] = json.loads(r["specs_json"]) if r.get("specs_json") else {}
-            except Exception:
-                product["specs"] = {}
-            
-            try:
-                product["carousel_images"] = json.loads(r["carousel_images"]) if isinstance(r["carousel_images"], str) else r["carousel_images"]
-            except Exception:
-                product["carousel_images"] = []
-            
-            products.append(product)
+        products = PRODUCT_TOOL.many(rows)
         
         return {
             "success": True,
@@ -80,6 +60,7 @@ def search_products_by_name(name: str, max_results: int = 5) -> Dict[str, any]:
             "products": []
         }
 
+@single_flight("get_product_detail", key=lambda product_id: product_id, wait=TOOL_WAIT)
 def get_product_detail(product_id: str) -> Dict[str, any]:
     """根据商品ID查询商品详情
     
@@ -102,7 +83,7 @@ def get_product_detail(product_id: str) -> Dict[str, any]:
         }
     
     try:
-        with get_conn() as conn:
+        with get_read_conn(product_id) as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     "SELECT product_id, shop_id, title, category, price, description, specs_json, image_url, carousel_images, detail_images, detailed_text, is_active "
@@ -118,33 +99,7 @@ def get_product_detail(product_id: str) -> Dict[str, any]:
                 "product": None
             }
         
-        product = {
-            "product_id": r["product_id"],
-            "shop_id": r["shop_id"],
-            "title": r["title"],
-            "category": r["category"],
-            "price": float(r["price"]),
-            "description": r["description"] or "",
-            "image_url": r["image_url"] or "",
-            "detailed_text": r["detailed_text"] or "",
-            "is_active": r["is_active"] == 1
-        }
-        
-        # 处理 JSON 字段
-        try:
-            product["specs"] = json.loads(r["specs_json"]) if r.get("specs_json") else {}
-        except Exception:
-            product["specs"] = {}
-        
-        try:
-            product["carousel_images"] = json.loads(r["carousel_images"]) if isinstance(r["carousel_images"], str) else r["carousel_images"]
-        except Exception:
-            product["carousel_images"] = []
-        
-        try:
-            product["detail_images"] = json.loads(r["detail_images"]) if isinstance(r["detail_images"], str) else r["detail_images"]
-        except Exception:
-            product["detail_images"] = []
+        product = PRODUCT_TOOL(r)
         
         return {
             "success": True,
@@ -157,3 +112,62 @@ def get_product_detail(product_id: str) -> Dict[str, any]:
             "message": f"查询商品详情时发生错误：{str(e)}",
             "product": None
         }
+
+
+def semantic_search_products(query: str, max_results: int = 5) -> Dict[str, any]:
+    """根据自然语言描述检索商品（本地向量索引，按相似度排序）
+
+    Args:
+        query: 用户对商品的描述，如“适合打游戏的便宜手机”
+        max_results: 返回的最大结果数
+
+    Returns:
+        格式同 search_products_by_name，每个商品额外带 score 字段
+    """
+    if not query or not query.strip():
+        return {
+            "success": False,
+            "message": "查询描述不能为空",
+            "products": []
+        }
+
+    try:
+        hits = get_index().search(query.strip(), int(max_results))
+        if not hits:
+            return {
+                "success": True,
+                "message": "未找到相关商品",
+                "products": []
+            }
+
+        ids = [pid for pid, _ in hits]
+        with get_read_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT product_id, shop_id, title, category, price, description, specs_json, is_active "
+                    "FROM products WHERE is_active=1 AND product_id IN (" + ",".join(["%s"] * len(ids)) + ")",
+                    ids
+                )
+                rows = {r["product_id"]: r for r in cur.fetchall()}
+
+        products = []
+        for pid, score in hits:
+            r = rows.get(pid)
+            if not r:
+                continue
+            product = PRODUCT_TOOL(r)
+            product.pop("is_active", None)
+            product["score"] = round(score, 4)
+            products.append(product)
+
+        return {
+            "success": True,
+            "message": f"找到 {len(products)} 个相关商品",
+            "products": products
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": f"检索商品时发生错误：{str(e)}",
+            "products": []
+        }
@@ -0,0 +1,265 @@
+# backend/transcripts.py
+"""对话记录的异步落库（write-behind）。
+
+/chat 只把本轮记录放进有界队列就返回，后台线程攒批后一次性写入：
+- mysql：chat_turns / chat_tool_calls 两张表（见 migrations/0002），executemany 多行 INSERT；
+- sqlite:<path>：本地 SQLite 文件，表结构同上；
+- jsonl:<path>：每行一条 JSON；
+- off：不落盘。
+
+队列满时调用方最多等待 TRANSCRIPT_ENQUEUE_TIMEOUT 秒（背压），仍满则丢弃并计数；
+写入失败的批次留到下一轮重试，共尝试 TRANSCRIPT_FLUSH_RETRIES 次仍失败就按轮逐条写，
+只丢真正写不进去的那几轮；字符串字段在入队时按列宽截断，单条超长数据不会拖垮整批；
+进程退出时 close() 会把队列里剩余的记录全部刷完。
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.database import get_conn
+from backend.log_pipeline import report_error
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TRANSCRIPT_SINK = os.getenv("TRANSCRIPT_SINK", "jsonl:" + os.path.join(BASE_DIR, "data", "transcripts.jsonl"))
+QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "1.0"))
+ENQUEUE_TIMEOUT = float(os.getenv("TRANSCRIPT_ENQUEUE_TIMEOUT", "0.05"))
+FLUSH_RETRIES = int(os.getenv("TRANSCRIPT_FLUSH_RETRIES", "5"))
+
+TURN_COLUMNS = [
+    "session_id", "turn_id", "user_message", "answer", "iterations",
+    "latency_ms", "prompt_tokens", "completion_tokens", "created_at",
+]
+TOOL_CALL_COLUMNS = [
+    "session_id", "turn_id", "seq", "tool", "tool_input", "observation", "latency_ms", "created_at",
+]
+
+# 字符串列的最大字符数（migrations/0002：varchar 按字符，text / mediumtext 按 utf8mb4 最坏 4 字节折算）
+COLUMN_LIMITS = {
+    "session_id": 64,
+    "turn_id": 32,
+    "tool": 64,
+    "user_message": 16000,
+    "answer": 16000,
+    "tool_input": 16000,
+    "observation": 4000000,
+}
+
+_SQLITE_DDL = [
+    "CREATE TABLE IF NOT EXISTS chat_turns (" + ", ".join(TURN_COLUMNS) + ")",
+    "CREATE TABLE IF NOT EXISTS chat_tool_calls (" + ", ".join(TOOL_CALL_COLUMNS) + ")",
+]
+
+_STOP = object()
+
+
+def _clip(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(row)
+    for k, limit in COLUMN_LIMITS.items():
+        v = out.get(k)
+        if isinstance(v, str) and len(v) > limit:
+            out[k] = v[:limit]
+    return out
+
+
+def _insert_sql(table: str, columns: List[str], mark: str) -> str:
+    return f"INSERT INTO {table}({', '.join(columns)}) VALUES({','.join([mark] * len(columns))})"
+
+
+class _MySQLSink:
+    def write(self, turns: List[Dict[str, Any]], calls: List[Dict[str, Any]]) -> None:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                # pymysql 会把 INSERT ... VALUES 的 executemany 改写成一条多行 INSERT
+                if turns:
+                    cur.executemany(_insert_sql("chat_turns", TURN_COLUMNS, "%s"),
+                                    [tuple(t.get(c) for c in TURN_COLUMNS) for t in turns])
+                if calls:
+                    cur.executemany(_insert_sql("chat_tool_calls", TOOL_CALL_COLUMNS, "%s"),
+                                    [tuple(c.get(k) for k in TOOL_CALL_COLUMNS) for c in calls])
+
+
+class _SQLiteSink:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        for ddl in _SQLITE_DDL:
+            self.conn.execute(ddl)
+        self.conn.commit()
+
+    def write(self, turns, calls) -> None:
+        with self.conn:
+            if turns:
+                self.conn.executemany(_insert_sql("chat_turns", TURN_COLUMNS, "?"),
+                                      [tuple(t.get(c) for c in TURN_COLUMNS) for t in turns])
+            if calls:
+                self.conn.executemany(_insert_sql("chat_tool_calls", TOOL_CALL_COLUMNS, "?"),
+                                      [tuple(c.get(k) for k in TOOL_CALL_COLUMNS) for c in calls])
+
+
+class _JsonlSink:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+
+    def write(self, turns, calls) -> None:
+        lines = [json.dumps({"kind": "turn", **t}, ensure_ascii=False, default=str) for t in turns]
+        lines += [json.dumps({"kind": "tool_call", **c}, ensure_ascii=False, default=str) for c in calls]
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def _make_sink(spec: str):
+    kind, _, arg = spec.partition(":")
+    if kind == "mysql":
+        return _MySQLSink()
+    if kind == "sqlite":
+        return _SQLiteSink(arg)
+    if kind == "jsonl":
+        return _JsonlSink(arg)
+    return None
+
+
+class TranscriptWriter:
+    def __init__(self, sink_spec: str = TRANSCRIPT_SINK, maxsize: int = QUEUE_SIZE):
+        self.sink = _make_sink(sink_spec)
+        self.q: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        # 写失败待重试的批次：(turns, calls, 已尝试次数)，最多 FLUSH_RETRIES 个在途
+        self._retry: List[Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.sink is None or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="transcript-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, turn: Dict[str, Any], tool_calls: List[Dict[str, Any]]) -> bool:
+        """放入一轮对话记录；队列满且等待超时后丢弃，返回是否入队成功。"""
+        if self.sink is None:
+            return False
+        self.start()
+        try:
+            self.q.put((_clip(turn), [_clip(c) for c in tool_calls]), timeout=ENQUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _loop(self) -> None:
+        stopping = False
+        while not stopping:
+            turns, calls = [], []
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(turns) < BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                turns.append(item[0])
+                calls.extend(item[1])
+            if stopping:
+                # 把 _STOP 之前已入队的剩余记录一并带走
+                while True:
+                    try:
+                        item = self.q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        turns.append(item[0])
+                        calls.extend(item[1])
+            self._flush_retries()
+            if turns:
+                self._flush(turns, calls)
+            while stopping and self._retry:
+                self._flush_retries()
+
+    def _flush_retries(self) -> None:
+        with self._lock:
+            batches, self._retry = self._retry, []
+        for turns, calls, attempts in batches:
+            self._flush(turns, calls, attempts)
+
+    def _flush(self, turns, calls, attempts: int = 0) -> None:
+        try:
+            self.sink.write(turns, calls)
+        except Exception as e:
+            attempts += 1
+            if attempts >= FLUSH_RETRIES and len(turns) > 1:
+                report_error("transcripts", "flush_failed", e, attempt=attempts, fallback="per_turn")
+                self._flush_per_turn(turns, calls)
+                return
+            with self._lock:
+                if attempts < FLUSH_RETRIES:
+                    self._retry.append((turns, calls, attempts))
+                    self.retried += 1
+                else:
+                    self.failed += len(turns)
+            if attempts < FLUSH_RETRIES:
+                report_error("transcripts", "flush_failed", e, attempt=attempts, kept_for_retry=len(turns))
+            else:
+                report_error("transcripts", "flush_gave_up", e, attempt=attempts, lost=len(turns))
+            time.sleep(FLUSH_INTERVAL)  # 下游故障时别空转重试
+            return
+        with self._lock:
+            self.written += len(turns)
+
+    def _flush_per_turn(self, turns, calls) -> None:
+        """整批重试用尽后按轮逐条写，只丢写不进去的那几轮。"""
+        by_turn: Dict[str, List[Dict[str, Any]]] = {}
+        for c in calls:
+            by_turn.setdefault(c.get("turn_id"), []).append(c)
+        for t in turns:
+            try:
+                self.sink.write([t], by_turn.get(t.get("turn_id"), []))
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                report_error("transcripts", "flush_gave_up", e, session_id=t.get("session_id"),
+                             turn_id=t.get("turn_id"), lost=1)
+                continue
+            with self._lock:
+                self.written += 1
+
+    def close(self, timeout: float = 10.0) -> None:
+        """停止后台线程并刷完队列。"""
+        with self._lock:
+            t = self._thread
+            self._thread = None
+        if t is None:
+            return
+        self.q.put(_STOP)
+        t.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "queued": self.q.qsize(),
+                "retrying": sum(len(b[0]) for b in self._retry),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "retried": self.retried,
+            }
+
+
+WRITER = TranscriptWriter()